@@ -1,5 +1,5 @@
 # app.py
-from flask import Flask, jsonify, request, g
+from flask import Flask, Response, jsonify, request, g
 from flask_cors import CORS
 from routes.bible import bible_bp
 from routes.auth import auth_bp
@@ -7,7 +7,11 @@ from routes.friends import friends_bp
 from routes.notes import notes_bp
 from routes.highlight import highlight_bp
 from routes.bookmarks_routes import bookmarks_bp
-from database import get_supabase, get_db
+from database import get_supabase, get_db, pool_status
+from utils.resilience import anthropic_status
+from utils.cache import cache_stats
+from utils.search_index import warm_search_index
+from utils import metrics, roundtrips
 from dotenv import load_dotenv
 import os
 import logging
@@ -40,7 +44,7 @@ app.json.compact = True     # Use compact JSON to reduce memory usage
 app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10MB max request/response size (reduced from 100MB)
 app.config['CORS_HEADERS'] = 'Content-Type'  # Add CORS headers configuration
 app.config['CORS_SUPPORTS_CREDENTIALS'] = True  # Enable credentials support
-app.config['CORS_EXPOSE_HEADERS'] = ['Content-Type', 'Authorization']  # Expose headers
+app.config['CORS_EXPOSE_HEADERS'] = ['Content-Type', 'Authorization', 'X-Next-Cursor', 'Link']  # Expose headers
 
 # Configure CORS to allow requests from any origin
 CORS(app, resources={
@@ -48,7 +52,7 @@ CORS(app, resources={
         "origins": "*",
         "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
         "allow_headers": ["Content-Type", "Authorization"],
-        "expose_headers": ["Content-Type", "Authorization"],
+        "expose_headers": ["Content-Type", "Authorization", "X-Next-Cursor", "Link"],
         "supports_credentials": True
     }
 })
@@ -73,6 +77,9 @@ app.register_blueprint(notes_bp, url_prefix='/api/notes')
 app.register_blueprint(highlight_bp)
 app.register_blueprint(bookmarks_bp)
 
+# Load the verse corpus for hybrid search now rather than inside the first search request
+warm_search_index()
+
 # Request timeout middleware
 def timeout_handler(seconds):
     def decorator(f):
@@ -89,12 +96,27 @@ def timeout_handler(seconds):
 def before_request():
     g.start_time = time.time()
     g.request_timeout = 150  # 2.5 minutes
+    roundtrips.begin_request()
+    g.metric_labels = metrics.request_labels(request.blueprint, request.endpoint)
+    g.metric_started = time.perf_counter()
+    metrics.REQUESTS_IN_PROGRESS.labels(g.metric_labels[0]).inc()
 
 @app.after_request
 def after_request(response):
     # Log request duration
     duration = time.time() - g.start_time
     logger.info(f"Request to {request.path} took {duration:.2f} seconds")
+
+    metrics.REQUEST_LATENCY.labels(*g.metric_labels, request.method, response.status_code) \
+        .observe(time.perf_counter() - g.metric_started)
+    g.metric_observed = True
+
+    # Database round trips made while handling the request
+    stats = roundtrips.current()
+    if stats is not None:
+        response.headers['Server-Timing'] = f'{stats.server_timing()}, app;dur={duration * 1000:.1f}'
+        response.headers['Timing-Allow-Origin'] = '*'
+        roundtrips.log_request(request.method, request.endpoint, request.path, response.status_code, stats)
     
     # Clean up memory after each request
     try:
@@ -118,13 +140,24 @@ def after_request(response):
     
     return response
 
+@app.teardown_request
+def end_request_accounting(exc):
+    roundtrips.end_request()
+    labels = g.get('metric_labels')
+    if labels is not None:
+        metrics.REQUESTS_IN_PROGRESS.labels(labels[0]).dec()
+        # Unhandled exceptions skip after_request
+        if not g.get('metric_observed'):
+            metrics.REQUEST_LATENCY.labels(*labels, request.method, 500) \
+                .observe(time.perf_counter() - g.metric_started)
+
 @app.route('/test', methods=['GET'])
 def test():
     return {'message': 'Flask server is working!'}
 
 @app.route('/health', methods=['GET'])
 def health():
-    """Health check endpoint that also verifies Supabase connection"""
+    """Health check endpoint that also verifies Supabase connection and reports Anthropic breaker and cache state"""
     try:
         # Check if Supabase is connected by making a simple query
         with get_db() as client:
@@ -134,6 +167,8 @@ def health():
         return jsonify({
             'status': 'healthy',
             'supabase': 'connected' if db_status else 'error',
+            'anthropic': anthropic_status(),
+            'caches': cache_stats(),
             'timestamp': time.time()
         })
     except Exception as e:
@@ -141,9 +176,22 @@ def health():
         return jsonify({
             'status': 'unhealthy',
             'error': str(e),
+            'anthropic': anthropic_status(),
+            'caches': cache_stats(),
             'timestamp': time.time()
         }), 500
 
+@app.route('/health/db-pool', methods=['GET'])
+def db_pool_health():
+    """SQLAlchemy connection pool occupancy for this worker"""
+    return jsonify(pool_status())
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus text exposition, aggregated across workers when PROMETHEUS_MULTIPROC_DIR is set"""
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
 if __name__ == '__main__':
     print("Starting Flask server...")
     port = int(os.getenv('PORT', 5001))
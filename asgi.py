@@ -0,0 +1,257 @@
+# asgi.py
+"""ASGI entry point for the I/O-bound read routes.
+
+Under gunicorn's sync workers every slow Anthropic or database call holds a
+request thread. The routes here serve the same URLs and responses as the
+Flask app but await their I/O, so one process can hold hundreds of slow
+requests open at once:
+
+    GET /api/bible/verses/<book>/<chapter>
+    GET /api/bible/ai-search?q=...
+    GET /api/notes/chapter/<book>/<chapter>/notes
+    GET /api/friends/friends
+    GET /api/friends/friends/requests
+
+Database reads go through utils.dal on the shared asyncpg loop and AI search
+uses the async Anthropic client behind the same limiter, breaker and request
+coalescing as the sync app. Run it next to gunicorn and route these paths to
+it at the proxy:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5002
+"""
+import asyncio
+import logging
+import math
+import os
+import sys
+import time
+from functools import wraps
+
+import anthropic
+import jwt
+from dotenv import load_dotenv
+from quart import Quart, Response, g, jsonify, request
+from quart_cors import cors
+
+from database import close_pg_pool, run_pg_async
+from utils import dal, metrics, roundtrips
+from utils.auth import SigningKeysUnavailable, authenticate
+from utils.resilience import (
+    CircuitOpenError,
+    RateLimitExceeded,
+    anthropic_status,
+    guarded_anthropic_call_async,
+)
+from utils.singleflight import coalesce_async, normalize_text, request_key
+from routes.bible import AI_SEARCH_MODEL, AI_SEARCH_TIMEOUT, ai_search_prompt, format_verses, parse_reference
+from routes.friends import format_friend_requests, format_friends
+from routes.notes import format_chapter_notes
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+app = Quart(__name__)
+app = cors(
+    app,
+    allow_origin="*",
+    allow_methods=["GET", "OPTIONS"],
+    allow_headers=["Content-Type", "Authorization"],
+    expose_headers=["Content-Type", "Authorization"],
+)
+app.url_map.strict_slashes = False
+
+_anthropic_client = None
+
+
+@app.before_request
+async def begin_request_accounting():
+    roundtrips.begin_request()
+    g.metric_labels = metrics.request_labels(request.blueprint, request.endpoint)
+    g.metric_started = time.perf_counter()
+    metrics.REQUESTS_IN_PROGRESS.labels(g.metric_labels[0]).inc()
+
+
+@app.teardown_request
+async def end_request_accounting(exc):
+    labels = g.get('metric_labels')
+    if labels is not None:
+        metrics.REQUESTS_IN_PROGRESS.labels(labels[0]).dec()
+        if not g.get('metric_observed'):
+            metrics.REQUEST_LATENCY.labels(*labels, request.method, 500) \
+                .observe(time.perf_counter() - g.metric_started)
+
+
+@app.after_request
+async def add_server_timing(response):
+    metrics.REQUEST_LATENCY.labels(*g.metric_labels, request.method, response.status_code) \
+        .observe(time.perf_counter() - g.metric_started)
+    g.metric_observed = True
+    stats = roundtrips.end_request()
+    if stats is not None:
+        response.headers['Server-Timing'] = stats.server_timing()
+        response.headers['Timing-Allow-Origin'] = '*'
+        roundtrips.log_request(request.method, request.endpoint, request.path, response.status_code, stats)
+    return response
+
+
+def _get_anthropic_client():
+    global _anthropic_client
+    if _anthropic_client is None:
+        # Retries are left to the shared limiter/breaker rather than the SDK's own backoff
+        _anthropic_client = anthropic.AsyncAnthropic(
+            api_key=os.getenv("ANTHROPIC_API_KEY"), max_retries=0, timeout=AI_SEARCH_TIMEOUT)
+    return _anthropic_client
+
+
+def token_required(view):
+    """Async counterpart of utils.auth.token_required (no remote revocation check)"""
+    @wraps(view)
+    async def decorated(*args, **kwargs):
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not token.strip():
+            return jsonify({'error': 'Token is required'}), 401
+
+        try:
+            # A cache miss on an RS256/ES256 token may fetch the JWKS; keep that off the loop
+            current_user = await asyncio.to_thread(authenticate, token.strip())
+        except jwt.ExpiredSignatureError:
+            return jsonify({'error': 'Token has expired'}), 401
+        except jwt.InvalidTokenError as e:
+            logger.debug(f"Rejected token for {request.path}: {e}")
+            return jsonify({'error': 'Invalid token'}), 401
+        except SigningKeysUnavailable as e:
+            logger.error(f"Token verification unavailable: {e}")
+            return jsonify({'error': 'Authentication is temporarily unavailable'}), 503
+        except Exception as e:
+            logger.error(f"An unexpected error occurred during token verification: {e}")
+            return jsonify({'error': 'Token processing error'}), 500
+
+        return await view(current_user, *args, **kwargs)
+
+    return decorated
+
+
+@app.route('/api/bible/verses/<book>/<int:chapter>', methods=['GET'])
+async def get_verses(book, chapter):
+    try:
+        verses = await run_pg_async(dal.fetch_verses_by_chapter(book, chapter))
+        if not verses:
+            return jsonify({"error": "Chapter not found"}), 404
+        return jsonify(format_verses(verses))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/bible/ai-search', methods=['GET'])
+@token_required
+async def ai_search_bible(current_user):
+    query_str = request.args.get('q', '')
+    if not query_str:
+        return jsonify([])
+
+    try:
+        if not os.getenv("ANTHROPIC_API_KEY"):
+            logger.error("Anthropic API key not found in environment variables.")
+            return jsonify({"error": "AI search configuration error."}), 500
+
+        prompt = ai_search_prompt(query_str)
+
+        async def resolve_reference():
+            message = await guarded_anthropic_call_async(lambda: _get_anthropic_client().messages.create(
+                model=AI_SEARCH_MODEL,
+                max_tokens=100,
+                temperature=0.0,
+                messages=[{"role": "user", "content": prompt}]
+            ))
+            return message.content[0].text
+
+        llm_response_text = await coalesce_async(
+            request_key("ai-search", AI_SEARCH_MODEL, normalize_text(query_str)),
+            resolve_reference
+        )
+
+        try:
+            book, chapter = parse_reference(llm_response_text)
+            if not book or not chapter:
+                return jsonify({"message": "Could not identify a specific Bible reference for your query.", "type": "info"}), 200
+        except (ValueError, IndexError, AttributeError) as parse_err:
+            logger.error(f"Failed to parse LLM response: {llm_response_text}. Error: {parse_err}")
+            return jsonify({"error": "Failed to process AI response."}), 500
+
+        try:
+            verses = await run_pg_async(dal.fetch_verses_by_chapter(book, chapter))
+            if not verses:
+                return jsonify({"message": f"AI suggested {book} {chapter}, but no verses were found.", "type": "warning"}), 200
+            return jsonify(format_verses(verses, ai_suggestion=True))
+        except Exception as db_err:
+            logger.error(f"Database error fetching verses for {book} {chapter}: {db_err}", exc_info=True)
+            return jsonify({"error": "Failed to retrieve verses from database."}), 500
+
+    except (CircuitOpenError, RateLimitExceeded) as busy_err:
+        logger.warning(f"AI search rejected locally: {busy_err}")
+        response = jsonify({'error': 'AI search is temporarily unavailable. Please try again shortly.'})
+        response.headers['Retry-After'] = str(int(math.ceil(busy_err.retry_after or 1)))
+        return response, 503
+    except anthropic.APIError as api_err:
+        logger.error(f"Anthropic API error: {api_err}", exc_info=True)
+        return jsonify({'error': 'AI service communication error.'}), 500
+    except Exception as e:
+        logger.error(f"AI Search error: {str(e)}", exc_info=True)
+        return jsonify({'error': 'An error occurred during AI search.'}), 500
+
+
+@app.route('/api/notes/chapter/<book>/<int:chapter>/notes', methods=['GET'])
+@token_required
+async def get_chapter_notes(current_user, book, chapter):
+    try:
+        notes = await run_pg_async(dal.fetch_notes_by_chapter(current_user.id, book, chapter))
+        return jsonify(format_chapter_notes(notes))
+    except Exception as e:
+        logger.error(f"Error fetching chapter notes: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/friends/friends', methods=['GET'])
+@token_required
+async def get_friends(current_user):
+    try:
+        friendships = await run_pg_async(dal.fetch_friendships(current_user.id))
+        return jsonify(format_friends(friendships))
+    except Exception as e:
+        logger.error(f"Error fetching friends: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/friends/friends/requests', methods=['GET'])
+@token_required
+async def get_friend_requests(current_user):
+    try:
+        requests = await run_pg_async(dal.fetch_pending_friend_requests(current_user.id))
+        return jsonify(format_friend_requests(requests))
+    except Exception as e:
+        logger.error(f"Error fetching friend requests: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/health', methods=['GET'])
+async def health_check():
+    return jsonify({'status': 'healthy', 'anthropic': anthropic_status()})
+
+
+@app.route('/metrics', methods=['GET'])
+async def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+
+@app.after_serving
+async def shutdown():
+    if _anthropic_client is not None:
+        await _anthropic_client.close()
+    await run_pg_async(close_pg_pool())
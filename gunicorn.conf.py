@@ -15,7 +15,7 @@ bind = f"0.0.0.0:{port}"
 
 # Reduce workers and threads to minimize memory usage
 workers = 1  # Use a single worker to minimize memory usage
-threads = 2  # Reduce threads to minimize memory usage
+threads = int(os.getenv('GUNICORN_THREADS', 2))  # Reduce threads to minimize memory usage; database.py sizes its pool from this
 
 # Log configuration on startup
 def on_starting(server):
@@ -25,6 +25,20 @@ def on_starting(server):
     logger.info(f"Starting gunicorn with {workers} workers on port {port}")
     logger.info(f"Worker timeout set to 180 seconds")
 
+    # Samples left over from a previous run would be aggregated into /metrics
+    multiproc_dir = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if multiproc_dir:
+        os.makedirs(multiproc_dir, exist_ok=True)
+        for name in os.listdir(multiproc_dir):
+            if name.endswith('.db'):
+                os.remove(os.path.join(multiproc_dir, name))
+
+def child_exit(server, worker):
+    # Drop the dead worker's live gauges (e.g. requests in progress) from /metrics
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
 # Extended timeouts for Railway
 timeout = 180  # 3 minutes timeout for slow operations
 keepalive = 120  # Keep connections alive for 2 minutes
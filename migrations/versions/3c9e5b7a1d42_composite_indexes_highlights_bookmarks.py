@@ -0,0 +1,56 @@
+"""composite indexes for highlights and bookmarks
+
+Revision ID: 3c9e5b7a1d42
+Revises: aaf5327e9ca5
+Create Date: 2026-10-19 10:12:31.508214
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c9e5b7a1d42'
+down_revision: Union[str, None] = 'aaf5327e9ca5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # The routes always filter on (user_id, book, chapter[, verse]); one composite index
+    # answers those directly, where the single-column ones left the planner to combine
+    # bitmaps or filter a whole user's rows.
+    op.create_index('ix_highlights_user_book_chapter_verse', 'highlights',
+                    ['user_id', 'book', 'chapter', 'verse', 'start_offset'], unique=False)
+    op.create_index('ix_bookmarks_user_book_chapter_verse', 'bookmarks',
+                    ['user_id', 'book', 'chapter', 'verse'], unique=False)
+    op.create_index('ix_bookmarks_user_created_at', 'bookmarks',
+                    ['user_id', sa.text('created_at DESC'), sa.text('id DESC')], unique=False)
+
+    # user_id is the leading column of the composites; book, chapter and verse are never
+    # queried on their own
+    op.drop_index(op.f('ix_highlights_user_id'), table_name='highlights')
+    op.drop_index(op.f('ix_highlights_book'), table_name='highlights')
+    op.drop_index(op.f('ix_highlights_chapter'), table_name='highlights')
+    op.drop_index(op.f('ix_highlights_verse'), table_name='highlights')
+    op.drop_index(op.f('ix_bookmarks_user_id'), table_name='bookmarks')
+    op.drop_index(op.f('ix_bookmarks_book'), table_name='bookmarks')
+    op.drop_index(op.f('ix_bookmarks_chapter'), table_name='bookmarks')
+    op.drop_index(op.f('ix_bookmarks_verse'), table_name='bookmarks')
+
+
+def downgrade() -> None:
+    op.create_index(op.f('ix_bookmarks_verse'), 'bookmarks', ['verse'], unique=False)
+    op.create_index(op.f('ix_bookmarks_chapter'), 'bookmarks', ['chapter'], unique=False)
+    op.create_index(op.f('ix_bookmarks_book'), 'bookmarks', ['book'], unique=False)
+    op.create_index(op.f('ix_bookmarks_user_id'), 'bookmarks', ['user_id'], unique=False)
+    op.create_index(op.f('ix_highlights_verse'), 'highlights', ['verse'], unique=False)
+    op.create_index(op.f('ix_highlights_chapter'), 'highlights', ['chapter'], unique=False)
+    op.create_index(op.f('ix_highlights_book'), 'highlights', ['book'], unique=False)
+    op.create_index(op.f('ix_highlights_user_id'), 'highlights', ['user_id'], unique=False)
+
+    op.drop_index('ix_bookmarks_user_created_at', table_name='bookmarks')
+    op.drop_index('ix_bookmarks_user_book_chapter_verse', table_name='bookmarks')
+    op.drop_index('ix_highlights_user_book_chapter_verse', table_name='highlights')
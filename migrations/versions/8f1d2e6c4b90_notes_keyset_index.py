@@ -0,0 +1,32 @@
+"""notes keyset index for paginated listing
+
+Revision ID: 8f1d2e6c4b90
+Revises: 3c9e5b7a1d42
+Create Date: 2026-10-19 11:40:07.219356
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8f1d2e6c4b90'
+down_revision: Union[str, None] = '3c9e5b7a1d42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # notes predates these migrations and has no model, so the index is created
+    # idempotently in plain SQL. GET /notes pages through a user's notes by
+    # (created_at, id), newest first.
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_notes_user_created_at "
+        "ON notes (user_id, created_at DESC, id DESC)"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_notes_user_created_at")
@@ -0,0 +1,43 @@
+"""one bookmark per user and verse
+
+Revision ID: b47e0a93c6d1
+Revises: 8f1d2e6c4b90
+Create Date: 2026-10-19 13:05:52.830117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b47e0a93c6d1'
+down_revision: Union[str, None] = '8f1d2e6c4b90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # create_bookmark only checked before inserting, so concurrent requests could
+    # store the same verse twice; keep the oldest bookmark of each duplicate set
+    op.execute(
+        """
+        DELETE FROM bookmarks b
+        USING bookmarks older
+        WHERE b.user_id = older.user_id
+          AND b.book = older.book
+          AND b.chapter = older.chapter
+          AND b.verse = older.verse
+          AND b.id > older.id
+        """
+    )
+    # The unique constraint's index replaces the plain composite one
+    op.drop_index('ix_bookmarks_user_book_chapter_verse', table_name='bookmarks')
+    op.create_unique_constraint('uq_bookmarks_user_verse', 'bookmarks', ['user_id', 'book', 'chapter', 'verse'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_bookmarks_user_verse', 'bookmarks', type_='unique')
+    op.create_index('ix_bookmarks_user_book_chapter_verse', 'bookmarks',
+                    ['user_id', 'book', 'chapter', 'verse'], unique=False)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, func, Text
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index, UniqueConstraint, func, Text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from database import Base # Assuming Base is in a 'database.py' at the root of 'backend'
@@ -7,11 +7,11 @@ class Bookmark(Base):
     __tablename__ = 'bookmarks'
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(UUID(as_uuid=True), ForeignKey('users.id'), nullable=False, index=True)
+    user_id = Column(UUID(as_uuid=True), ForeignKey('users.id'), nullable=False)
     
-    book = Column(String(100), nullable=False, index=True) # E.g., "Genesis", "Revelation"
-    chapter = Column(Integer, nullable=False, index=True)  # E.g., 1, 23
-    verse = Column(Integer, nullable=False, index=True)    # E.g., 1, 15
+    book = Column(String(100), nullable=False) # E.g., "Genesis", "Revelation"
+    chapter = Column(Integer, nullable=False)  # E.g., 1, 23
+    verse = Column(Integer, nullable=False)    # E.g., 1, 15
 
     text_preview = Column(String(255), nullable=True) # Store a short preview of the verse
     notes = Column(Text, nullable=True) # Optional user notes for the bookmark
@@ -22,5 +22,12 @@ class Bookmark(Base):
     # Relationship to User
     user = relationship("User", back_populates="bookmarks")
 
+    __table_args__ = (
+        # One bookmark per user and verse; inserts use ON CONFLICT against it
+        UniqueConstraint(user_id, book, chapter, verse, name='uq_bookmarks_user_verse'),
+        # Listing a user's bookmarks newest first
+        Index('ix_bookmarks_user_created_at', user_id, created_at.desc(), id.desc()),
+    )
+
     def __repr__(self):
         return f'<Bookmark {self.id} User: {self.user_id} - {self.book} {self.chapter}:{self.verse}>' 
\ No newline at end of file
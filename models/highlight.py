@@ -1,5 +1,5 @@
 # backend/models/highlight.py
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, func
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index, func
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from database import Base
@@ -8,10 +8,10 @@ class Highlight(Base):
     __tablename__ = 'highlights'
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(UUID(as_uuid=True), ForeignKey('users.id'), nullable=False, index=True)
-    book = Column(String, nullable=False, index=True)
-    chapter = Column(Integer, nullable=False, index=True)
-    verse = Column(Integer, nullable=False, index=True)
+    user_id = Column(UUID(as_uuid=True), ForeignKey('users.id'), nullable=False)
+    book = Column(String, nullable=False)
+    chapter = Column(Integer, nullable=False)
+    verse = Column(Integer, nullable=False)
     start_offset = Column(Integer, nullable=False)
     end_offset = Column(Integer, nullable=False)
     color = Column(String, nullable=False, default='#FFFF00') # Default yellow
@@ -20,5 +20,10 @@ class Highlight(Base):
 
     user = relationship("User", back_populates="highlights") # Add back_populates
 
+    # Every query filters on (user_id, book, chapter[, verse]) and orders by verse, start_offset
+    __table_args__ = (
+        Index('ix_highlights_user_book_chapter_verse', user_id, book, chapter, verse, start_offset),
+    )
+
     def __repr__(self):
         return f'<Highlight {self.user_id} {self.book} {self.chapter}:{self.verse} [{self.start_offset}-{self.end_offset}] {self.color}>' 
\ No newline at end of file
@@ -6,37 +6,15 @@ from datetime import datetime, timedelta
 from functools import wraps
 import os
 from database import get_db
+from utils.auth import token_required
+from utils.user_cache import get_user_profile, invalidate_user_profile, store_user_profile
+from utils.entitlements import set_premium
 import logging
 import time
 
 auth_bp = Blueprint('auth', __name__)
 logger = logging.getLogger(__name__)
 
-def token_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        token = None
-        if 'Authorization' in request.headers:
-            auth_header = request.headers['Authorization']
-            if auth_header.startswith('Bearer '):
-                token = auth_header.split(' ')[1]
-
-        if not token:
-            return jsonify({'message': 'Token is missing!'}), 401
-
-        try:
-            with get_db() as client:
-                # Verify the JWT token with Supabase
-                user = client.auth.get_user(token)
-                if not user:
-                    return jsonify({'message': 'Invalid token!'}), 401
-                return f(user, *args, **kwargs)
-        except Exception as e:
-            logger.error(f"Token validation error: {str(e)}")
-            return jsonify({'message': 'Invalid token!'}), 401
-
-    return decorated
-
 @auth_bp.route('/register', methods=['POST'])
 def register():
     try:
@@ -90,6 +68,7 @@ def register():
             
             if not response.data:
                 return jsonify({'error': 'Failed to create user profile'}), 500
+            store_user_profile(response.data[0])
 
             return jsonify({
                 'message': 'Registration successful! Please check your email to confirm your account.',
@@ -127,8 +106,7 @@ def login():
                     return jsonify({'error': 'Invalid credentials'}), 401
 
                 # Get user profile
-                response = client.table('users').select('*').eq('id', auth_response.user.id).execute()
-                user = response.data[0] if response.data else None
+                user = get_user_profile(auth_response.user.id)
 
                 if not user:
                     return jsonify({'error': 'User profile not found'}), 404
@@ -162,27 +140,25 @@ def login():
 @token_required
 def get_profile(current_user):
     try:
-        with get_db() as client:
-            response = client.table('users').select('*').eq('id', current_user.id).execute()
-            user = response.data[0] if response.data else None
+        user = get_user_profile(current_user.id)
 
-            if not user:
-                return jsonify({'error': 'User not found'}), 404
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
 
-            return jsonify({
-                'id': user['id'],
-                'email': user['email'],
-                'username': user['username'],
-                'created_at': user['created_at'],
-                'updated_at': user['updated_at']
-            })
+        return jsonify({
+            'id': user['id'],
+            'email': user['email'],
+            'username': user['username'],
+            'created_at': user['created_at'],
+            'updated_at': user['updated_at']
+        })
 
     except Exception as e:
         logger.error(f"Profile fetch error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @auth_bp.route('/profile', methods=['PUT'])
-@token_required
+@token_required(remote_check=True)
 def update_profile(current_user):
     try:
         data = request.get_json()
@@ -197,8 +173,11 @@ def update_profile(current_user):
                 'updated_at': datetime.utcnow().isoformat()
             }).eq('id', current_user.id).execute()
 
+            # Write-through: drop the stale entry and cache the row the update returned
+            invalidate_user_profile(current_user.id, current_user.email)
             if not response.data:
                 return jsonify({'error': 'Failed to update profile'}), 500
+            store_user_profile(response.data[0])
 
             return jsonify({
                 'message': 'Profile updated successfully',
@@ -214,105 +193,144 @@ def update_profile(current_user):
         return jsonify({'error': str(e)}), 500
 
 @auth_bp.route('/premium', methods=['POST'])
-@token_required
+@token_required(remote_check=True)
 def upgrade_to_premium(current_user):
-    current_user.is_premium = True
-    current_user.save()
-    return jsonify({'message': 'Upgraded to premium successfully', 'user': current_user.to_json()})
+    try:
+        user = set_premium(current_user.id, True)
+        return jsonify({'message': 'Upgraded to premium successfully', 'user': {
+            'id': user['id'],
+            'email': user['email'],
+            'username': user['username'],
+            'is_premium': user['is_premium']
+        }})
+    except LookupError:
+        return jsonify({'error': 'User not found'}), 404
+    except Exception as e:
+        logger.error(f"Premium upgrade error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
 
 @auth_bp.route('/premium/cancel', methods=['POST'])
-@token_required
+@token_required(remote_check=True)
 def cancel_premium(current_user):
-    current_user.is_premium = False
-    current_user.save()
-    return jsonify({'message': 'Premium subscription cancelled', 'user': current_user.to_json()})
+    try:
+        user = set_premium(current_user.id, False)
+        return jsonify({'message': 'Premium subscription cancelled', 'user': {
+            'id': user['id'],
+            'email': user['email'],
+            'username': user['username'],
+            'is_premium': user['is_premium']
+        }})
+    except LookupError:
+        return jsonify({'error': 'User not found'}), 404
+    except Exception as e:
+        logger.error(f"Premium cancellation error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
 
 @auth_bp.route('/logout', methods=['POST'])
 @token_required
 def logout(current_user):
-    current_user.online = False
-    current_user.save()
-    return jsonify({'message': 'Logged out successfully'})
+    try:
+        with get_db() as client:
+            client.table('users').update({
+                'online': False,
+                'updated_at': datetime.utcnow().isoformat()
+            }).eq('id', current_user.id).execute()
+        invalidate_user_profile(current_user.id, current_user.email)
+        return jsonify({'message': 'Logged out successfully'})
+    except Exception as e:
+        logger.error(f"Logout error: {str(e)}")
+        return jsonify({'message': 'Failed to log out'}), 500
 
 @auth_bp.route('/delete-account', methods=['DELETE'])
-@token_required
+@token_required(remote_check=True)
 def delete_account(current_user):
     try:
-        # Remove this user from all other users' friends lists
-        AuthUser.objects(friends=current_user.id).update(
-            pull__friends=current_user.id
-        )
-        
-        # Delete the user's account
-        current_user.delete()
-        
+        with get_db() as client:
+            # Remove this user from all other users' friends lists
+            client.table('friendships').delete().or_(
+                f'user1_id.eq.{current_user.id},user2_id.eq.{current_user.id}'
+            ).execute()
+
+            # Delete the user's profile, then their login
+            client.table('users').delete().eq('id', current_user.id).execute()
+            client.auth.admin.delete_user(current_user.id)
+
+        invalidate_user_profile(current_user.id, current_user.email)
         return jsonify({'message': 'Account deleted successfully'})
     except Exception as e:
-        print(f"Error deleting account: {str(e)}")
+        logger.error(f"Error deleting account: {str(e)}")
         return jsonify({'message': 'Failed to delete account'}), 500
 
 @auth_bp.route('/settings/notes', methods=['POST'])
 @token_required
 def update_note_settings(current_user):
     try:
-        data = request.get_json()
-        
+        data = request.get_json() or {}
+
         # Update the user's note privacy settings
-        current_user.can_view_friend_notes = data.get('can_view_friend_notes', True)
-        current_user.share_notes_with_friends = data.get('share_notes_with_friends', True)
-        current_user.save()
-        
+        with get_db() as client:
+            response = client.table('users').update({
+                'can_view_friend_notes': data.get('can_view_friend_notes', True),
+                'share_notes_with_friends': data.get('share_notes_with_friends', True),
+                'updated_at': datetime.utcnow().isoformat()
+            }).eq('id', current_user.id).execute()
+
+        invalidate_user_profile(current_user.id, current_user.email)
+        if not response.data:
+            return jsonify({'message': 'User not found'}), 404
+        user = response.data[0]
+        store_user_profile(user)
+
         return jsonify({
-            'id': str(current_user.id),
-            'username': current_user.username,
-            'email': current_user.email,
-            'is_premium': current_user.is_premium,
-            'can_view_friend_notes': current_user.can_view_friend_notes,
-            'share_notes_with_friends': current_user.share_notes_with_friends
+            'id': str(user['id']),
+            'username': user['username'],
+            'email': user['email'],
+            'is_premium': user.get('is_premium', False),
+            'can_view_friend_notes': user['can_view_friend_notes'],
+            'share_notes_with_friends': user['share_notes_with_friends']
         })
     except Exception as e:
-        print(f"Error updating note settings: {str(e)}")
+        logger.error(f"Error updating note settings: {str(e)}")
         return jsonify({'message': 'Failed to update note settings'}), 500
 
+# Keys of users.ai_preferences a client may set
+AI_PREFERENCE_FIELDS = (
+    'model_temperature', 'response_length', 'writing_style', 'preferred_topics',
+    'challenge_level', 'depth_level', 'time_orientation', 'user_context',
+)
+
 @auth_bp.route('/settings/ai', methods=['POST'])
 @token_required
 def update_ai_preferences(current_user):
     try:
-        data = request.get_json()
-        
-        # Update AI preferences if provided
-        if 'model_temperature' in data:
-            current_user.ai_preferences.model_temperature = data['model_temperature']
-            
-        if 'response_length' in data:
-            current_user.ai_preferences.response_length = data['response_length']
-            
-        if 'writing_style' in data:
-            current_user.ai_preferences.writing_style = data['writing_style']
-            
-        if 'preferred_topics' in data:
-            current_user.ai_preferences.preferred_topics = data['preferred_topics']
-            
-        if 'challenge_level' in data:
-            current_user.ai_preferences.challenge_level = data['challenge_level']
-            
-        if 'depth_level' in data:
-            current_user.ai_preferences.depth_level = data['depth_level']
-            
-        if 'time_orientation' in data:
-            current_user.ai_preferences.time_orientation = data['time_orientation']
-            
-        if 'user_context' in data:
-            current_user.ai_preferences.user_context = data['user_context']
-            
-        current_user.save()
-        
+        data = request.get_json() or {}
+
+        with get_db() as client:
+            # Read the stored preferences from the database, not the cache, so a
+            # change made through another worker is not overwritten
+            current = client.table('users').select('ai_preferences').eq('id', current_user.id).execute()
+            if not current.data:
+                return jsonify({'message': 'User not found'}), 404
+
+            # Update AI preferences if provided
+            ai_preferences = dict(current.data[0].get('ai_preferences') or {})
+            ai_preferences.update({field: data[field] for field in AI_PREFERENCE_FIELDS if field in data})
+
+            response = client.table('users').update({
+                'ai_preferences': ai_preferences,
+                'updated_at': datetime.utcnow().isoformat()
+            }).eq('id', current_user.id).execute()
+
+        invalidate_user_profile(current_user.id, current_user.email)
+        if response.data:
+            store_user_profile(response.data[0])
+
         return jsonify({
             'message': 'AI preferences updated successfully',
-            'ai_preferences': current_user.ai_preferences.to_json()
+            'ai_preferences': ai_preferences
         })
     except Exception as e:
-        print(f"Error updating AI preferences: {str(e)}")
+        logger.error(f"Error updating AI preferences: {str(e)}")
         return jsonify({'message': 'Failed to update AI preferences'}), 500
 
 @auth_bp.route('/resend-confirmation', methods=['POST'])
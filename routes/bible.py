@@ -5,10 +5,13 @@ import sys
 import traceback
 import os
 import json
+import math
 import anthropic
-# from utils.auth import token_required # Remove this import
-from .auth import token_required # Import from sibling auth module
-from database import get_db, get_pg_conn
+from utils.auth import token_required
+from database import get_db
+from utils import dal
+from utils.singleflight import coalesce, request_key, normalize_text
+from utils.resilience import CircuitOpenError, RateLimitExceeded, guarded_anthropic_call
 import asyncio
 
 bible_bp = Blueprint('bible', __name__)
@@ -21,6 +24,39 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+AI_SEARCH_MODEL = "claude-3-haiku-20240307"
+AI_SEARCH_TIMEOUT = 20  # seconds; the reference lookup is a 100-token reply
+
+def ai_search_prompt(query_str):
+    """Prompt asking the model to resolve a free-text query to one book and chapter"""
+    return f"""Analyze the following query and identify the specific Bible book and chapter it refers to. 
+        Query: "{query_str}"
+        
+        Respond ONLY with a JSON object containing the book name (full name, e.g., '1 Corinthians') and the chapter number. Use the key "book" for the book name and "chapter" for the chapter number (as an integer).
+        Example format: {{"book": "John", "chapter": 4}}
+        
+        If the query does not clearly refer to a specific Bible passage or is too ambiguous, respond with: {{"book": null, "chapter": null}}
+        """
+
+def parse_reference(llm_response_text):
+    """(book, chapter) from the model's reply; raises ValueError/IndexError/AttributeError if malformed"""
+    # The response might be wrapped in ```json ... ```, try to extract if needed
+    if llm_response_text.strip().startswith('```json'):
+        llm_response_text = llm_response_text.split('```json')[1].split('```')[0].strip()
+    llm_data = json.loads(llm_response_text)
+    return llm_data.get('book'), llm_data.get('chapter')
+
+def format_verses(verses, **extra):
+    """bible_verses rows in the shape the frontend expects"""
+    return [{
+        "id": verse['id'],
+        "book": verse['book_name'],
+        "chapter": verse['chapter'],
+        "verse": verse['verse'],
+        "text": verse['text'],
+        **extra
+    } for verse in verses]
+
 @bible_bp.route('/books', methods=['GET'])
 def get_books():
     try:
@@ -50,7 +86,7 @@ def get_books():
         
         # First try a quick check to confirm database connectivity
         try:
-            with get_db() as client:
+            with get_db(read_only=True) as client:
                 response = client.table('bible_verses').select('book_name').limit(1).execute()
                 if response.data:
                     logger.info("Database connection check: found sample records")
@@ -68,7 +104,7 @@ def get_books():
             logger.info(f"Supabase connection status check")
             
             # Get unique book names
-            with get_db() as client:
+            with get_db(read_only=True) as client:
                 response = client.table('bible_verses').select('book_name').execute()
                 books = list(set(item['book_name'] for item in response.data))
             
@@ -78,7 +114,7 @@ def get_books():
                 logger.warning("No books found in database")
                 # Try to get a count of all documents to check if any data exists
                 try:
-                    with get_db() as client:
+                    with get_db(read_only=True) as client:
                         response = client.table('bible_verses').select('id', count='exact').execute()
                         count = response.count
                     logger.info(f"Total documents in collection: {count}")
@@ -110,7 +146,7 @@ def get_books():
 def get_chapters(book):
     try:
         # Get unique chapter numbers for the given book
-        with get_db() as client:
+        with get_db(read_only=True) as client:
             response = client.table('bible_verses').select('chapter').eq('book_name', book).execute()
             chapters = list(set(item['chapter'] for item in response.data))
             
@@ -125,20 +161,12 @@ def get_chapters(book):
 def get_verses(book, chapter):
     try:
         # Get all verses for the given book and chapter
-        with get_db() as client:
-            response = client.table('bible_verses').select('*').eq('book_name', book).eq('chapter', chapter).order('verse').execute()
-            verses = response.data
-            
+        verses = dal.verses_by_chapter(book, chapter)
+
         if not verses:
             return jsonify({"error": "Chapter not found"}), 404
             
-        return jsonify([{
-            "id": verse['id'],
-            "book": verse['book_name'],
-            "chapter": verse['chapter'],
-            "verse": verse['verse'],
-            "text": verse['text']
-        } for verse in verses])
+        return jsonify(format_verses(verses))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -154,7 +182,7 @@ def search_bible(current_user):
         # Simple word matching: split query and filter by each word
         words = [word for word in query_str.split() if word] # Basic split, could add stopword filtering
         
-        with get_db() as client:
+        with get_db(read_only=True) as client:
             # Start the query
             supabase_query = client.table('bible_verses').select('*')
             
@@ -178,6 +206,39 @@ def search_bible(current_user):
         logger.error(f"Search error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@bible_bp.route('/hybrid-search', methods=['GET'])
+@token_required
+def hybrid_search_bible(current_user):
+    """Verse-level search fusing BM25 keyword ranking with embedding similarity (no LLM call)"""
+    query_str = request.args.get('q', '')
+    if not query_str.strip():
+        return jsonify([])
+
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+
+    try:
+        # Imported lazily so the numpy index is only built by workers that serve search
+        from utils.search_index import get_search_index
+        results = get_search_index().search(query_str, limit=limit)
+
+        return jsonify([{
+            "id": verse['id'],
+            "book": verse['book_name'],
+            "chapter": verse['chapter'],
+            "verse": verse['verse'],
+            "text": verse['text'],
+            "score": verse['score'],
+            "lexical_rank": verse['lexical_rank'],
+            "semantic_rank": verse['semantic_rank']
+        } for verse in results])
+
+    except Exception as e:
+        logger.error(f"Hybrid search error: {str(e)}", exc_info=True)
+        return jsonify({'error': 'An error occurred during search.'}), 500
+
 @bible_bp.route('/ai-search', methods=['GET'])
 @token_required
 def ai_search_bible(current_user):
@@ -194,44 +255,38 @@ def ai_search_bible(current_user):
             logger.error("Anthropic API key not found in environment variables.")
             return jsonify({"error": "AI search configuration error."}), 500
 
-        client = anthropic.Anthropic(api_key=api_key)
-        
-        # Define the prompt for the LLM
-        prompt = f"""Analyze the following query and identify the specific Bible book and chapter it refers to. 
-        Query: "{query_str}"
+        # Retries are left to the shared limiter/breaker rather than the SDK's own backoff
+        client = anthropic.Anthropic(api_key=api_key, max_retries=0, timeout=AI_SEARCH_TIMEOUT)
         
-        Respond ONLY with a JSON object containing the book name (full name, e.g., '1 Corinthians') and the chapter number. Use the key "book" for the book name and "chapter" for the chapter number (as an integer).
-        Example format: {{"book": "John", "chapter": 4}}
-        
-        If the query does not clearly refer to a specific Bible passage or is too ambiguous, respond with: {{"book": null, "chapter": null}}
-        """
+        prompt = ai_search_prompt(query_str)
         
         logger.info(f"Sending prompt to Anthropic for query: '{query_str}'")
         
-        message = client.messages.create(
-            model="claude-3-haiku-20240307",
-            max_tokens=100,
-            temperature=0.0, # Low temperature for deterministic output
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ]
+        def resolve_reference():
+            message = guarded_anthropic_call(lambda: client.messages.create(
+                model=AI_SEARCH_MODEL,
+                max_tokens=100,
+                temperature=0.0, # Low temperature for deterministic output
+                messages=[
+                    {
+                        "role": "user",
+                        "content": prompt
+                    }
+                ]
+            ))
+            return message.content[0].text
+        
+        # Identical concurrent queries (e.g. a shared chapter going viral) share one upstream call
+        llm_response_text = coalesce(
+            request_key("ai-search", AI_SEARCH_MODEL, normalize_text(query_str)),
+            resolve_reference
         )
         
-        # Extract and parse the JSON response from the LLM
-        llm_response_text = message.content[0].text
+        # Parse the JSON response from the LLM
         logger.info(f"Received response from Anthropic: {llm_response_text}")
         
         try:
-            # The response might be wrapped in ```json ... ```, try to extract if needed
-            if llm_response_text.strip().startswith('```json'):
-                llm_response_text = llm_response_text.split('```json')[1].split('```')[0].strip()
-                
-            llm_data = json.loads(llm_response_text)
-            book = llm_data.get('book')
-            chapter = llm_data.get('chapter')
+            book, chapter = parse_reference(llm_response_text)
             
             if not book or not chapter:
                 logger.info(f"LLM could not identify a specific reference for query: '{query_str}'")
@@ -244,14 +299,7 @@ def ai_search_bible(current_user):
         # Fetch verses for the identified book and chapter
         logger.info(f"Fetching verses for {book} {chapter} based on LLM response")
         try:
-            with get_db() as db_client:
-                response = db_client.table('bible_verses')\
-                                    .select('*')\
-                                    .eq('book_name', book)\
-                                    .eq('chapter', chapter)\
-                                    .order('verse')\
-                                    .execute()
-                verses = response.data
+            verses = dal.verses_by_chapter(book, chapter)
             
             if not verses:
                 logger.warning(f"No verses found for {book} {chapter} despite LLM suggestion.")
@@ -260,14 +308,8 @@ def ai_search_bible(current_user):
             
             logger.info(f"Successfully fetched {len(verses)} verses for {book} {chapter}")
             # Format the response similarly to the standard verse endpoint
-            formatted_verses = [{
-                "id": verse['id'],
-                "book": verse['book_name'],
-                "chapter": verse['chapter'],
-                "verse": verse['verse'],
-                "text": verse['text'],
-                "ai_suggestion": True # Add a flag indicating this came from AI search
-            } for verse in verses]
+            # Add a flag indicating this came from AI search
+            formatted_verses = format_verses(verses, ai_suggestion=True)
             
             return jsonify(formatted_verses)
 
@@ -275,6 +317,11 @@ def ai_search_bible(current_user):
             logger.error(f"Database error fetching verses for {book} {chapter}: {db_err}", exc_info=True)
             return jsonify({"error": "Failed to retrieve verses from database."}), 500
 
+    except (CircuitOpenError, RateLimitExceeded) as busy_err:
+        logger.warning(f"AI search rejected locally: {busy_err}")
+        response = jsonify({'error': 'AI search is temporarily unavailable. Please try again shortly.'})
+        response.headers['Retry-After'] = str(int(math.ceil(busy_err.retry_after or 1)))
+        return response, 503
     except anthropic.APIError as api_err:
         logger.error(f"Anthropic API error: {api_err}", exc_info=True)
         return jsonify({'error': 'AI service communication error.'}), 500
@@ -285,7 +332,7 @@ def ai_search_bible(current_user):
 @bible_bp.route('/verse/<book>/<int:chapter>/<int:verse>', methods=['GET'])
 def get_single_verse(book, chapter, verse):
     try:
-        with get_db() as client:
+        with get_db(read_only=True) as client:
             response = client.table('bible_verses').select('*').eq('book_name', book).eq('chapter', chapter).eq('verse', verse).execute()
             verse_obj = response.data[0] if response.data else None
         
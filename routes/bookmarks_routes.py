@@ -1,125 +1,177 @@
 # backend/routes/bookmarks_routes.py
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from sqlalchemy import tuple_
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 from database import get_db_session
 from models import Bookmark, User # Assuming models are accessible like this
 from schemas.bookmark_schemas import BookmarkCreate, BookmarkRead # For potential internal use or future migration
 from utils.auth import token_required
+from utils.pagination import page_params, paginate, parse_fields, query_columns, set_next_page
+from utils.verse_lookup import truncate_preview, verse_previews
+import json
 import logging
+import os
 import uuid
+from datetime import datetime
 
 logger = logging.getLogger(__name__)
 bookmarks_bp = Blueprint('bookmarks_bp', __name__, url_prefix='/api/bookmarks')
 
+# Columns a client may request with ?fields=
+BOOKMARK_FIELDS = ('id', 'user_id', 'book', 'chapter', 'verse', 'text_preview', 'notes', 'created_at')
+
+# Largest import and batch delete accepted in one request
+BOOKMARK_BATCH_MAX = int(os.getenv('BOOKMARK_BATCH_MAX', 2000))
+# Rows per multi-row INSERT during import, and per fetch while streaming an export
+BOOKMARK_CHUNK_SIZE = 500
+
+def _bookmark_error(data):
+    """Validation message for one bookmark payload, or None if it is valid"""
+    if not isinstance(data, dict) or not all(field in data for field in ('book', 'chapter', 'verse')):
+        return "Missing required fields (book, chapter, verse)"
+    # Basic type validation (can be expanded or use Pydantic models if preferred internally)
+    if not isinstance(data.get('book'), str) or \
+       not isinstance(data.get('chapter'), int) or \
+       not isinstance(data.get('verse'), int):
+        return "Invalid data types for book, chapter, or verse"
+    if len(data['book']) > 100:
+        return "book must be at most 100 characters"
+    if data.get('text_preview') is not None and not isinstance(data.get('text_preview'), str):
+        return "Invalid data type for text_preview"
+    if data.get('notes') is not None and not isinstance(data.get('notes'), str):
+        return "Invalid data type for notes"
+    return None
+
+def _bookmark_values(user_id, data):
+    return {
+        "user_id": user_id,
+        "book": data['book'],
+        "chapter": data['chapter'],
+        "verse": data['verse'],
+        "text_preview": data.get('text_preview'),
+        "notes": data.get('notes'),
+    }
+
+def _fill_previews(rows):
+    """Set text_preview on bookmark rows from the verse cache, keeping client text if the lookup fails.
+
+    Client text is cut to the column width too, so an over-long preview cannot fail the insert.
+    """
+    try:
+        previews = verse_previews((row['book'], row['chapter'], row['verse']) for row in rows)
+    except Exception as e:
+        logger.warning(f"Verse lookup failed, keeping client-supplied previews: {str(e)}")
+        previews = {}
+    for row in rows:
+        row['text_preview'] = previews.get((row['book'], row['chapter'], row['verse'])) \
+            or truncate_preview(row.get('text_preview'))
+    return rows
+
+def _serialize_bookmark(b):
+    return {
+        "id": b.id,
+        "user_id": b.user_id,
+        "book": b.book,
+        "chapter": b.chapter,
+        "verse": b.verse,
+        "text_preview": b.text_preview,
+        "notes": b.notes,
+        "created_at": b.created_at.isoformat() if b.created_at else None
+    }
+
 @bookmarks_bp.route("/", methods=['POST'])
 @token_required
-def create_bookmark(current_user_id_str):
+def create_bookmark(current_user):
     data = request.get_json()
     if not data:
         return jsonify({"error": "Invalid JSON payload"}), 400
 
     try:
-        current_user_id = uuid.UUID(current_user_id_str)
+        current_user_id = uuid.UUID(current_user.id)
     except ValueError:
-        logger.error(f"Invalid UUID format for user_id: {current_user_id_str}")
+        logger.error(f"Invalid UUID format for user_id: {current_user.id}")
         return jsonify({"error": "Invalid user identifier format"}), 400
 
-    required_fields = ['book', 'chapter', 'verse']
-    if not all(field in data for field in required_fields):
-        return jsonify({"error": "Missing required fields (book, chapter, verse)"}), 400
-    
-    # Basic type validation (can be expanded or use Pydantic models if preferred internally)
-    if not isinstance(data.get('book'), str) or \
-       not isinstance(data.get('chapter'), int) or \
-       not isinstance(data.get('verse'), int):
-        return jsonify({"error": "Invalid data types for book, chapter, or verse"}), 400
-    if data.get('text_preview') is not None and not isinstance(data.get('text_preview'), str):
-        return jsonify({"error": "Invalid data type for text_preview"}), 400
-    if data.get('notes') is not None and not isinstance(data.get('notes'), str):
-         return jsonify({"error": "Invalid data type for notes"}), 400
+    error = _bookmark_error(data)
+    if error:
+        return jsonify({"error": error}), 400
 
     try:
-        with get_db_session() as db:
-            # Check if bookmark already exists for this user and verse
-            existing_bookmark = db.query(Bookmark).filter_by(
-                user_id=current_user_id,
-                book=data['book'],
-                chapter=data['chapter'],
-                verse=data['verse']
+        with get_db_session(user_id=current_user_id) as db:
+            # One statement: uq_bookmarks_user_verse turns a duplicate into no row rather than an error
+            created = db.execute(
+                insert(Bookmark).values(**_fill_previews([_bookmark_values(current_user_id, data)])[0])
+                .on_conflict_do_nothing(constraint='uq_bookmarks_user_verse')
+                .returning(*Bookmark.__table__.c)
             ).first()
 
-            if existing_bookmark:
-                return jsonify({"error": "Bookmark already exists for this verse"}), 409 # Conflict
-
-            new_bookmark = Bookmark(
-                user_id=current_user_id,
-                book=data['book'],
-                chapter=data['chapter'],
-                verse=data['verse'],
-                text_preview=data.get('text_preview'),
-                notes=data.get('notes')
-            )
-            db.add(new_bookmark)
-            db.commit()
-            db.refresh(new_bookmark) # To get ID and created_at
-            
-            # Convert to a dictionary for JSON response, similar to BookmarkRead schema
-            response_data = {
-                "id": new_bookmark.id,
-                "user_id": new_bookmark.user_id,
-                "book": new_bookmark.book,
-                "chapter": new_bookmark.chapter,
-                "verse": new_bookmark.verse,
-                "text_preview": new_bookmark.text_preview,
-                "notes": new_bookmark.notes,
-                "created_at": new_bookmark.created_at.isoformat() if new_bookmark.created_at else None
-            }
-            return jsonify(response_data), 201
+        if created is None:
+            return jsonify({"error": "Bookmark already exists for this verse"}), 409 # Conflict
+        return jsonify(_serialize_bookmark(created)), 201
 
     except Exception as e:
-        db.rollback()
         logger.error(f"Error creating bookmark: {str(e)}", exc_info=True)
         return jsonify({"error": "Failed to create bookmark"}), 500
 
 @bookmarks_bp.route("/", methods=['GET'])
 @token_required
-def get_bookmarks(current_user_id_str):
+def get_bookmarks(current_user):
     try:
-        current_user_id = uuid.UUID(current_user_id_str)
+        current_user_id = uuid.UUID(current_user.id)
     except ValueError:
-        logger.error(f"Invalid UUID format for user_id: {current_user_id_str}")
+        logger.error(f"Invalid UUID format for user_id: {current_user.id}")
         return jsonify({"error": "Invalid user identifier format"}), 400
 
     try:
-        with get_db_session() as db:
-            bookmarks = db.query(Bookmark).filter_by(user_id=current_user_id).order_by(Bookmark.created_at.desc()).all()
-            
-            results = [{
-                "id": b.id,
-                "user_id": b.user_id,
-                "book": b.book,
-                "chapter": b.chapter,
-                "verse": b.verse,
-                "text_preview": b.text_preview,
-                "notes": b.notes,
-                "created_at": b.created_at.isoformat() if b.created_at else None
-            } for b in bookmarks]
-            return jsonify(results), 200
+        limit, cursor = page_params(request.args)
+        fields = parse_fields(request.args.get('fields'), BOOKMARK_FIELDS)
+        previews = request.args.get('previews', 'stored')
+        if previews not in ('stored', 'live'):
+            raise ValueError("previews must be 'stored' or 'live'")
+        # previews=live resolves text_preview from the verse text instead of the stored copy
+        live_previews = previews == 'live' and 'text_preview' in fields
+        cursor_key = (datetime.fromisoformat(cursor[0]), int(cursor[1])) if cursor else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        with get_db_session(read_only=True, user_id=current_user_id) as db:
+            # Only the requested columns, one page past the cursor via ix_bookmarks_user_created_at
+            columns = query_columns(fields)
+            if live_previews:
+                # Live previews are looked up by verse, so the reference columns are needed too
+                columns += [name for name in ('book', 'chapter', 'verse') if name not in columns]
+            query = db.query(*[getattr(Bookmark, name) for name in columns]).filter(
+                Bookmark.user_id == current_user_id)
+            if cursor_key:
+                query = query.filter(tuple_(Bookmark.created_at, Bookmark.id) < tuple_(*cursor_key))
+            rows = query.order_by(Bookmark.created_at.desc(), Bookmark.id.desc()).limit(limit + 1).all()
+
+        rows = [{
+            **row._asdict(),
+            "created_at": row.created_at.isoformat() if row.created_at else None
+        } for row in rows]
+        if live_previews:
+            # One cached chapter read per distinct chapter on the page, not one per bookmark
+            _fill_previews(rows)
+        results, next_cursor = paginate(rows, limit, fields)
+        return set_next_page(jsonify(results), next_cursor), 200
     except Exception as e:
         logger.error(f"Error fetching bookmarks: {str(e)}", exc_info=True)
         return jsonify({"error": "Failed to fetch bookmarks"}), 500
 
 @bookmarks_bp.route("/<int:bookmark_id>", methods=['DELETE'])
 @token_required
-def delete_bookmark(current_user_id_str, bookmark_id):
+def delete_bookmark(current_user, bookmark_id):
     try:
-        current_user_id = uuid.UUID(current_user_id_str)
+        current_user_id = uuid.UUID(current_user.id)
     except ValueError:
-        logger.error(f"Invalid UUID format for user_id: {current_user_id_str}")
+        logger.error(f"Invalid UUID format for user_id: {current_user.id}")
         return jsonify({"error": "Invalid user identifier format"}), 400
 
     try:
-        with get_db_session() as db:
+        with get_db_session(user_id=current_user_id) as db:
             bookmark_to_delete = db.query(Bookmark).filter_by(id=bookmark_id, user_id=current_user_id).first()
 
             if not bookmark_to_delete:
@@ -132,4 +184,109 @@ def delete_bookmark(current_user_id_str, bookmark_id):
     except Exception as e:
         db.rollback()
         logger.error(f"Error deleting bookmark {bookmark_id}: {str(e)}", exc_info=True)
-        return jsonify({"error": "Failed to delete bookmark"}), 500 
\ No newline at end of file
+        return jsonify({"error": "Failed to delete bookmark"}), 500
+
+@bookmarks_bp.route("/import", methods=['POST'])
+@token_required
+def import_bookmarks(current_user):
+    """
+    Imports a list of bookmarks (a JSON array, or {"bookmarks": [...]}) with
+    multi-row INSERT ... ON CONFLICT DO NOTHING in one transaction. Verses the
+    user has already bookmarked are skipped rather than rejected.
+    """
+    data = request.get_json()
+    items = data.get('bookmarks') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Expected a non-empty list of bookmarks"}), 400
+    if len(items) > BOOKMARK_BATCH_MAX:
+        return jsonify({"error": f"At most {BOOKMARK_BATCH_MAX} bookmarks per import"}), 400
+
+    try:
+        current_user_id = uuid.UUID(current_user.id)
+    except ValueError:
+        logger.error(f"Invalid UUID format for user_id: {current_user.id}")
+        return jsonify({"error": "Invalid user identifier format"}), 400
+
+    for index, item in enumerate(items):
+        error = _bookmark_error(item)
+        if error:
+            return jsonify({"error": f"Bookmark {index}: {error}"}), 400
+    rows = _fill_previews([_bookmark_values(current_user_id, item) for item in items])
+
+    try:
+        imported = 0
+        with get_db_session(user_id=current_user_id) as db:
+            for start in range(0, len(rows), BOOKMARK_CHUNK_SIZE):
+                result = db.execute(
+                    insert(Bookmark).values(rows[start:start + BOOKMARK_CHUNK_SIZE])
+                    .on_conflict_do_nothing(constraint='uq_bookmarks_user_verse')
+                    .returning(Bookmark.id)
+                )
+                imported += len(result.all())
+
+        return jsonify({"imported": imported, "skipped": len(rows) - imported}), 200
+
+    except Exception as e:
+        logger.error(f"Error importing bookmarks: {str(e)}", exc_info=True)
+        return jsonify({"error": "Failed to import bookmarks"}), 500
+
+@bookmarks_bp.route("/batch", methods=['DELETE'])
+@token_required
+def delete_bookmarks_batch(current_user):
+    """Deletes the user's bookmarks listed in {"ids": [...]} with one statement"""
+    data = request.get_json()
+    ids = data.get('ids') if isinstance(data, dict) else None
+    if not isinstance(ids, list) or not ids or \
+       not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+        return jsonify({"error": "ids must be a non-empty list of integers"}), 400
+    if len(ids) > BOOKMARK_BATCH_MAX:
+        return jsonify({"error": f"At most {BOOKMARK_BATCH_MAX} ids per request"}), 400
+
+    try:
+        current_user_id = uuid.UUID(current_user.id)
+    except ValueError:
+        logger.error(f"Invalid UUID format for user_id: {current_user.id}")
+        return jsonify({"error": "Invalid user identifier format"}), 400
+
+    try:
+        with get_db_session(user_id=current_user_id) as db:
+            # Ids owned by someone else are simply not matched
+            deleted = db.execute(
+                Bookmark.__table__.delete()
+                .where(Bookmark.user_id == current_user_id, Bookmark.id.in_(set(ids)))
+                .returning(Bookmark.id)
+            ).scalars().all()
+
+        return jsonify({"deleted": sorted(deleted), "not_found": sorted(set(ids).difference(deleted))}), 200
+
+    except Exception as e:
+        logger.error(f"Error deleting bookmarks: {str(e)}", exc_info=True)
+        return jsonify({"error": "Failed to delete bookmarks"}), 500
+
+@bookmarks_bp.route("/export", methods=['GET'])
+@token_required
+def export_bookmarks(current_user):
+    """
+    Streams all of the user's bookmarks, newest first, as newline-delimited JSON.
+    Rows are read through a server-side cursor, so memory stays flat however
+    many bookmarks the user has.
+    """
+    try:
+        current_user_id = uuid.UUID(current_user.id)
+    except ValueError:
+        logger.error(f"Invalid UUID format for user_id: {current_user.id}")
+        return jsonify({"error": "Invalid user identifier format"}), 400
+
+    def generate():
+        with get_db_session(read_only=True, user_id=current_user_id) as db:
+            bookmarks = db.query(Bookmark).filter(Bookmark.user_id == current_user_id) \
+                .order_by(Bookmark.created_at.desc(), Bookmark.id.desc()) \
+                .execution_options(stream_results=True, yield_per=BOOKMARK_CHUNK_SIZE)
+            for b in bookmarks:
+                yield json.dumps(_serialize_bookmark(b), default=str) + "\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="application/x-ndjson",
+        headers={"Content-Disposition": "attachment; filename=bookmarks.ndjson"},
+    )
@@ -2,50 +2,43 @@ from flask import Blueprint, request, jsonify
 from datetime import datetime
 from utils.auth import token_required
 from database import get_db
+from utils import dal
+from utils.user_cache import get_user_by_email
 import logging
 
 friends_bp = Blueprint('friends', __name__)
 logger = logging.getLogger(__name__)
 
+def format_friends(friendships):
+    """Friendship rows from dal.friendships in the shape the frontend expects"""
+    return [{
+        'id': friendship['friend_id'],
+        'username': friendship['friend_username'],
+        'email': friendship['friend_email'],
+        'friendship_id': friendship['id'],
+        'status': friendship['status'],
+        'created_at': friendship['created_at']
+    } for friendship in friendships]
+
+def format_friend_requests(requests):
+    """Rows from dal.pending_friend_requests in the shape the frontend expects"""
+    return [{
+        'id': request['id'],
+        'user': {
+            'id': request['requester_id'],
+            'username': request['requester_username'],
+            'email': request['requester_email']
+        },
+        'created_at': request['created_at']
+    } for request in requests]
+
 @friends_bp.route('/friends', methods=['GET'])
 @token_required
 def get_friends(current_user):
     try:
-        with get_db() as client:
-            # Get all friendships where the current user is either user1 or user2
-            response = client.table('friendships').select(
-                'id',
-                'user1_id',
-                'user2_id',
-                'status',
-                'created_at',
-                'users!friendships_user1_id_fkey(id, username, email)',
-                'users!friendships_user2_id_fkey(id, username, email)'
-            ).or_(f'user1_id.eq.{current_user.id},user2_id.eq.{current_user.id}').execute()
-            
-            friendships = response.data
-            
-            # Process friendships to get friend information
-            friends = []
-            for friendship in friendships:
-                # Determine which user is the friend (not the current user)
-                friend = None
-                if friendship['user1_id'] == current_user.id:
-                    friend = friendship['users!friendships_user2_id_fkey']
-                else:
-                    friend = friendship['users!friendships_user1_id_fkey']
-                
-                if friend:
-                    friends.append({
-                        'id': friend['id'],
-                        'username': friend['username'],
-                        'email': friend['email'],
-                        'friendship_id': friendship['id'],
-                        'status': friendship['status'],
-                        'created_at': friendship['created_at']
-                    })
-            
-            return jsonify(friends)
+        friends = format_friends(dal.friendships(current_user.id))
+
+        return jsonify(friends)
             
     except Exception as e:
         logger.error(f"Error fetching friends: {str(e)}")
@@ -55,26 +48,9 @@ def get_friends(current_user):
 @token_required
 def get_friend_requests(current_user):
     try:
-        with get_db() as client:
-            # Get pending friend requests where current user is the recipient
-            response = client.table('friendships').select(
-                'id',
-                'user1_id',
-                'created_at',
-                'users!friendships_user1_id_fkey(id, username, email)'
-            ).eq('user2_id', current_user.id).eq('status', 'pending').execute()
-            
-            requests = response.data
-            
-            return jsonify([{
-                'id': request['id'],
-                'user': {
-                    'id': request['users!friendships_user1_id_fkey']['id'],
-                    'username': request['users!friendships_user1_id_fkey']['username'],
-                    'email': request['users!friendships_user1_id_fkey']['email']
-                },
-                'created_at': request['created_at']
-            } for request in requests])
+        requests = dal.pending_friend_requests(current_user.id)
+
+        return jsonify(format_friend_requests(requests))
             
     except Exception as e:
         logger.error(f"Error fetching friend requests: {str(e)}")
@@ -92,11 +68,11 @@ def send_friend_request(current_user):
 
         with get_db() as client:
             # Check if friend exists
-            friend_response = client.table('users').select('id').eq('email', friend_email).execute()
-            if not friend_response.data:
+            friend = get_user_by_email(friend_email)
+            if not friend:
                 return jsonify({'error': 'User not found'}), 404
 
-            friend_id = friend_response.data[0]['id']
+            friend_id = friend['id']
 
             # Check if friendship already exists
             existing_response = client.table('friendships').select('*').or_(
@@ -1,13 +1,16 @@
 # backend/routes/highlight.py
 from flask import Blueprint, request, jsonify, g
 from sqlalchemy.orm import Session
-from sqlalchemy import and_ # Added for complex queries
+from sqlalchemy import and_, insert # Added for complex queries
 from database import get_db_session # Assuming a session getter for Flask context
 from models import Highlight, User # Import models directly
 # from utils.auth import login_required
 from utils.auth import token_required # Corrected import name
 import logging
 import uuid # Import the uuid module
+from datetime import datetime, timezone
+from utils.highlight_segments import diff_segments, paint
+from utils import dal
 
 logger = logging.getLogger(__name__)
 
@@ -16,10 +19,91 @@ highlight_bp = Blueprint('highlight_bp', __name__)
 # Pydantic models are not typically used directly in Flask request handling
 # We'll parse JSON from the request body
 
+def _serialize_highlight(row, user_id, book, chapter, verse):
+    return {
+        "id": row['id'],
+        "user_id": user_id,
+        "book": book,
+        "chapter": chapter,
+        "verse": verse,
+        "start_offset": row['start'],
+        "end_offset": row['end'],
+        "color": row['color'],
+        "created_at": row['created_at'].isoformat() if row['created_at'] else None,
+        "updated_at": row['updated_at'].isoformat() if row['updated_at'] else None,
+    }
+
+def _load_highlight_rows(db, user_id, book, chapter, verses):
+    """Stored segments for the given verses of one chapter, keyed by verse, in one query"""
+    rows = {verse: [] for verse in verses}
+    highlights = db.query(Highlight).filter(
+        Highlight.user_id == user_id,
+        Highlight.book == book,
+        Highlight.chapter == chapter,
+        Highlight.verse.in_(list(rows))
+    ).order_by(Highlight.verse, Highlight.start_offset).all()
+    for hl in highlights:
+        rows[hl.verse].append({
+            'id': hl.id, 'start': hl.start_offset, 'end': hl.end_offset, 'color': hl.color,
+            'created_at': hl.created_at, 'updated_at': hl.updated_at,
+        })
+    return rows
+
+def _save_highlight_segments(db, user_id, book, chapter, segments_by_verse, rows_by_verse):
+    """Write the minimal diff between stored rows and new segments for each verse.
+
+    All verses share one DELETE, one bulk UPDATE by primary key and one
+    INSERT ... RETURNING, inside the caller's transaction. Returns the
+    serialized highlights per verse, built from memory rather than re-queried.
+    """
+    now = datetime.now(timezone.utc)
+    final_rows = {}
+    delete_ids, updates, inserts = [], [], []
+
+    for verse, segments in segments_by_verse.items():
+        to_keep, to_update, to_delete, to_insert = diff_segments(rows_by_verse.get(verse, []), segments)
+        final_rows[verse] = list(to_keep)
+        delete_ids.extend(row['id'] for row in to_delete)
+        for row, seg in to_update:
+            updates.append({
+                'id': row['id'], 'start_offset': seg['start'], 'end_offset': seg['end'],
+                'color': seg['color'], 'updated_at': now,
+            })
+            final_rows[verse].append({**row, **seg, 'updated_at': now})
+        for seg in to_insert:
+            inserts.append({
+                'user_id': user_id, 'book': book, 'chapter': chapter, 'verse': verse,
+                'start_offset': seg['start'], 'end_offset': seg['end'], 'color': seg['color'],
+            })
+
+    if delete_ids:
+        db.query(Highlight).filter(Highlight.id.in_(delete_ids)).delete(synchronize_session=False)
+    if updates:
+        # updated_at is set explicitly: bulk updates bypass the column's onupdate
+        db.bulk_update_mappings(Highlight, updates)
+    if inserts:
+        table = Highlight.__table__
+        created = db.execute(
+            insert(table).values(inserts).returning(
+                table.c.id, table.c.verse, table.c.start_offset, table.c.end_offset,
+                table.c.color, table.c.created_at, table.c.updated_at)
+        ).all()
+        for new in created:
+            final_rows[new.verse].append({
+                'id': new.id, 'start': new.start_offset, 'end': new.end_offset, 'color': new.color,
+                'created_at': new.created_at, 'updated_at': new.updated_at,
+            })
+
+    return {
+        verse: [_serialize_highlight(row, user_id, book, chapter, verse)
+                for row in sorted(rows, key=lambda r: r['start'])]
+        for verse, rows in final_rows.items()
+    }
+
 @highlight_bp.route("/api/highlights", methods=['POST'])
 # @login_required
 @token_required # Use the correct decorator name
-def create_highlight(current_user_id_str): # Renamed to indicate it's a string
+def create_highlight(current_user):
     """
     Creates or updates highlights for a verse based on a new highlight submission.
     Implements a "paint over" logic: new highlights can split, truncate, or
@@ -30,11 +114,11 @@ def create_highlight(current_user_id_str): # Renamed to indicate it's a string
     if not data:
         return jsonify({"error": "Invalid JSON payload"}), 400
 
-    # Convert current_user_id_str to UUID object
+    # Convert the user id claim to a UUID object
     try:
-        current_user_id = uuid.UUID(current_user_id_str)
+        current_user_id = uuid.UUID(current_user.id)
     except ValueError:
-        logger.error(f"Invalid UUID format for user_id: {current_user_id_str}")
+        logger.error(f"Invalid UUID format for user_id: {current_user.id}")
         return jsonify({"error": "Invalid user identifier format"}), 400
 
     required_fields = ['book', 'chapter', 'verse', 'start_offset', 'end_offset', 'color']
@@ -57,136 +141,139 @@ def create_highlight(current_user_id_str): # Renamed to indicate it's a string
         return jsonify({"error": "Invalid start or end offset"}), 400
 
     try:
-        with get_db_session() as db:
-            existing_highlights = db.query(Highlight).filter(
-                Highlight.user_id == current_user_id,
-                Highlight.book == book,
-                Highlight.chapter == chapter,
-                Highlight.verse == verse
-            ).order_by(Highlight.start_offset).all()
-
-            final_segments = []
-
-            # 1. Calculate remaining parts of existing highlights
-            for ex_hl in existing_highlights:
-                ex_start, ex_end, ex_color = ex_hl.start_offset, ex_hl.end_offset, ex_hl.color
-
-                # If existing highlight is entirely to the left of the new one
-                if ex_end <= new_start_offset:
-                    final_segments.append({'start': ex_start, 'end': ex_end, 'color': ex_color})
-                # If existing highlight is entirely to the right of the new one
-                elif ex_start >= new_end_offset:
-                    final_segments.append({'start': ex_start, 'end': ex_end, 'color': ex_color})
-                # Else, there is an overlap
-                else:
-                    # Part of existing highlight to the left of the new highlight
-                    if ex_start < new_start_offset:
-                        final_segments.append({'start': ex_start, 'end': new_start_offset, 'color': ex_color})
-                    # Part of existing highlight to the right of the new highlight
-                    if ex_end > new_end_offset:
-                        final_segments.append({'start': new_end_offset, 'end': ex_end, 'color': ex_color})
-            
-            # 2. Add the new highlight itself
-            final_segments.append({'start': new_start_offset, 'end': new_end_offset, 'color': new_color})
-
-            # 3. Sort and Merge segments
-            # Sort by start offset, then by end offset
-            final_segments.sort(key=lambda s: (s['start'], s['end']))
-
-            merged_segments = []
-            if not final_segments:
-                # If there are no segments (e.g. first highlight, or new highlight covered all old ones)
-                # and the new highlight itself was valid.
-                # This case is handled by the loop below if final_segments has the new highlight.
-                # If final_segments is truly empty, merged_segments remains empty.
-                pass
-
-
-            for seg in final_segments:
-                # Skip zero-length or invalid segments that might have been created
-                if seg['start'] >= seg['end']:
-                    continue
-
-                if not merged_segments or seg['color'] != merged_segments[-1]['color'] or seg['start'] > merged_segments[-1]['end']:
-                    # If merged_segments is empty, or current segment has a different color,
-                    # or current segment does not touch/overlap the last merged segment,
-                    # then add it as a new segment.
-                    merged_segments.append(seg.copy()) # Use copy to avoid modifying original in final_segments
-                else:
-                    # Merge with the last segment (it has the same color and touches or overlaps)
-                    merged_segments[-1]['end'] = max(merged_segments[-1]['end'], seg['end'])
-            
-            # 4. Database Update
-            # Delete old highlights for this verse for this user
-            db.query(Highlight).filter(
-                Highlight.user_id == current_user_id,
-                Highlight.book == book,
-                Highlight.chapter == chapter,
-                Highlight.verse == verse
-            ).delete(synchronize_session=False) # synchronize_session=False is typical for bulk deletes
-
-            # Add new merged segments
-            new_db_highlights = []
-            for seg_data in merged_segments:
-                new_hl = Highlight(
-                    user_id=current_user_id,
-                    book=book,
-                    chapter=chapter,
-                    verse=verse,
-                    start_offset=seg_data['start'],
-                    end_offset=seg_data['end'],
-                    color=seg_data['color']
-                )
-                db.add(new_hl)
-                new_db_highlights.append(new_hl)
-            
-            db.commit() # Commit changes: deletions and additions
-
-            # Refresh objects to get IDs and timestamps
-            # Instead of refreshing (which might be tricky with new_db_highlights if they weren't flushed for IDs),
-            # it's safer to re-query. But for performance, if IDs are populated after add and before commit,
-            # we might not need a full re-query. SQLAlchemy populates PKs on flush, which happens before commit.
-            # However, timestamps like created_at, updated_at with server_default/onupdate might need refresh.
-            # Let's re-fetch for safety and to ensure all fields are current.
-
-            # 5. Fetch and Return all highlights for the verse
-            final_verse_highlights = db.query(Highlight).filter(
-                Highlight.user_id == current_user_id,
-                Highlight.book == book,
-                Highlight.chapter == chapter,
-                Highlight.verse == verse
-            ).order_by(Highlight.start_offset).all()
-
-            response_data = [{
-                "id": hl.id,
-                "user_id": hl.user_id,
-                "book": hl.book,
-                "chapter": hl.chapter,
-                "verse": hl.verse,
-                "start_offset": hl.start_offset,
-                "end_offset": hl.end_offset,
-                "color": hl.color,
-                "created_at": hl.created_at.isoformat() if hl.created_at else None,
-                "updated_at": hl.updated_at.isoformat() if hl.updated_at else None,
-            } for hl in final_verse_highlights]
-            
-            return jsonify(response_data), 200
+        with get_db_session(user_id=current_user_id) as db:
+            rows = _load_highlight_rows(db, current_user_id, book, chapter, [verse])[verse]
+            segments = paint(rows, new_start_offset, new_end_offset, new_color)
+            response_data = _save_highlight_segments(db, current_user_id, book, chapter, {verse: segments}, {verse: rows})[verse]
+
+        return jsonify(response_data), 200
 
     except Exception as e:
-        db.rollback() # Rollback in case of error during transaction
         logger.error(f"Error processing highlight for verse {book} {chapter}:{verse}: {str(e)}", exc_info=True)
         return jsonify({"error": "Failed to process highlight"}), 500
 
 # We will add GET and DELETE endpoints later
 
+# Upper bound on strokes (operations, or verses covered by a span) in one batch request
+MAX_BATCH_STROKES = 200
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def _operation_strokes(operations):
+    """(verse, start, end, color) strokes from a list of operations; color None erases"""
+    if not isinstance(operations, list) or not operations:
+        raise ValueError("operations must be a non-empty list")
+    strokes = []
+    for op in operations:
+        if not isinstance(op, dict) or not all(field in op for field in ('verse', 'start_offset', 'end_offset')):
+            raise ValueError("Each operation needs verse, start_offset and end_offset")
+        verse, start, end, color = op['verse'], op['start_offset'], op['end_offset'], op.get('color')
+        if not all(_is_int(val) for val in (verse, start, end)):
+            raise ValueError("verse, start_offset and end_offset must be integers")
+        if color is not None and not isinstance(color, str):
+            raise ValueError("color must be a string, or null to erase")
+        if start < 0 or end <= start:
+            raise ValueError(f"Invalid start or end offset for verse {verse}")
+        strokes.append((verse, start, end, color))
+    return strokes
+
+def _span_strokes(book, chapter, data):
+    """Strokes covering start_verse:start_offset up to end_verse:end_offset within one chapter"""
+    start_verse, start_offset = data.get('start_verse'), data.get('start_offset')
+    end_verse, end_offset = data.get('end_verse'), data.get('end_offset')
+    color = data.get('color')
+    if not all(_is_int(val) for val in (start_verse, start_offset, end_verse, end_offset)):
+        raise ValueError("start_verse, start_offset, end_verse and end_offset must be integers")
+    if color is not None and not isinstance(color, str):
+        raise ValueError("color must be a string, or null to erase")
+    if end_verse < start_verse or (end_verse == start_verse and end_offset <= start_offset) or start_offset < 0:
+        raise ValueError("The span must end after it starts")
+    if end_verse - start_verse + 1 > MAX_BATCH_STROKES:
+        raise ValueError(f"A span may cover at most {MAX_BATCH_STROKES} verses")
+
+    # Verse lengths bound the strokes for the first, middle and last verses
+    lengths = {v['verse']: len(v['text']) for v in dal.verses_by_chapter(book, chapter)}
+    missing = [verse for verse in range(start_verse, end_verse + 1) if verse not in lengths]
+    if missing:
+        raise ValueError(f"{book} {chapter} has no verse {missing[0]}")
+
+    strokes = []
+    for verse in range(start_verse, end_verse + 1):
+        start = start_offset if verse == start_verse else 0
+        end = min(end_offset, lengths[verse]) if verse == end_verse else lengths[verse]
+        if end > start:
+            strokes.append((verse, start, end, color))
+    return strokes
+
+@highlight_bp.route("/api/highlights/batch", methods=['POST'])
+@token_required
+def batch_highlights(current_user):
+    """
+    Applies several paint/erase strokes within one chapter in a single transaction.
+    The body gives book and chapter plus either a span (start_verse, start_offset,
+    end_verse, end_offset, color) or a list of operations (verse, start_offset,
+    end_offset, color), applied in order. A null color erases. Returns the updated
+    segments of every affected verse, keyed by verse number.
+    """
+    data = request.get_json()
+    if not data:
+        return jsonify({"error": "Invalid JSON payload"}), 400
+
+    try:
+        current_user_id = uuid.UUID(current_user.id)
+    except ValueError:
+        logger.error(f"Invalid UUID format for user_id: {current_user.id}")
+        return jsonify({"error": "Invalid user identifier format"}), 400
+
+    book = data.get('book')
+    chapter = data.get('chapter')
+    if not isinstance(book, str) or not _is_int(chapter):
+        return jsonify({"error": "book must be a string and chapter an integer"}), 400
+
+    try:
+        if 'operations' in data:
+            strokes = _operation_strokes(data['operations'])
+        else:
+            strokes = _span_strokes(book, chapter, data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        # A span reads the chapter's verse lengths
+        logger.error(f"Error reading verses for batch highlights in {book} {chapter}: {str(e)}", exc_info=True)
+        return jsonify({"error": "Failed to process highlights"}), 500
+    if len(strokes) > MAX_BATCH_STROKES:
+        return jsonify({"error": f"At most {MAX_BATCH_STROKES} operations per request"}), 400
+
+    verses = sorted({verse for verse, _, _, _ in strokes})
+    try:
+        with get_db_session(user_id=current_user_id) as db:
+            rows_by_verse = _load_highlight_rows(db, current_user_id, book, chapter, verses)
+            segments_by_verse = dict(rows_by_verse)
+            for verse, start, end, color in strokes:
+                segments_by_verse[verse] = paint(segments_by_verse[verse], start, end, color)
+            highlights_by_verse = _save_highlight_segments(
+                db, current_user_id, book, chapter, segments_by_verse, rows_by_verse)
+
+        return jsonify({
+            "book": book,
+            "chapter": chapter,
+            "verses": {str(verse): highlights_by_verse[verse] for verse in verses}
+        }), 200
+
+    except Exception as e:
+        logger.error(f"Error applying batch highlights for {book} {chapter}: {str(e)}", exc_info=True)
+        return jsonify({"error": "Failed to process highlights"}), 500
+
 @highlight_bp.route("/api/highlights/chapter/<string:book_name>/<int:chapter_number>", methods=['GET'])
 @token_required
-def get_highlights_by_chapter(current_user_id, book_name, chapter_number):
+def get_highlights_by_chapter(current_user, book_name, chapter_number):
     """Fetches all highlights for a given book and chapter for the current user."""
+    current_user_id = current_user.id
     logger.info(f"Attempting to fetch highlights for user: {current_user_id}, book: {book_name}, chapter: {chapter_number}")
     try:
         logger.debug("Attempting to get DB session.")
-        with get_db_session() as db:
+        with get_db_session(read_only=True, user_id=current_user_id) as db:
             logger.debug(f"DB session acquired. Querying highlights for user_id: {current_user_id}, book: {book_name}, chapter: {chapter_number}")
             highlights = db.query(Highlight).filter_by(
                 user_id=current_user_id,
@@ -217,7 +304,7 @@ def get_highlights_by_chapter(current_user_id, book_name, chapter_number):
 
 @highlight_bp.route("/api/highlights/range", methods=['DELETE'])
 @token_required
-def delete_highlights_in_range(current_user_id_str):
+def delete_highlights_in_range(current_user):
     """
     Deletes highlights within a specified range for a verse.
     Recalculates segments similar to create_highlight, but removes the specified range.
@@ -228,9 +315,9 @@ def delete_highlights_in_range(current_user_id_str):
         return jsonify({"error": "Invalid JSON payload"}), 400
 
     try:
-        current_user_id = uuid.UUID(current_user_id_str)
+        current_user_id = uuid.UUID(current_user.id)
     except ValueError:
-        logger.error(f"Invalid UUID format for user_id: {current_user_id_str}")
+        logger.error(f"Invalid UUID format for user_id: {current_user.id}")
         return jsonify({"error": "Invalid user identifier format"}), 400
 
     required_fields = ['book', 'chapter', 'verse', 'start_offset', 'end_offset']
@@ -252,91 +339,13 @@ def delete_highlights_in_range(current_user_id_str):
         return jsonify({"error": "Invalid start or end offset for deletion range"}), 400
 
     try:
-        with get_db_session() as db:
-            existing_highlights = db.query(Highlight).filter(
-                Highlight.user_id == current_user_id,
-                Highlight.book == book,
-                Highlight.chapter == chapter,
-                Highlight.verse == verse
-            ).order_by(Highlight.start_offset).all()
-
-            final_segments = []
-
-            # Calculate remaining parts of existing highlights after deletion range is applied
-            for ex_hl in existing_highlights:
-                ex_start, ex_end, ex_color = ex_hl.start_offset, ex_hl.end_offset, ex_hl.color
-
-                # Case 1: Existing highlight is entirely to the left of the deletion range
-                if ex_end <= del_start_offset:
-                    final_segments.append({'start': ex_start, 'end': ex_end, 'color': ex_color})
-                # Case 2: Existing highlight is entirely to the right of the deletion range
-                elif ex_start >= del_end_offset:
-                    final_segments.append({'start': ex_start, 'end': ex_end, 'color': ex_color})
-                # Case 3: Overlap exists
-                else:
-                    # Part of existing highlight to the left of the deletion range
-                    if ex_start < del_start_offset:
-                        final_segments.append({'start': ex_start, 'end': del_start_offset, 'color': ex_color})
-                    # Part of existing highlight to the right of the deletion range
-                    if ex_end > del_end_offset:
-                        final_segments.append({'start': del_end_offset, 'end': ex_end, 'color': ex_color})
-            
-            # Sort and Merge segments (same logic as create_highlight, but without adding a new highlight segment)
-            final_segments.sort(key=lambda s: (s['start'], s['end']))
-
-            merged_segments = []
-            for seg in final_segments:
-                if seg['start'] >= seg['end']: # Skip zero-length or invalid segments
-                    continue
-                if not merged_segments or seg['color'] != merged_segments[-1]['color'] or seg['start'] > merged_segments[-1]['end']:
-                    merged_segments.append(seg.copy())
-                else:
-                    merged_segments[-1]['end'] = max(merged_segments[-1]['end'], seg['end'])
-            
-            # Database Update: Delete old highlights for this verse, then add new merged segments
-            db.query(Highlight).filter(
-                Highlight.user_id == current_user_id,
-                Highlight.book == book,
-                Highlight.chapter == chapter,
-                Highlight.verse == verse
-            ).delete(synchronize_session=False)
-
-            new_db_highlights = []
-            for seg_data in merged_segments:
-                new_hl = Highlight(
-                    user_id=current_user_id,
-                    book=book,
-                    chapter=chapter,
-                    verse=verse,
-                    start_offset=seg_data['start'],
-                    end_offset=seg_data['end'],
-                    color=seg_data['color']
-                )
-                db.add(new_hl)
-                new_db_highlights.append(new_hl)
-            
-            db.commit()
-
-            # Fetch and Return all highlights for the verse
-            final_verse_highlights = db.query(Highlight).filter(
-                Highlight.user_id == current_user_id,
-                Highlight.book == book,
-                Highlight.chapter == chapter,
-                Highlight.verse == verse
-            ).order_by(Highlight.start_offset).all()
-
-            response_data = [{
-                "id": hl.id, "user_id": hl.user_id, "book": hl.book,
-                "chapter": hl.chapter, "verse": hl.verse,
-                "start_offset": hl.start_offset, "end_offset": hl.end_offset,
-                "color": hl.color,
-                "created_at": hl.created_at.isoformat() if hl.created_at else None,
-                "updated_at": hl.updated_at.isoformat() if hl.updated_at else None,
-            } for hl in final_verse_highlights]
-            
-            return jsonify(response_data), 200
+        with get_db_session(user_id=current_user_id) as db:
+            rows = _load_highlight_rows(db, current_user_id, book, chapter, [verse])[verse]
+            segments = paint(rows, del_start_offset, del_end_offset, None)
+            response_data = _save_highlight_segments(db, current_user_id, book, chapter, {verse: segments}, {verse: rows})[verse]
+
+        return jsonify(response_data), 200
 
     except Exception as e:
-        db.rollback()
         logger.error(f"Error deleting highlights in range for verse {book} {chapter}:{verse}: {str(e)}", exc_info=True)
-        return jsonify({"error": "Failed to delete highlights in range"}), 500 
\ No newline at end of file
+        return jsonify({"error": "Failed to delete highlights in range"}), 500
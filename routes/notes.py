@@ -1,57 +1,45 @@
 from flask import Blueprint, request, jsonify
 from datetime import datetime
+import uuid
+from postgrest.types import CountMethod, ReturnMethod
 from utils.auth import token_required
 from database import get_db
+from utils import dal
+from utils.pagination import page_params, paginate, parse_fields, query_columns, set_next_page
 import logging
-from functools import wraps
 
 notes_bp = Blueprint('notes', __name__)
 logger = logging.getLogger(__name__)
 
-def token_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        token = None
-        if 'Authorization' in request.headers:
-            auth_header = request.headers['Authorization']
-            if auth_header.startswith('Bearer '):
-                token = auth_header.split(' ')[1]
-
-        if not token:
-            return jsonify({'message': 'Token is missing!'}), 401
-
-        try:
-            with get_db() as client:
-                # Verify the JWT token with Supabase
-                user_response = client.auth.get_user(token)
-                if not user_response:
-                    return jsonify({'message': 'Invalid token!'}), 401
-                
-                # Extract user ID from the response
-                user_id = user_response.user.id
-                return f(user_id, *args, **kwargs)
-        except Exception as e:
-            logger.error(f"Token validation error: {str(e)}")
-            return jsonify({'message': 'Invalid token!'}), 401
-
-    return decorated
+# Columns a client may request with ?fields= on GET /notes
+NOTE_FIELDS = ('id', 'user_id', 'verse_id', 'content', 'created_at', 'updated_at')
 
 @notes_bp.route('/notes', methods=['GET'])
 @token_required
 def get_notes(current_user):
+    try:
+        limit, cursor = page_params(request.args)
+        fields = parse_fields(request.args.get('fields'), NOTE_FIELDS)
+        if cursor:
+            # Re-serialize both keys so nothing from the client reaches the filter string verbatim
+            try:
+                created_at = datetime.fromisoformat(cursor[0]).isoformat()
+                note_id = cursor[1] if isinstance(cursor[1], int) else str(uuid.UUID(cursor[1]))
+            except ValueError:
+                raise ValueError("Invalid cursor")
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
     try:
         with get_db() as client:
-            response = client.table('notes').select('*').eq('user_id', current_user).order('created_at', desc=True).execute()
-            notes = response.data
-            
-        return jsonify([{
-            'id': note['id'],
-            'user_id': note['user_id'],
-            'verse_id': note['verse_id'],
-            'content': note['content'],
-            'created_at': note['created_at'],
-            'updated_at': note['updated_at']
-        } for note in notes])
+            query = client.table('notes').select(','.join(query_columns(fields))).eq('user_id', current_user.id)
+            if cursor:
+                # Rows strictly before the cursor in (created_at, id) order
+                query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt."{note_id}")')
+            response = query.order('created_at', desc=True).order('id', desc=True).limit(limit + 1).execute()
+
+        notes, next_cursor = paginate(response.data, limit, fields)
+        return set_next_page(jsonify(notes), next_cursor)
         
     except Exception as e:
         logger.error(f"Error fetching notes: {str(e)}")
@@ -77,7 +65,7 @@ def create_note(current_user):
             # Create note
             current_time = datetime.utcnow().isoformat()
             note_data = {
-                'user_id': current_user,
+                'user_id': current_user.id,
                 'verse_id': verse_id,
                 'content': content,
                 'created_at': current_time,
@@ -109,19 +97,14 @@ def update_note(current_user, note_id):
             return jsonify({'error': 'Content is required'}), 400
 
         with get_db() as client:
-            # Verify note exists and belongs to user
-            response = client.table('notes').select('*').eq('id', note_id).eq('user_id', current_user).execute()
-            if not response.data:
-                return jsonify({'error': 'Note not found'}), 404
-
-            # Update note
+            # The ownership check is part of the update; no row back means no such note for this user
             update_response = client.table('notes').update({
                 'content': content,
                 'updated_at': datetime.utcnow().isoformat()
-            }).eq('id', note_id).execute()
+            }).eq('id', note_id).eq('user_id', current_user.id).execute()
 
             if not update_response.data:
-                return jsonify({'error': 'Failed to update note'}), 500
+                return jsonify({'error': 'Note not found'}), 404
 
             return jsonify({
                 'message': 'Note updated successfully',
@@ -137,16 +120,15 @@ def update_note(current_user, note_id):
 def delete_note(current_user, note_id):
     try:
         with get_db() as client:
-            # Verify note exists and belongs to user
-            response = client.table('notes').select('*').eq('id', note_id).eq('user_id', current_user).execute()
-            if not response.data:
-                return jsonify({'error': 'Note not found'}), 404
+            # Filter on owner too and only ask for the affected row count, not the deleted row
+            delete_response = client.table('notes') \
+                .delete(count=CountMethod.exact, returning=ReturnMethod.minimal) \
+                .eq('id', note_id) \
+                .eq('user_id', current_user.id) \
+                .execute()
 
-            # Delete note
-            delete_response = client.table('notes').delete().eq('id', note_id).execute()
-            
-            if not delete_response.data:
-                return jsonify({'error': 'Failed to delete note'}), 500
+            if not delete_response.count:
+                return jsonify({'error': 'Note not found'}), 404
 
             return jsonify({
                 'message': 'Note deleted successfully'
@@ -161,7 +143,7 @@ def delete_note(current_user, note_id):
 def get_notes_for_verse(current_user, verse_id):
     try:
         with get_db() as client:
-            response = client.table('notes').select('*').eq('user_id', current_user).eq('verse_id', verse_id).order('created_at', desc=True).execute()
+            response = client.table('notes').select('*').eq('user_id', current_user.id).eq('verse_id', verse_id).order('created_at', desc=True).execute()
             notes = response.data
             
         return jsonify([{
@@ -177,34 +159,30 @@ def get_notes_for_verse(current_user, verse_id):
         logger.error(f"Error fetching notes for verse: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-@notes_bp.route('/chapter/<book>/<chapter>/notes', methods=['GET'])
+def format_chapter_notes(notes):
+    """Format notes to include the nested user object expected by the frontend"""
+    return [{
+        'id': note['id'],
+        'user': {
+            'id': note['user_id'],
+            'is_self': True # Since we query by current_user, these are always self
+        },
+        'book': note['book'],
+        'chapter': note['chapter'],
+        'verse': note['verse'],
+        'content': note['content'],
+        'note_type': note['note_type'],
+        'created_at': note['created_at'],
+        'updated_at': note['updated_at']
+    } for note in notes]
+
+@notes_bp.route('/chapter/<book>/<int:chapter>/notes', methods=['GET'])
 @token_required
 def get_chapter_notes(current_user, book, chapter):
     try:
-        with get_db() as client:
-            response = client.table('notes').select('*').eq('user_id', current_user).eq('book', book).eq('chapter', chapter).order('created_at', desc=True).execute()
-            notes = response.data
-            
-        # Format the notes to include the nested user object expected by the frontend
-        formatted_notes = []
-        for note in notes:
-            formatted_notes.append({
-                'id': note['id'],
-                # Add the nested user object
-                'user': {
-                    'id': note['user_id'],
-                    'is_self': True # Since we query by current_user, these are always self
-                },
-                'book': note['book'],
-                'chapter': note['chapter'],
-                'verse': note['verse'],
-                'content': note['content'],
-                'note_type': note['note_type'],
-                'created_at': note['created_at'],
-                'updated_at': note['updated_at']
-            })
-            
-        return jsonify(formatted_notes)
+        notes = dal.notes_by_chapter(current_user.id, book, chapter)
+
+        return jsonify(format_chapter_notes(notes))
         
     except Exception as e:
         logger.error(f"Error fetching chapter notes: {str(e)}")
@@ -219,7 +197,7 @@ def get_single_chapter_note(current_user, book, chapter):
     try:
         with get_db() as client:
             response = client.table('notes').select('id, content, created_at, updated_at') \
-                .eq('user_id', current_user) \
+                .eq('user_id', current_user.id) \
                 .eq('book', book) \
                 .eq('chapter', chapter) \
                 .eq('note_type', 'chapter') \
@@ -241,7 +219,7 @@ def get_single_chapter_note(current_user, book, chapter):
                 }), 200 # Return 200 OK even if note doesn't exist yet
 
     except Exception as e:
-        logger.exception(f"Error fetching single chapter note for user {current_user}, book {book}, chapter {chapter}: {str(e)}")
+        logger.exception(f"Error fetching single chapter note for user {current_user.id}, book {book}, chapter {chapter}: {str(e)}")
         return jsonify({'error': 'An internal server error occurred while fetching the chapter note.'}), 500
 
 @notes_bp.route('/study', methods=['POST'])
@@ -256,64 +234,24 @@ def create_study_note(current_user):
 
         if not all([book, chapter, verse, content]):
             return jsonify({'error': 'Missing required fields (book, chapter, verse, content)'}), 400
+        try:
+            chapter, verse = int(chapter), int(verse)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'chapter and verse must be integers'}), 400
 
-        with get_db() as client:
-            current_time = datetime.utcnow().isoformat()
-            note_type = 'study'
-
-            # 1. Check if a study note already exists for this verse
-            existing_note_response = client.table('notes') \
-                .select('id') \
-                .eq('user_id', current_user) \
-                .eq('book', book) \
-                .eq('chapter', chapter) \
-                .eq('verse', verse) \
-                .eq('note_type', note_type) \
-                .limit(1) \
-                .execute()
-
-            if existing_note_response.data:
-                # 2a. Update existing note
-                existing_note_id = existing_note_response.data[0]['id']
-                update_data = {
-                    'content': content,
-                    'updated_at': current_time
-                }
-                response = client.table('notes') \
-                    .update(update_data) \
-                    .eq('id', existing_note_id) \
-                    .execute()
-                operation = 'updated'
-            else:
-                # 2b. Insert new note
-                insert_data = {
-                    'user_id': current_user,
-                    'book': book,
-                    'chapter': chapter,
-                    'verse': verse,
-                    'content': content,
-                    'note_type': note_type,
-                    'created_at': current_time, # Set created_at on initial insert
-                    'updated_at': current_time
-                }
-                response = client.table('notes') \
-                    .insert(insert_data) \
-                    .execute()
-                operation = 'created'
-
-            # Check for success
-            if not response.data:
-                logger.error(f"Failed to {operation} study note. User: {current_user}, Ref: {book} {chapter}:{verse}. Response: {response}")
-                return jsonify({'error': f'Failed to save study note ({operation} operation)'}), 500
+        # One atomic statement: concurrent double-submits cannot create duplicates
+        note = dal.upsert_study_note(current_user.id, book, chapter, verse, content)
+        if note is None:
+            return jsonify({'error': 'A quick note already exists for this verse'}), 409
+        operation = 'created' if note.pop('inserted') else 'updated'
 
-            # Return the created/updated note data
-            return jsonify({
-                'message': f'Study note {operation} successfully',
-                'note': response.data[0]
-            }), 200 if operation == 'updated' else 201 # 200 for update, 201 for create
+        return jsonify({
+            'message': f'Study note {operation} successfully',
+            'note': note
+        }), 200 if operation == 'updated' else 201 # 200 for update, 201 for create
 
     except Exception as e:
-        logger.exception(f"Error saving study note for user {current_user}, ref {book} {chapter}:{verse}: {str(e)}")
+        logger.exception(f"Error saving study note for user {current_user.id}, ref {book} {chapter}:{verse}: {str(e)}")
         return jsonify({'error': 'An internal server error occurred while saving the note.'}), 500
 
 @notes_bp.route('/quick', methods=['POST'])
@@ -333,7 +271,7 @@ def create_quick_note(current_user):
             # Create quick note
             current_time = datetime.utcnow().isoformat()
             note_data = {
-                'user_id': current_user,
+                'user_id': current_user.id,
                 'book': book,
                 'chapter': chapter,
                 'verse': verse,
@@ -368,60 +306,20 @@ def create_chapter_note(current_user):
 
         if not all([book, chapter, content]):
             return jsonify({'error': 'Missing required fields (book, chapter, content)'}), 400
+        try:
+            chapter = int(chapter)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'chapter must be an integer'}), 400
 
-        with get_db() as client:
-            current_time = datetime.utcnow().isoformat()
-            note_type = 'chapter'
-
-            # 1. Check if a chapter note already exists
-            existing_note_response = client.table('notes') \
-                .select('id') \
-                .eq('user_id', current_user) \
-                .eq('book', book) \
-                .eq('chapter', chapter) \
-                .eq('note_type', note_type) \
-                .limit(1) \
-                .execute()
-
-            if existing_note_response.data:
-                # 2a. Update existing note
-                existing_note_id = existing_note_response.data[0]['id']
-                update_data = {
-                    'content': content,
-                    'updated_at': current_time
-                }
-                response = client.table('notes') \
-                    .update(update_data) \
-                    .eq('id', existing_note_id) \
-                    .execute()
-                operation = 'updated'
-            else:
-                # 2b. Insert new note
-                insert_data = {
-                    'user_id': current_user,
-                    'book': book,
-                    'chapter': chapter,
-                    'content': content,
-                    'note_type': note_type, 
-                    'created_at': current_time,
-                    'updated_at': current_time
-                }
-                response = client.table('notes') \
-                    .insert(insert_data) \
-                    .execute()
-                operation = 'created'
-            
-            # Check for success
-            if not response.data:
-                logger.error(f"Failed to {operation} chapter note. User: {current_user}, Book: {book}, Chapter: {chapter}. Response: {response}")
-                return jsonify({'error': f'Failed to save chapter note ({operation} operation)'}), 500
+        # One atomic statement: concurrent double-submits cannot create duplicates
+        note = dal.upsert_chapter_note(current_user.id, book, chapter, content)
+        operation = 'created' if note.pop('inserted') else 'updated'
 
-            # Return the created/updated note data
-            return jsonify({
-                'message': f'Chapter note {operation} successfully',
-                'note': response.data[0]
-            }), 200 if operation == 'updated' else 201 # 200 for update, 201 for create
+        return jsonify({
+            'message': f'Chapter note {operation} successfully',
+            'note': note
+        }), 200 if operation == 'updated' else 201 # 200 for update, 201 for create
 
     except Exception as e:
-        logger.exception(f"Error saving chapter note for user {current_user}, book {book}, chapter {chapter}: {str(e)}")
+        logger.exception(f"Error saving chapter note for user {current_user.id}, book {book}, chapter {chapter}: {str(e)}")
         return jsonify({'error': 'An internal server error occurred while saving the note.'}), 500 
\ No newline at end of file
@@ -0,0 +1,175 @@
+# scripts/anthropic_stub.py
+"""Local stand-in for the subset of the Anthropic Messages API used by the app.
+
+Implements POST /v1/messages, both plain and streaming (server-sent events),
+with configurable latency and a configurable share of overloaded (529)
+responses, so ai_search_bible and generate_verse_insights can be exercised
+and benchmarked without calling the paid API.
+
+Example:
+    python scripts/anthropic_stub.py --port 8089 --latency lognormal:-0.5,0.6 --overload-rate 0.05
+    ANTHROPIC_BASE_URL=http://localhost:8089 ANTHROPIC_API_KEY=stub python app.py
+
+Latency specs (seconds):
+    constant:0.8
+    uniform:0.2,1.5
+    normal:0.8,0.2
+    lognormal:MU,SIGMA     (of the underlying normal; median is e**MU)
+"""
+import argparse
+import json
+import random
+import sys
+import time
+import uuid
+from pathlib import Path
+
+# Add the parent directory to the Python path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from flask import Flask, Response, jsonify, request
+
+from utils.prompt_builder import estimate_tokens
+
+app = Flask(__name__)
+
+SETTINGS = {
+    "latency": lambda: 0.0,
+    "tokens_per_sec": 200.0,
+    "output_tokens": 400,
+    "overload_rate": 0.0,
+    "retry_after": None,
+}
+
+_FILLER = (
+    "This passage invites the reader to consider how faith is lived out in ordinary days. "
+    "The themes of covenant, mercy and renewal run through each verse and connect to the wider story. "
+)
+
+
+def parse_latency(spec):
+    """Turn a latency spec into a sampler returning seconds"""
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    if kind == "constant" and len(values) == 1:
+        return lambda: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "normal" and len(values) == 2:
+        return lambda: max(random.gauss(values[0], values[1]), 0.0)
+    if kind == "lognormal" and len(values) == 2:
+        return lambda: random.lognormvariate(values[0], values[1])
+    raise argparse.ArgumentTypeError(f"Invalid latency spec: {spec!r}")
+
+
+def _prompt_text(body):
+    parts = [body.get("system") or ""]
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, list):
+            content = " ".join(block.get("text", "") for block in content if isinstance(block, dict))
+        parts.append(content or "")
+    return "\n".join(parts)
+
+
+def _reply_text(prompt, max_tokens):
+    # The AI search prompt asks for a bare JSON reference
+    if "Respond ONLY with a JSON object" in prompt:
+        return json.dumps({"book": "John", "chapter": 3})
+    target_tokens = min(max_tokens, SETTINGS["output_tokens"])
+    text = ""
+    while estimate_tokens(text) < target_tokens:
+        text += _FILLER
+    return text.strip()
+
+
+def _overloaded():
+    response = jsonify({"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}})
+    response.status_code = 529
+    if SETTINGS["retry_after"] is not None:
+        response.headers["retry-after"] = str(SETTINGS["retry_after"])
+    return response
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route("/v1/messages", methods=["POST"])
+def create_message():
+    body = request.get_json(silent=True) or {}
+    if not body.get("messages") or not body.get("max_tokens"):
+        return jsonify({"type": "error", "error": {"type": "invalid_request_error",
+                                                   "message": "messages and max_tokens are required"}}), 400
+
+    # Time to first token
+    time.sleep(SETTINGS["latency"]())
+
+    if random.random() < SETTINGS["overload_rate"]:
+        return _overloaded()
+
+    prompt = _prompt_text(body)
+    text = _reply_text(prompt, body["max_tokens"])
+    usage = {"input_tokens": estimate_tokens(prompt), "output_tokens": estimate_tokens(text)}
+    message_id = f"msg_stub_{uuid.uuid4().hex[:24]}"
+    model = body.get("model", "stub")
+    per_token_delay = 1.0 / SETTINGS["tokens_per_sec"] if SETTINGS["tokens_per_sec"] > 0 else 0
+
+    if body.get("stream"):
+        def generate():
+            yield _sse("message_start", {"type": "message_start", "message": {
+                "id": message_id, "type": "message", "role": "assistant", "model": model,
+                "content": [], "stop_reason": None, "stop_sequence": None,
+                "usage": {"input_tokens": usage["input_tokens"], "output_tokens": 0}}})
+            yield _sse("content_block_start", {"type": "content_block_start", "index": 0,
+                                               "content_block": {"type": "text", "text": ""}})
+            words = text.split(" ")
+            for i in range(0, len(words), 4):
+                chunk = " ".join(words[i:i + 4]) + (" " if i + 4 < len(words) else "")
+                time.sleep(per_token_delay * estimate_tokens(chunk))
+                yield _sse("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                                   "delta": {"type": "text_delta", "text": chunk}})
+            yield _sse("content_block_stop", {"type": "content_block_stop", "index": 0})
+            yield _sse("message_delta", {"type": "message_delta",
+                                         "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                         "usage": {"output_tokens": usage["output_tokens"]}})
+            yield _sse("message_stop", {"type": "message_stop"})
+
+        return Response(generate(), mimetype="text/event-stream")
+
+    # Non-streaming responses arrive once generation would have finished
+    time.sleep(per_token_delay * usage["output_tokens"])
+    return jsonify({
+        "id": message_id,
+        "type": "message",
+        "role": "assistant",
+        "model": model,
+        "content": [{"type": "text", "text": text}],
+        "stop_reason": "end_turn",
+        "stop_sequence": None,
+        "usage": usage,
+    })
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local stub of the Anthropic Messages API")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=parse_latency, default=parse_latency("constant:0.5"),
+                        help="Time-to-first-token distribution, e.g. lognormal:-0.5,0.6")
+    parser.add_argument("--tokens-per-sec", type=float, default=200.0, help="Simulated generation speed (0 = instant)")
+    parser.add_argument("--output-tokens", type=int, default=400, help="Length of generated replies")
+    parser.add_argument("--overload-rate", type=float, default=0.0, help="Share of requests answered with 529 overloaded")
+    parser.add_argument("--retry-after", type=float, help="Retry-After seconds sent with overloaded responses")
+    args = parser.parse_args(argv)
+
+    SETTINGS.update({
+        "latency": args.latency,
+        "tokens_per_sec": args.tokens_per_sec,
+        "output_tokens": args.output_tokens,
+        "overload_rate": args.overload_rate,
+        "retry_after": args.retry_after,
+    })
+    app.run(host="127.0.0.1", port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
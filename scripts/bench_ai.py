@@ -0,0 +1,198 @@
+# scripts/bench_ai.py
+"""Latency/throughput benchmark for the AI code paths.
+
+Drives either the AI search endpoint of a running server over HTTP, or
+generate_verse_insights in-process, from a pool of concurrent clients and
+reports throughput, latency percentiles and how saturated the server's
+request slots were. Point the app at scripts/anthropic_stub.py to keep the
+paid API out of the loop.
+
+Examples:
+    # Terminal 1: stub API.  Terminal 2: app with ANTHROPIC_BASE_URL=http://localhost:8089
+    python scripts/bench_ai.py ai-search --base-url http://localhost:5001 --token $TOKEN \\
+        --concurrency 16 --duration 30
+
+    ANTHROPIC_BASE_URL=http://localhost:8089 ANTHROPIC_API_KEY=stub \\
+        python scripts/bench_ai.py insights --concurrency 8 --requests 200 --unique
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Add the parent directory to the Python path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+SAMPLE_QUERIES = [
+    "the good shepherd",
+    "love is patient, love is kind",
+    "in the beginning was the word",
+    "the lord is my shepherd",
+    "faith without works",
+    "the prodigal son",
+    "do not be anxious about anything",
+    "the armor of god",
+]
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class Recorder:
+    """Collects (start, end, outcome) samples from all client threads"""
+
+    def __init__(self):
+        self.samples = []
+        self._lock = threading.Lock()
+
+    def record(self, start, end, outcome):
+        with self._lock:
+            self.samples.append((start, end, outcome))
+
+
+def saturation(samples, capacity, started, finished):
+    """Time-weighted mean in-flight requests, and the share of time all server slots were busy"""
+    events = []
+    for start, end, _ in samples:
+        events.append((start, 1))
+        events.append((end, -1))
+    events.sort()
+
+    in_flight = 0
+    weighted = 0.0
+    saturated_time = 0.0
+    previous = started
+    for moment, delta in events:
+        span = moment - previous
+        weighted += in_flight * span
+        if in_flight >= capacity:
+            saturated_time += span
+        in_flight += delta
+        previous = moment
+
+    wall = max(finished - started, 1e-9)
+    return weighted / wall, saturated_time / wall
+
+
+def make_ai_search_call(args):
+    import requests
+
+    session = requests.Session()
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+    counter = iter(range(10 ** 9))
+
+    def call():
+        query = SAMPLE_QUERIES[next(counter) % len(SAMPLE_QUERIES)]
+        if args.unique:
+            query = f"{query} {uuid.uuid4().hex[:6]}"
+        response = session.get(f"{args.base_url.rstrip('/')}/api/bible/ai-search",
+                               params={"q": query}, headers=headers, timeout=args.timeout)
+        return str(response.status_code)
+
+    return call
+
+
+def make_insights_call(args):
+    from utils.rag import generate_verse_insights
+
+    verses = [{"book": "Psalms", "chapter": 119, "verse": i,
+               "text": "Blessed are the undefiled in the way, who walk in the law of the LORD."}
+              for i in range(1, args.verses + 1)]
+
+    def call():
+        # A unique user_context defeats request coalescing so every call reaches the API
+        preferences = {"user_context": {"run": uuid.uuid4().hex}} if args.unique else {}
+        result = generate_verse_insights(verses, [], {}, preferences, use_precomputed=False)
+        return "error" if "error" in result else "ok"
+
+    return call
+
+
+def run(call, args):
+    recorder = Recorder()
+    deadline = time.monotonic() + args.duration if args.duration else None
+    remaining = [args.requests]
+    lock = threading.Lock()
+
+    def take_ticket():
+        with lock:
+            if deadline is not None:
+                return time.monotonic() < deadline
+            if remaining[0] <= 0:
+                return False
+            remaining[0] -= 1
+            return True
+
+    def client():
+        while take_ticket():
+            start = time.monotonic()
+            try:
+                outcome = call()
+            except Exception as e:
+                outcome = type(e).__name__
+            recorder.record(start, time.monotonic(), outcome)
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for _ in range(args.concurrency):
+            executor.submit(client)
+    finished = time.monotonic()
+    return recorder.samples, started, finished
+
+
+def summarize(samples, started, finished, capacity):
+    latencies = sorted(end - start for start, end, _ in samples)
+    elapsed = finished - started
+    mean_in_flight, saturated_share = saturation(samples, capacity, started, finished)
+    return {
+        "requests": len(samples),
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else None,
+        "latency_s": {
+            "p50": round(percentile(latencies, 50), 3) if latencies else None,
+            "p90": round(percentile(latencies, 90), 3) if latencies else None,
+            "p99": round(percentile(latencies, 99), 3) if latencies else None,
+            "max": round(latencies[-1], 3) if latencies else None,
+        },
+        "outcomes": dict(Counter(outcome for _, _, outcome in samples)),
+        "worker_saturation": {
+            "capacity": capacity,
+            "mean_in_flight": round(mean_in_flight, 2),
+            "utilization": round(min(mean_in_flight / capacity, 1.0), 3) if capacity else None,
+            "time_all_slots_busy": round(saturated_share, 3),
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the AI search and insights paths")
+    parser.add_argument("target", choices=["ai-search", "insights"])
+    parser.add_argument("--base-url", default="http://localhost:5001", help="Server for ai-search")
+    parser.add_argument("--token", help="Bearer token for ai-search")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients")
+    parser.add_argument("--requests", type=int, default=100, help="Total requests (ignored with --duration)")
+    parser.add_argument("--duration", type=float, help="Run for this many seconds instead of a fixed count")
+    parser.add_argument("--capacity", type=int, default=2,
+                        help="Server request slots (gunicorn workers x threads) used for saturation")
+    parser.add_argument("--verses", type=int, default=40, help="Chapter length for insights")
+    parser.add_argument("--unique", action="store_true", help="Make every request distinct to bypass coalescing")
+    parser.add_argument("--timeout", type=float, default=180)
+    args = parser.parse_args(argv)
+
+    call = make_ai_search_call(args) if args.target == "ai-search" else make_insights_call(args)
+    samples, started, finished = run(call, args)
+    print(json.dumps(summarize(samples, started, finished, args.capacity), indent=2))
+
+
+if __name__ == "__main__":
+    main()
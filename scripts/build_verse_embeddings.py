@@ -0,0 +1,39 @@
+# scripts/build_verse_embeddings.py
+"""Embed every verse for the semantic half of hybrid search.
+
+Writes the vectors and verse ids to VERSE_EMBEDDINGS_PATH (default:
+verse_embeddings.npz next to app.py), which the search index loads at startup.
+
+Example:
+    python scripts/build_verse_embeddings.py --processes 4
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+# Add the parent directory to the Python path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from utils.search_index import VERSE_EMBEDDINGS_PATH, build_verse_embeddings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build verse embeddings for hybrid search")
+    parser.add_argument('--output', default=VERSE_EMBEDDINGS_PATH, help="Where to write the .npz file")
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                        help="Encoder processes; each loads its own model")
+    args = parser.parse_args(argv)
+
+    started = time.time()
+    count = build_verse_embeddings(args.output, processes=args.processes)
+    elapsed = time.time() - started
+    print(f"Embedded {count} verses into {args.output} in {elapsed:.1f}s ({count / elapsed:.1f} verses/sec)")
+
+
+if __name__ == '__main__':
+    main()
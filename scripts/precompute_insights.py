@@ -0,0 +1,164 @@
+# scripts/precompute_insights.py
+"""Precompute AI insights for popular chapters.
+
+Walks every (chapter, preference profile) pair, generates insights with
+bounded parallelism and a request-rate ceiling, and stores the results where
+generate_verse_insights can serve them without calling the API. Pairs that
+are already stored are skipped, so an interrupted run can simply be restarted.
+
+Example:
+    python scripts/precompute_insights.py --chapters popular_chapters.txt \\
+        --profiles profiles.json --concurrency 4 --rate 30
+
+To run against a local stub of the Messages API instead of Anthropic:
+    ANTHROPIC_BASE_URL=http://localhost:8089 ANTHROPIC_API_KEY=stub \\
+        python scripts/precompute_insights.py --chapters popular_chapters.txt
+"""
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+# Add the parent directory to the Python path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from utils.insight_store import has_insight, put_insight, profile_key
+from utils.rag import generate_verse_insights
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("precompute_insights")
+
+
+class RateLimiter:
+    """Spaces calls evenly so at most `per_minute` start in any minute"""
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def load_chapters(path):
+    """Read 'Book Chapter' lines, e.g. '1 Corinthians 13'. Blank lines and # comments are skipped."""
+    chapters = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            book, _, chapter = line.rpartition(' ')
+            if not book or not chapter.isdigit():
+                raise ValueError(f"{path}:{line_number}: expected 'Book Chapter', got {line!r}")
+            chapters.append((book, int(chapter)))
+    return chapters
+
+
+def load_profiles(path):
+    if not path:
+        return [{}]  # The default ai_preferences profile
+    with open(path, 'r', encoding='utf-8') as f:
+        profiles = json.load(f)
+    if not isinstance(profiles, list) or not all(isinstance(p, dict) for p in profiles):
+        raise ValueError(f"{path}: expected a JSON list of preference objects")
+    return profiles
+
+
+def make_verse_loader(verses_json):
+    """Return a function (book, chapter) -> verses, from a local JSON file or Supabase"""
+    if verses_json:
+        with open(verses_json, 'r', encoding='utf-8') as f:
+            local_verses = json.load(f)
+        return lambda book, chapter: local_verses.get(f"{book} {chapter}", [])
+
+    from database import get_db
+
+    def load_from_db(book, chapter):
+        with get_db() as client:
+            response = client.table('bible_verses') \
+                .select('book_name, chapter, verse, text') \
+                .eq('book_name', book) \
+                .eq('chapter', chapter) \
+                .order('verse') \
+                .execute()
+        return [{
+            'book': v['book_name'],
+            'chapter': v['chapter'],
+            'verse': v['verse'],
+            'text': v['text']
+        } for v in response.data]
+
+    return load_from_db
+
+
+def precompute_one(book, chapter, profile, load_verses, limiter):
+    verses = load_verses(book, chapter)
+    if not verses:
+        raise ValueError(f"No verses found for {book} {chapter}")
+
+    limiter.wait()
+    result = generate_verse_insights(verses, [], {}, profile, use_precomputed=False)
+    if 'error' in result:
+        raise RuntimeError(result['error'])
+
+    result['generated_at'] = time.time()
+    return put_insight(book, chapter, profile, result)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute AI insights for popular chapters")
+    parser.add_argument('--chapters', required=True, help="File with one 'Book Chapter' per line")
+    parser.add_argument('--profiles', help="JSON list of ai_preferences objects (default: the default profile)")
+    parser.add_argument('--verses-json', help="Read verses from a JSON file keyed by 'Book Chapter' instead of Supabase")
+    parser.add_argument('--concurrency', type=int, default=4, help="Maximum concurrent API calls")
+    parser.add_argument('--rate', type=float, default=30, help="Maximum API calls started per minute")
+    parser.add_argument('--force', action='store_true', help="Regenerate insights that are already stored")
+    args = parser.parse_args(argv)
+
+    chapters = load_chapters(args.chapters)
+    profiles = load_profiles(args.profiles)
+    load_verses = make_verse_loader(args.verses_json)
+    limiter = RateLimiter(args.rate)
+
+    jobs = [(book, chapter, profile) for book, chapter in chapters for profile in profiles]
+    pending = [job for job in jobs if args.force or not has_insight(*job)]
+    logger.info(f"{len(jobs)} chapter/profile pairs, {len(jobs) - len(pending)} already stored, {len(pending)} to generate")
+
+    failures = 0
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(args.concurrency, 1)) as executor:
+        futures = {
+            executor.submit(precompute_one, book, chapter, profile, load_verses, limiter): (book, chapter, profile)
+            for book, chapter, profile in pending
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            book, chapter, profile = futures[future]
+            label = f"{book} {chapter} [profile {profile_key(profile)}]"
+            try:
+                future.result()
+                logger.info(f"({done}/{len(pending)}) stored {label}")
+            except Exception as e:
+                failures += 1
+                logger.error(f"({done}/{len(pending)}) failed {label}: {e}")
+
+    elapsed = time.monotonic() - started
+    logger.info(f"Finished in {elapsed:.1f}s: {len(pending) - failures} generated, {failures} failed")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
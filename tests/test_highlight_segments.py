@@ -0,0 +1,67 @@
+# tests/test_highlight_segments.py
+"""Paint-over and row-diff logic for verse highlights (utils/highlight_segments.py)."""
+from utils.highlight_segments import diff_segments, paint
+
+
+def _row(row_id, start, end, color):
+    return {'id': row_id, 'start': start, 'end': end, 'color': color}
+
+
+def test_paint_on_an_empty_verse_adds_one_segment():
+    assert paint([], 5, 10, 'yellow') == [{'start': 5, 'end': 10, 'color': 'yellow'}]
+
+
+def test_paint_splits_the_segment_it_lands_inside():
+    segments = paint([_row(1, 0, 20, 'yellow')], 5, 10, 'green')
+    assert segments == [
+        {'start': 0, 'end': 5, 'color': 'yellow'},
+        {'start': 5, 'end': 10, 'color': 'green'},
+        {'start': 10, 'end': 20, 'color': 'yellow'},
+    ]
+
+
+def test_paint_merges_touching_segments_of_the_same_colour():
+    segments = paint([_row(1, 0, 5, 'yellow')], 5, 10, 'yellow')
+    assert segments == [{'start': 0, 'end': 10, 'color': 'yellow'}]
+
+
+def test_erase_removes_the_middle_of_a_segment():
+    segments = paint([_row(1, 0, 20, 'yellow')], 5, 10, None)
+    assert segments == [
+        {'start': 0, 'end': 5, 'color': 'yellow'},
+        {'start': 10, 'end': 20, 'color': 'yellow'},
+    ]
+
+
+def test_diff_for_a_new_verse_inserts_every_segment():
+    segments = paint([], 5, 10, 'yellow')
+    keep, update, delete, insert = diff_segments([], segments)
+    assert (keep, update, delete) == ([], [], [])
+    assert insert == segments
+
+
+def test_diff_for_a_split_reuses_the_row_and_inserts_the_rest():
+    rows = [_row(1, 0, 20, 'yellow')]
+    keep, update, delete, insert = diff_segments(rows, paint(rows, 5, 10, 'green'))
+    assert keep == [] and delete == []
+    # The original row keeps one of its yellow pieces; the other two pieces are new rows
+    assert update == [(rows[0], {'start': 0, 'end': 5, 'color': 'yellow'})]
+    assert insert == [
+        {'start': 5, 'end': 10, 'color': 'green'},
+        {'start': 10, 'end': 20, 'color': 'yellow'},
+    ]
+
+
+def test_diff_keeps_untouched_rows_and_deletes_erased_ones():
+    rows = [_row(1, 0, 5, 'yellow'), _row(2, 10, 15, 'green')]
+    keep, update, delete, insert = diff_segments(rows, paint(rows, 10, 15, None))
+    assert keep == [rows[0]]
+    assert (update, insert) == ([], [])
+    assert delete == [rows[1]]
+
+
+def test_diff_moves_a_boundary_with_an_update():
+    rows = [_row(1, 0, 10, 'yellow')]
+    keep, update, delete, insert = diff_segments(rows, paint(rows, 5, 10, None))
+    assert (keep, delete, insert) == ([], [], [])
+    assert update == [(rows[0], {'start': 0, 'end': 5, 'color': 'yellow'})]
@@ -0,0 +1,179 @@
+# tests/test_highlights.py
+"""Writing highlight strokes through routes/highlight.py against an in-memory session."""
+import itertools
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("sqlalchemy")
+
+from sqlalchemy.dialects import postgresql  # noqa: E402
+
+from routes import highlight  # noqa: E402
+from utils.highlight_segments import paint  # noqa: E402
+
+USER_ID = uuid.uuid4()
+CREATED_AT = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+class _Result:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def all(self):
+        return self._rows
+
+
+class _Query:
+    def __init__(self, session):
+        self.session = session
+
+    def filter(self, *criteria):
+        return self
+
+    def delete(self, synchronize_session=None):
+        self.session.deleted = True
+        return 0
+
+
+class FakeSession:
+    """Records the statements _save_highlight_segments issues and answers the INSERT ... RETURNING"""
+
+    def __init__(self):
+        self.ids = itertools.count(100)
+        self.inserted = []
+        self.updated = []
+        self.deleted = False
+
+    def query(self, model):
+        return _Query(self)
+
+    def bulk_update_mappings(self, model, mappings):
+        self.updated.extend(mappings)
+
+    def execute(self, statement):
+        params = statement.compile(dialect=postgresql.dialect()).params
+        rows = []
+        for i in itertools.count():
+            if f'verse_m{i}' not in params:
+                break
+            row = {column: params[f'{column}_m{i}']
+                   for column in ('user_id', 'book', 'chapter', 'verse', 'start_offset', 'end_offset', 'color')}
+            self.inserted.append(row)
+            rows.append(_Row(id=next(self.ids), created_at=CREATED_AT, updated_at=None, **row))
+        return _Result(rows)
+
+
+class _Row:
+    def __init__(self, **values):
+        self.__dict__.update(values)
+
+
+def _stored(row_id, start, end, color):
+    return {'id': row_id, 'start': start, 'end': end, 'color': color,
+            'created_at': CREATED_AT, 'updated_at': None}
+
+
+def _offsets(highlights):
+    return [(h['start_offset'], h['end_offset'], h['color']) for h in highlights]
+
+
+def test_first_highlight_on_a_verse_is_inserted():
+    db = FakeSession()
+    segments = paint([], 5, 10, 'yellow')
+    saved = highlight._save_highlight_segments(db, USER_ID, 'John', 3, {16: segments}, {16: []})
+    assert db.inserted == [{'user_id': USER_ID, 'book': 'John', 'chapter': 3, 'verse': 16,
+                            'start_offset': 5, 'end_offset': 10, 'color': 'yellow'}]
+    assert db.updated == [] and not db.deleted
+    assert _offsets(saved[16]) == [(5, 10, 'yellow')]
+    assert saved[16][0]['id'] == 100
+
+
+def test_split_updates_the_row_and_inserts_the_new_pieces():
+    db = FakeSession()
+    rows = [_stored(1, 0, 20, 'yellow')]
+    segments = paint(rows, 5, 10, 'green')
+    saved = highlight._save_highlight_segments(db, USER_ID, 'John', 3, {16: segments}, {16: rows})
+    assert [(u['id'], u['start_offset'], u['end_offset']) for u in db.updated] == [(1, 0, 5)]
+    assert [(r['start_offset'], r['end_offset'], r['color']) for r in db.inserted] == [
+        (5, 10, 'green'), (10, 20, 'yellow')]
+    assert _offsets(saved[16]) == [(0, 5, 'yellow'), (5, 10, 'green'), (10, 20, 'yellow')]
+    assert [h['id'] for h in saved[16]] == [1, 100, 101]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    import jwt
+    from flask import Flask
+
+    from utils import auth
+
+    secret = 'test-secret-long-enough-for-hs256-keys'
+    monkeypatch.setattr(auth, 'JWT_SECRET', secret)
+    db = FakeSession()
+    stored = {16: [_stored(1, 0, 20, 'yellow')]}
+
+    class _Scope:
+        def __enter__(self):
+            return db
+
+        def __exit__(self, *exc):
+            return False
+
+    monkeypatch.setattr(highlight, 'get_db_session', lambda **kwargs: _Scope())
+    monkeypatch.setattr(highlight, '_load_highlight_rows',
+                        lambda db, user_id, book, chapter, verses: {v: list(stored.get(v, [])) for v in verses})
+    monkeypatch.setattr(highlight.dal, 'verses_by_chapter', lambda book, chapter: [
+        {'verse': 16, 'text': 'x' * 30}, {'verse': 17, 'text': 'y' * 40}, {'verse': 18, 'text': 'z' * 25}])
+
+    app = Flask(__name__)
+    app.register_blueprint(highlight.highlight_bp)
+    token = jwt.encode({'sub': str(USER_ID), 'aud': 'authenticated'}, secret, algorithm='HS256')
+    test_client = app.test_client()
+    test_client.environ_base['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+    test_client.db = db
+    return test_client
+
+
+def test_batch_span_paints_across_verses(client):
+    response = client.post('/api/highlights/batch', json={
+        'book': 'John', 'chapter': 3, 'color': 'green',
+        'start_verse': 16, 'start_offset': 10, 'end_verse': 18, 'end_offset': 5,
+    })
+    assert response.status_code == 200
+    verses = response.get_json()['verses']
+    assert _offsets(verses['16']) == [(0, 10, 'yellow'), (10, 30, 'green')]
+    assert _offsets(verses['17']) == [(0, 40, 'green')]
+    assert _offsets(verses['18']) == [(0, 5, 'green')]
+    # Verse 16's row is trimmed in place; the other three segments are new rows
+    assert [(u['id'], u['start_offset'], u['end_offset']) for u in client.db.updated] == [(1, 0, 10)]
+    assert len(client.db.inserted) == 3
+
+
+def test_batch_operations_apply_in_order(client):
+    response = client.post('/api/highlights/batch', json={
+        'book': 'John', 'chapter': 3, 'operations': [
+            {'verse': 16, 'start_offset': 5, 'end_offset': 10, 'color': 'green'},
+            {'verse': 16, 'start_offset': 15, 'end_offset': 20, 'color': None},
+            {'verse': 17, 'start_offset': 0, 'end_offset': 4, 'color': 'blue'},
+        ],
+    })
+    assert response.status_code == 200
+    verses = response.get_json()['verses']
+    assert _offsets(verses['16']) == [(0, 5, 'yellow'), (5, 10, 'green'), (10, 15, 'yellow')]
+    assert _offsets(verses['17']) == [(0, 4, 'blue')]
+
+
+def test_batch_span_reports_a_failed_verse_lookup(client, monkeypatch):
+    def unavailable(book, chapter):
+        raise OSError("connection refused")
+
+    monkeypatch.setattr(highlight.dal, 'verses_by_chapter', unavailable)
+    response = client.post('/api/highlights/batch', json={
+        'book': 'John', 'chapter': 3, 'color': 'green',
+        'start_verse': 16, 'start_offset': 0, 'end_verse': 17, 'end_offset': 5,
+    })
+    assert response.status_code == 500
+    assert response.get_json() == {'error': 'Failed to process highlights'}
@@ -0,0 +1,129 @@
+# tests/test_query_plans.py
+"""The highlight, bookmark and notes queries must be served by their indexes.
+
+Runs EXPLAIN for each query the routes issue against a migrated Postgres
+database and fails unless the plan reads the table through the expected
+index, with no sequential scan, bitmap combination or extra sort. Sequential
+and bitmap scans are disabled for the session so that a near-empty test
+database plans the same way a full one does: if the expected index cannot
+answer a query, the planner falls back to another index and the test fails.
+
+Skipped unless QUERY_PLAN_DATABASE_URL points at a database migrated to head:
+    alembic upgrade head
+    QUERY_PLAN_DATABASE_URL=postgresql://localhost/bible_test python -m pytest tests/test_query_plans.py
+"""
+import json
+import os
+import uuid
+
+import pytest
+
+sqlalchemy = pytest.importorskip("sqlalchemy")
+
+DATABASE_URL = os.getenv("QUERY_PLAN_DATABASE_URL")
+
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="QUERY_PLAN_DATABASE_URL is not set")
+
+SAMPLE_USER = str(uuid.uuid4())
+
+# (name, SQL, parameters, expected index, whether the index must also provide the order)
+# Each statement mirrors a query in routes/highlight.py, routes/bookmarks_routes.py or routes/notes.py.
+CASES = [
+    (
+        "highlights for a chapter",
+        """SELECT * FROM highlights
+           WHERE user_id = :user_id AND book = :book AND chapter = :chapter
+           ORDER BY verse, start_offset""",
+        {"user_id": SAMPLE_USER, "book": "John", "chapter": 3},
+        "ix_highlights_user_book_chapter_verse",
+        True,
+    ),
+    (
+        "highlights for verses being painted",
+        """SELECT * FROM highlights
+           WHERE user_id = :user_id AND book = :book AND chapter = :chapter AND verse IN (16, 17, 18)
+           ORDER BY verse, start_offset""",
+        {"user_id": SAMPLE_USER, "book": "John", "chapter": 3},
+        "ix_highlights_user_book_chapter_verse",
+        False,
+    ),
+    (
+        # create_bookmark and the import resolve duplicates through this index (ON CONFLICT arbiter)
+        "bookmark duplicate check",
+        """SELECT * FROM bookmarks
+           WHERE user_id = :user_id AND book = :book AND chapter = :chapter AND verse = :verse
+           LIMIT 1""",
+        {"user_id": SAMPLE_USER, "book": "John", "chapter": 3, "verse": 16},
+        "uq_bookmarks_user_verse",
+        False,
+    ),
+    (
+        "bookmarks newest first",
+        """SELECT * FROM bookmarks
+           WHERE user_id = :user_id
+           ORDER BY created_at DESC, id DESC""",
+        {"user_id": SAMPLE_USER},
+        "ix_bookmarks_user_created_at",
+        True,
+    ),
+    (
+        "bookmarks page after a cursor",
+        """SELECT id, book, chapter, verse, created_at FROM bookmarks
+           WHERE user_id = :user_id AND (created_at, id) < (:created_at, :id)
+           ORDER BY created_at DESC, id DESC
+           LIMIT 101""",
+        {"user_id": SAMPLE_USER, "created_at": "2025-01-01T00:00:00+00:00", "id": 1000},
+        "ix_bookmarks_user_created_at",
+        True,
+    ),
+    (
+        "notes first page",
+        """SELECT id, content, created_at FROM notes
+           WHERE user_id = :user_id
+           ORDER BY created_at DESC, id DESC
+           LIMIT 101""",
+        {"user_id": SAMPLE_USER},
+        "ix_notes_user_created_at",
+        True,
+    ),
+]
+
+# Plan nodes that mean the index is not doing the work on its own
+FORBIDDEN_NODES = {"Seq Scan", "BitmapAnd", "BitmapOr"}
+
+
+def plan_nodes(plan):
+    """Every node of an EXPLAIN (FORMAT JSON) plan, depth first"""
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+@pytest.fixture(scope="module")
+def connection():
+    engine = sqlalchemy.create_engine(DATABASE_URL)
+    with engine.connect() as conn:
+        transaction = conn.begin()
+        conn.execute(sqlalchemy.text("SET LOCAL enable_seqscan = off"))
+        conn.execute(sqlalchemy.text("SET LOCAL enable_bitmapscan = off"))
+        yield conn
+        transaction.rollback()
+    engine.dispose()
+
+
+@pytest.mark.parametrize("name, sql, params, expected_index, ordered", CASES, ids=[case[0] for case in CASES])
+def test_query_uses_index(connection, name, sql, params, expected_index, ordered):
+    result = connection.execute(sqlalchemy.text(f"EXPLAIN (FORMAT JSON) {sql}"), params).scalar()
+    plan = (json.loads(result) if isinstance(result, str) else result)[0]["Plan"]
+    nodes = list(plan_nodes(plan))
+    plan_text = json.dumps(plan, indent=2)
+
+    forbidden = [node["Node Type"] for node in nodes if node["Node Type"] in FORBIDDEN_NODES]
+    assert not forbidden, f"plan contains {', '.join(forbidden)}:\n{plan_text}"
+
+    used = sorted({node["Index Name"] for node in nodes if "Index Name" in node})
+    assert expected_index in used, f"expected {expected_index}, planner used {used or 'no index'}:\n{plan_text}"
+
+    if ordered:
+        sorts = [node["Node Type"] for node in nodes if node["Node Type"] in ("Sort", "Incremental Sort")]
+        assert not sorts, f"rows are sorted after the scan instead of read in index order:\n{plan_text}"
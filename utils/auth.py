@@ -3,19 +3,39 @@ import jwt
 import bcrypt
 from datetime import datetime, timedelta
 from functools import wraps
-from flask import request, jsonify
+from flask import request, jsonify, g
 import os
 import logging
+from urllib.error import URLError
+from utils.cache import TTLCache
+from utils.entitlements import is_premium
 
 logger = logging.getLogger(__name__)
 
 JWT_SECRET = os.getenv('JWT_SECRET', 'your-secret-key')  # In production, use a proper secret key
 JWT_EXPIRATION_HOURS = 24
 
+# Projects using asymmetric JWT signing keys publish them here; fetched keys are cached in-process
+SUPABASE_URL = os.getenv('SUPABASE_URL')
+SUPABASE_JWKS_URL = os.getenv(
+    'SUPABASE_JWKS_URL',
+    f"{SUPABASE_URL.rstrip('/')}/auth/v1/.well-known/jwks.json" if SUPABASE_URL else None
+)
+JWKS_CACHE_SECONDS = int(os.getenv('JWKS_CACHE_SECONDS', 600))
+_jwks_client = None
+
+# Recently verified tokens -> CurrentUser, so repeat requests skip HMAC verification and parsing
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 1024))
+TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', 300))
+_verified_tokens = TTLCache('verified_tokens', maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
+
 # !!! TEMPORARY DEBUG LOG - REMOVE AFTER USE !!!
 # print(f"[AUTH DEBUG] JWT_SECRET being used by backend: {JWT_SECRET}") # REMOVED FOR SECURITY
 # !!! END TEMPORARY DEBUG LOG !!!
 
+class SigningKeysUnavailable(Exception):
+    """Raised when the JWKS endpoint cannot be reached to verify an asymmetric token"""
+
 def hash_password(password):
     """Hash a password using bcrypt"""
     salt = bcrypt.gensalt()
@@ -37,85 +57,149 @@ def generate_token(user_id):
         algorithm='HS256'
     )
 
-def token_required(f):
-    """Decorator to protect routes with JWT"""
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        logger.info(f"token_required decorator executing for: {request.path}")
-        token = None
-        auth_header = request.headers.get('Authorization')
-        
-        if auth_header:
-            logger.info(f"Authorization header found: {auth_header[:15]}...")
-            try:
-                token = auth_header.split(" ")[1]
-                logger.info(f"Token extracted: {token[:10]}...")
-            except IndexError:
-                logger.warning("Invalid token format in Authorization header.")
-                return jsonify({'error': 'Invalid token format'}), 401
-        else:
-            logger.warning("Authorization header missing.")
-
-        if not token:
-            logger.warning("Token is missing or could not be extracted.")
-            return jsonify({'error': 'Token is required'}), 401
-
+def _get_jwks_client():
+    global _jwks_client
+    if _jwks_client is None:
+        if not SUPABASE_JWKS_URL:
+            raise jwt.InvalidTokenError("Asymmetric token received but no JWKS URL is configured")
+        _jwks_client = jwt.PyJWKClient(SUPABASE_JWKS_URL, cache_keys=True, lifespan=JWKS_CACHE_SECONDS)
+    return _jwks_client
+
+def decode_token(token):
+    """Verify a Supabase access token locally and return its claims.
+
+    HS256 tokens are checked against the project JWT secret; tokens signed
+    with an asymmetric key are checked against the cached JWKS. Raises
+    jwt.InvalidTokenError (or a subclass such as ExpiredSignatureError), or
+    SigningKeysUnavailable if the JWKS cannot be fetched.
+    """
+    algorithm = jwt.get_unverified_header(token).get('alg')
+    if algorithm == 'HS256':
+        return jwt.decode(token, JWT_SECRET, algorithms=["HS256"], audience='authenticated')
+    if algorithm in ('RS256', 'ES256'):
         try:
-            logger.info(f"[AUTH DEBUG] Attempting to decode token: {token[:15]}... with secret: {JWT_SECRET[:10]}... (and on file load: {os.getenv('JWT_SECRET')[:10]}...)")
-            data = jwt.decode(token, JWT_SECRET, algorithms=["HS256"], audience='authenticated')
-            current_user_id = data['sub']
-            logger.info(f"Token successfully decoded for user_id (from sub claim): {current_user_id}")
-        except jwt.ExpiredSignatureError:
-            logger.warning("Token has expired.")
-            return jsonify({'error': 'Token has expired'}), 401
-        except jwt.InvalidTokenError as e:
-            logger.warning(f"Invalid token: {e}")
-            return jsonify({'error': 'Invalid token'}), 401
-        except Exception as e:
-             logger.error(f"An unexpected error occurred during token decoding: {e}")
-             return jsonify({'error': 'Token processing error'}), 500
+            signing_key = _get_jwks_client().get_signing_key_from_jwt(token)
+        except (jwt.PyJWKClientConnectionError, URLError, TimeoutError) as e:
+            raise SigningKeysUnavailable(f"Could not fetch signing keys: {e}") from e
+        except jwt.PyJWKClientError as e:
+            # The JWKS was fetched but has no key for this token's kid
+            raise jwt.InvalidTokenError(f"Unknown signing key: {e}") from e
+        return jwt.decode(token, signing_key.key, algorithms=[algorithm], audience='authenticated')
+    raise jwt.InvalidTokenError(f"Unsupported token algorithm: {algorithm}")
+
+def verify_token_remote(token):
+    """Ask Supabase Auth whether the token is still valid (catches revoked sessions).
+
+    One network round trip; reserve it for revocation-sensitive operations.
+    Returns the Supabase user, or None if the token was rejected.
+    """
+    from database import get_db
+    try:
+        with get_db() as client:
+            response = client.auth.get_user(token)
+            return response.user if response else None
+    except Exception as e:
+        logger.warning(f"Remote token verification failed: {e}")
+        return None
+
+class CurrentUser:
+    """The authenticated user, as passed to every protected route.
+
+    Built from the verified token's claims, so no database lookup is needed
+    to identify the caller.
+    """
+
+    __slots__ = ('id', 'email', 'role', 'claims')
+
+    def __init__(self, claims):
+        self.id = claims['sub']
+        self.email = claims.get('email')
+        self.role = claims.get('role')
+        self.claims = claims
+
+    def __repr__(self):
+        return f'<CurrentUser {self.id}>'
+
+def _bearer_token():
+    auth_header = request.headers.get('Authorization', '')
+    scheme, _, token = auth_header.partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        return None
+    return token.strip()
+
+def authenticate(token, remote_check=False):
+    """Resolve a bearer token to a CurrentUser, using the verified-token cache.
+
+    Tokens verified in the last TOKEN_CACHE_TTL seconds skip signature
+    verification and claim parsing; cached entries never outlive the token's
+    own `exp`. With remote_check, Supabase Auth is also asked whether the
+    session has been revoked (never cached). Raises jwt.InvalidTokenError or
+    SigningKeysUnavailable.
+    """
+    user = _verified_tokens.get(token)
+    if user is None:
+        claims = decode_token(token)
+        user = CurrentUser(claims)
+        _verified_tokens.set(token, user, expires_at=claims.get('exp'))
+
+    # Revoked sessions still carry a valid signature until they expire
+    if remote_check and not verify_token_remote(token):
+        _verified_tokens.delete(token)
+        raise jwt.InvalidTokenError("Session has been revoked")
+    return user
+
+def token_required(f=None, *, remote_check=False):
+    """Protect a route with a Supabase JWT and pass it the CurrentUser.
+
+    Use as @token_required, or @token_required(remote_check=True) for
+    revocation-sensitive operations. The user is also available as g.current_user.
+    """
+    def decorator(view):
+        @wraps(view)
+        def decorated(*args, **kwargs):
+            token = _bearer_token()
+            if not token:
+                return jsonify({'error': 'Token is required'}), 401
 
-        return f(current_user_id, *args, **kwargs)
-
-    return decorated
+            try:
+                current_user = authenticate(token, remote_check=remote_check)
+            except jwt.ExpiredSignatureError:
+                return jsonify({'error': 'Token has expired'}), 401
+            except jwt.InvalidTokenError as e:
+                logger.debug(f"Rejected token for {request.path}: {e}")
+                return jsonify({'error': 'Invalid token'}), 401
+            except SigningKeysUnavailable as e:
+                logger.error(f"Token verification unavailable: {e}")
+                return jsonify({'error': 'Authentication is temporarily unavailable'}), 503
+            except Exception as e:
+                logger.error(f"An unexpected error occurred during token verification: {e}")
+                return jsonify({'error': 'Token processing error'}), 500
+
+            g.current_user = current_user
+            return view(current_user, *args, **kwargs)
+
+        return decorated
+
+    return decorator(f) if f is not None else decorator
 
 def premium_required(f):
-    """Decorator to protect premium-only routes"""
+    """Decorator to protect premium-only routes.
+
+    Premium status comes from the entitlement store (token claim or a short
+    TTL cache), so this costs no more than token_required in the common case.
+    """
+    @token_required
     @wraps(f)
-    def decorated(*args, **kwargs):
-        token = None
-        
-        if 'Authorization' in request.headers:
-            auth_header = request.headers['Authorization']
-            try:
-                token = auth_header.split(" ")[1]
-            except IndexError:
-                return jsonify({'error': 'Invalid token format'}), 401
+    def decorated(current_user, *args, **kwargs):
+        try:
+            premium = is_premium(current_user)
+        except Exception as e:
+            logger.error(f"Premium check failed for user {current_user.id}: {e}")
+            return jsonify({'error': 'Could not verify subscription'}), 503
 
-        if not token:
-            return jsonify({'error': 'Token is required'}), 401
+        if not premium:
+            return jsonify({'error': 'Premium subscription required'}), 403
 
-        try:
-            data = jwt.decode(token, JWT_SECRET, algorithms=["HS256"], audience='authenticated')
-            current_user_id = data['sub']
-            
-            # Check if user is premium
-            from database import get_db_connection
-            conn = get_db_connection()
-            user = conn.execute(
-                'SELECT is_premium FROM users WHERE id = ?', 
-                (current_user_id,)
-            ).fetchone()
-            conn.close()
-
-            if not user or not user['is_premium']:
-                return jsonify({'error': 'Premium subscription required'}), 403
-
-        except jwt.ExpiredSignatureError:
-            return jsonify({'error': 'Token has expired'}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({'error': 'Invalid token'}), 401
-
-        return f(current_user_id, *args, **kwargs)
-
-    return decorated
\ No newline at end of file
+        return f(current_user, *args, **kwargs)
+
+    return decorated
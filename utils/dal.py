@@ -0,0 +1,148 @@
+# backend/utils/dal.py
+"""Direct Postgres reads for the hot paths, bypassing PostgREST.
+
+Each query is a fixed statement over the shared asyncpg pool, so asyncpg
+prepares it once per connection and reuses the plan from its statement
+cache. Bible text is read from the replica's pool when one is configured.
+Coroutines (fetch_*, save_*) run on the asyncpg loop; the plain functions
+are synchronous wrappers for Flask routes. Rows come back as dicts shaped
+like the PostgREST responses they replace: UUIDs as strings and datetimes
+as ISO 8601 strings.
+"""
+import datetime
+import uuid
+from typing import Any, Dict, List, Optional
+
+from database import get_pg_conn, run_pg
+
+VERSES_BY_CHAPTER = """
+    SELECT id, book_name, chapter, verse, text
+    FROM bible_verses
+    WHERE book_name = $1 AND chapter = $2
+    ORDER BY verse
+"""
+
+NOTES_BY_CHAPTER = """
+    SELECT *
+    FROM notes
+    WHERE user_id = $1 AND book = $2 AND chapter = $3
+    ORDER BY created_at DESC
+"""
+
+# The friend is whichever side of the friendship is not the current user
+FRIENDSHIPS_FOR_USER = """
+    SELECT f.id, f.user1_id, f.user2_id, f.status, f.created_at,
+           u.id AS friend_id, u.username AS friend_username, u.email AS friend_email
+    FROM friendships f
+    JOIN users u ON u.id = CASE WHEN f.user1_id = $1 THEN f.user2_id ELSE f.user1_id END
+    WHERE f.user1_id = $1 OR f.user2_id = $1
+"""
+
+# One round trip per save. The conflict targets infer the existing partial unique
+# indexes notes_verse_unique_idx and notes_chapter_unique_idx; xmax = 0 only on a
+# freshly inserted row, which tells the caller whether it created or updated.
+# The verse index also covers quick notes: the WHERE on DO UPDATE leaves an existing
+# quick note untouched, and the statement then returns no row.
+UPSERT_STUDY_NOTE = """
+    INSERT INTO notes (user_id, book, chapter, verse, content, note_type, created_at, updated_at)
+    VALUES ($1, $2, $3, $4, $5, 'study', now(), now())
+    ON CONFLICT (user_id, book, chapter, verse) WHERE note_type <> 'chapter'
+    DO UPDATE SET content = EXCLUDED.content, updated_at = EXCLUDED.updated_at
+    WHERE notes.note_type = 'study'
+    RETURNING *, (xmax = 0) AS inserted
+"""
+
+UPSERT_CHAPTER_NOTE = """
+    INSERT INTO notes (user_id, book, chapter, content, note_type, created_at, updated_at)
+    VALUES ($1, $2, $3, $4, 'chapter', now(), now())
+    ON CONFLICT (user_id, book, chapter) WHERE note_type = 'chapter'
+    DO UPDATE SET content = EXCLUDED.content, updated_at = EXCLUDED.updated_at
+    RETURNING *, (xmax = 0) AS inserted
+"""
+
+PENDING_FRIEND_REQUESTS = """
+    SELECT f.id, f.user1_id, f.created_at,
+           u.id AS requester_id, u.username AS requester_username, u.email AS requester_email
+    FROM friendships f
+    JOIN users u ON u.id = f.user1_id
+    WHERE f.user2_id = $1 AND f.status = 'pending'
+"""
+
+
+def _to_json_value(value):
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    return value
+
+
+def _rows(records) -> List[Dict[str, Any]]:
+    return [{key: _to_json_value(value) for key, value in record.items()} for record in records]
+
+
+async def _fetch(query: str, *args, read_only: bool = False) -> List[Dict[str, Any]]:
+    async with get_pg_conn(read_only=read_only) as conn:
+        return _rows(await conn.fetch(query, *args))
+
+
+async def _fetch_one(query: str, *args) -> Optional[Dict[str, Any]]:
+    async with get_pg_conn() as conn:
+        record = await conn.fetchrow(query, *args)
+    return _rows([record])[0] if record is not None else None
+
+
+async def fetch_verses_by_chapter(book: str, chapter) -> List[Dict[str, Any]]:
+    # Bible text is never written by users, so it can always come from the replica
+    return await _fetch(VERSES_BY_CHAPTER, book, int(chapter), read_only=True)
+
+
+async def fetch_notes_by_chapter(user_id: str, book: str, chapter) -> List[Dict[str, Any]]:
+    return await _fetch(NOTES_BY_CHAPTER, uuid.UUID(str(user_id)), book, int(chapter))
+
+
+async def fetch_friendships(user_id: str) -> List[Dict[str, Any]]:
+    return await _fetch(FRIENDSHIPS_FOR_USER, uuid.UUID(str(user_id)))
+
+
+async def fetch_pending_friend_requests(user_id: str) -> List[Dict[str, Any]]:
+    return await _fetch(PENDING_FRIEND_REQUESTS, uuid.UUID(str(user_id)))
+
+
+async def save_study_note(user_id: str, book: str, chapter, verse, content: str) -> Optional[Dict[str, Any]]:
+    return await _fetch_one(UPSERT_STUDY_NOTE, uuid.UUID(str(user_id)), book, int(chapter), int(verse), content)
+
+
+async def save_chapter_note(user_id: str, book: str, chapter, content: str) -> Dict[str, Any]:
+    return await _fetch_one(UPSERT_CHAPTER_NOTE, uuid.UUID(str(user_id)), book, int(chapter), content)
+
+
+def verses_by_chapter(book: str, chapter) -> List[Dict[str, Any]]:
+    """Verses of one chapter in order, as bible_verses rows"""
+    return run_pg(fetch_verses_by_chapter(book, chapter))
+
+
+def notes_by_chapter(user_id: str, book: str, chapter) -> List[Dict[str, Any]]:
+    """A user's notes on one chapter, newest first"""
+    return run_pg(fetch_notes_by_chapter(user_id, book, chapter))
+
+
+def friendships(user_id: str) -> List[Dict[str, Any]]:
+    """Every friendship the user is part of, with the other user's id, username and email"""
+    return run_pg(fetch_friendships(user_id))
+
+
+def pending_friend_requests(user_id: str) -> List[Dict[str, Any]]:
+    """Pending requests sent to the user, with the requester's id, username and email"""
+    return run_pg(fetch_pending_friend_requests(user_id))
+
+
+def upsert_study_note(user_id: str, book: str, chapter, verse, content: str) -> Optional[Dict[str, Any]]:
+    """Create or replace the user's study note on a verse; the row has `inserted` set on create.
+    None if the verse already holds a note of another type (a quick note)."""
+    return run_pg(save_study_note(user_id, book, chapter, verse, content))
+
+
+def upsert_chapter_note(user_id: str, book: str, chapter, content: str) -> Dict[str, Any]:
+    """Create or replace the user's note on a chapter; the row has `inserted` set on create"""
+    return run_pg(save_chapter_note(user_id, book, chapter, content))
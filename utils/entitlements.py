@@ -0,0 +1,75 @@
+# backend/utils/entitlements.py
+import logging
+import os
+from datetime import datetime
+from typing import Optional
+
+from database import get_db
+from utils.cache import TTLCache
+from utils.user_cache import invalidate_user_profile
+
+logger = logging.getLogger(__name__)
+
+ENTITLEMENT_CACHE_SIZE = int(os.getenv('ENTITLEMENT_CACHE_SIZE', 2048))
+ENTITLEMENT_CACHE_TTL = int(os.getenv('ENTITLEMENT_CACHE_TTL', 60))
+# Tokens issued before an upgrade/cancel still carry the old claim until they expire
+TOKEN_LIFETIME_SECONDS = int(os.getenv('JWT_EXPIRY_SECONDS', 3600))
+
+# users.is_premium as last read from the database
+_premium_by_user = TTLCache('entitlements', maxsize=ENTITLEMENT_CACHE_SIZE, ttl=ENTITLEMENT_CACHE_TTL)
+# Changes made through this worker, which take precedence over stale token claims
+_recent_changes = TTLCache('entitlement_changes', maxsize=ENTITLEMENT_CACHE_SIZE, ttl=TOKEN_LIFETIME_SECONDS)
+
+
+def _premium_claim(claims) -> Optional[bool]:
+    """Premium status from a custom access-token claim, if the project issues one"""
+    app_metadata = claims.get('app_metadata') or {}
+    for value in (app_metadata.get('is_premium'), claims.get('is_premium')):
+        if isinstance(value, bool):
+            return value
+    return None
+
+
+def is_premium(current_user) -> bool:
+    """Resolve premium status without a database query in the common case.
+
+    Order: a change made here since the token was issued, then the token's
+    own claim, then the cached users.is_premium (refreshed every
+    ENTITLEMENT_CACHE_TTL seconds).
+    """
+    user_id = str(current_user.id)
+
+    changed = _recent_changes.get(user_id)
+    if changed is not None:
+        return changed
+
+    claimed = _premium_claim(current_user.claims)
+    if claimed is not None:
+        return claimed
+
+    cached = _premium_by_user.get(user_id)
+    if cached is not None:
+        return cached
+
+    with get_db() as client:
+        response = client.table('users').select('is_premium').eq('id', user_id).execute()
+    premium = bool(response.data and response.data[0].get('is_premium'))
+    _premium_by_user.set(user_id, premium)
+    return premium
+
+
+def set_premium(user_id: str, premium: bool):
+    """Persist an upgrade or cancellation and invalidate every cached view of it"""
+    with get_db() as client:
+        response = client.table('users').update({
+            'is_premium': premium,
+            'updated_at': datetime.utcnow().isoformat()
+        }).eq('id', user_id).execute()
+    if not response.data:
+        raise LookupError(f"User {user_id} not found")
+
+    user_id = str(user_id)
+    _premium_by_user.delete(user_id)
+    _recent_changes.set(user_id, premium)
+    invalidate_user_profile(user_id)
+    return response.data[0]
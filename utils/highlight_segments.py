@@ -0,0 +1,90 @@
+# backend/utils/highlight_segments.py
+"""Paint-over interval logic for verse highlights.
+
+A verse's highlights are kept as non-overlapping segments
+{'start', 'end', 'color'}. Painting a range overwrites whatever it covers
+(splitting or truncating neighbours); erasing does the same without adding
+a segment. Adjacent or overlapping segments of the same colour are merged.
+diff_segments then works out the fewest row changes that turn the stored
+rows into the new segments.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def merge_segments(segments: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Sort segments, drop empty ones and merge touching segments of the same colour"""
+    merged = []
+    for seg in sorted(segments, key=lambda s: (s['start'], s['end'])):
+        # Skip zero-length or invalid segments that might have been created
+        if seg['start'] >= seg['end']:
+            continue
+        if not merged or seg['color'] != merged[-1]['color'] or seg['start'] > merged[-1]['end']:
+            merged.append({'start': seg['start'], 'end': seg['end'], 'color': seg['color']})
+        else:
+            merged[-1]['end'] = max(merged[-1]['end'], seg['end'])
+    return merged
+
+
+def paint(segments: List[Dict[str, Any]], start: int, end: int, color: Optional[str]) -> List[Dict[str, Any]]:
+    """Apply one stroke over [start, end); color=None erases the range"""
+    remaining = []
+    for seg in segments:
+        # Entirely to the left or right of the stroke
+        if seg['end'] <= start or seg['start'] >= end:
+            remaining.append(seg)
+            continue
+        # Parts of an overlapped segment that stick out on either side survive
+        if seg['start'] < start:
+            remaining.append({'start': seg['start'], 'end': start, 'color': seg['color']})
+        if seg['end'] > end:
+            remaining.append({'start': end, 'end': seg['end'], 'color': seg['color']})
+    if color is not None:
+        remaining.append({'start': start, 'end': end, 'color': color})
+    return merge_segments(remaining)
+
+
+def diff_segments(
+    rows: List[Dict[str, Any]],
+    segments: List[Dict[str, Any]],
+) -> Tuple[List[Dict[str, Any]], List[Tuple[Dict[str, Any], Dict[str, Any]]], List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Plan the row changes that turn stored `rows` (with 'id') into `segments`.
+
+    Returns (keep, update, delete, insert): rows already matching a segment,
+    (row, segment) pairs where the row is rewritten in place, rows to delete
+    and segments that need new rows. Rows are reused before any insert, so a
+    stroke that only moves boundaries issues updates rather than delete/insert.
+    """
+    def key(item):
+        return item['start'], item['end'], item['color']
+
+    unmatched_rows, duplicates = {}, []
+    for row in rows:
+        if key(row) in unmatched_rows:
+            duplicates.append(row)
+        else:
+            unmatched_rows[key(row)] = row
+
+    keep, pending = [], []
+    for seg in segments:
+        row = unmatched_rows.pop(key(seg), None)
+        if row is not None:
+            keep.append(row)
+        else:
+            pending.append(seg)
+
+    spare = sorted(list(unmatched_rows.values()) + duplicates, key=lambda r: r['start'])
+    update, unpaired = [], []
+    # Prefer rewriting the row a segment was cut from (same colour, overlapping)
+    for seg in pending:
+        row = next((r for r in spare if r['color'] == seg['color']
+                    and r['start'] < seg['end'] and seg['start'] < r['end']), None)
+        if row is not None:
+            spare.remove(row)
+            update.append((row, seg))
+        else:
+            unpaired.append(seg)
+    reused = list(zip(spare, unpaired))
+    update.extend(reused)
+    delete = spare[len(reused):]
+    insert = unpaired[len(reused):]
+    return keep, update, delete, insert
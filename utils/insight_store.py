@@ -0,0 +1,80 @@
+# backend/utils/insight_store.py
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from typing import Any, Dict, Optional
+
+from config import BASE_DIR
+
+logger = logging.getLogger(__name__)
+
+# Precomputed insights live on disk so they ship with the image and survive restarts
+INSIGHTS_STORE_DIR = os.getenv("INSIGHTS_STORE_DIR", os.path.join(BASE_DIR, "precomputed_insights"))
+
+# Defaults mirror the ones applied in generate_verse_insights
+DEFAULT_PREFERENCES = {
+    "writing_style": "devotional",
+    "response_length": 4000,
+    "preferred_topics": [],
+    "challenge_level": 0.5,
+    "depth_level": "intermediate",
+    "time_orientation": 0.5,
+    "user_context": {},
+    "model_temperature": 0.7,
+}
+
+
+def normalize_preferences(ai_preferences: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Resolve AI preferences to the values that actually shape the prompt"""
+    prefs = dict(DEFAULT_PREFERENCES)
+    prefs.update({k: v for k, v in (ai_preferences or {}).items() if k in DEFAULT_PREFERENCES})
+    # generate_verse_insights never asks for less than 8000 characters
+    prefs["response_length"] = max(prefs["response_length"], 8000)
+    prefs["preferred_topics"] = sorted(prefs["preferred_topics"])
+    return prefs
+
+
+def profile_key(ai_preferences: Optional[Dict[str, Any]]) -> str:
+    """Stable hash of a preference profile"""
+    normalized = json.dumps(normalize_preferences(ai_preferences), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:16]
+
+
+def _path_for(book: str, chapter: int, ai_preferences: Optional[Dict[str, Any]]) -> str:
+    book_slug = book.lower().replace(" ", "_")
+    return os.path.join(INSIGHTS_STORE_DIR, book_slug, f"{int(chapter)}-{profile_key(ai_preferences)}.json")
+
+
+def get_insight(book: str, chapter: int, ai_preferences: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Return the stored insight for a chapter and profile, or None"""
+    path = _path_for(book, chapter, ai_preferences)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable precomputed insight {path}: {e}")
+        return None
+
+
+def has_insight(book: str, chapter: int, ai_preferences: Optional[Dict[str, Any]]) -> bool:
+    return os.path.exists(_path_for(book, chapter, ai_preferences))
+
+
+def put_insight(book: str, chapter: int, ai_preferences: Optional[Dict[str, Any]], insight: Dict[str, Any]) -> str:
+    """Store an insight atomically so readers never see a partial file"""
+    path = _path_for(book, chapter, ai_preferences)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(insight, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
@@ -0,0 +1,89 @@
+# backend/utils/metrics.py
+"""Prometheus metrics for the HTTP, database, LLM and cache paths.
+
+With PROMETHEUS_MULTIPROC_DIR set (it must be set before the workers start)
+every gunicorn worker writes its samples to memory-mapped files in that
+directory and /metrics aggregates them, so a scrape sees the whole server
+rather than whichever worker answered. Without it the metrics are
+per-process.
+"""
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Request latencies range from cached reads (ms) to insight generation (minutes)
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+DB_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+LLM_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+# Pool checkouts are instant until the pool is exhausted, then wait up to DB_POOL_TIMEOUT
+POOL_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency",
+    ["blueprint", "endpoint", "method", "status"], buckets=REQUEST_BUCKETS,
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "Requests currently being handled",
+    ["blueprint"], multiprocess_mode="livesum",
+)
+DB_LATENCY = Histogram(
+    "db_roundtrip_duration_seconds", "Database round-trip latency by client (sql, rest, auth, pg)",
+    ["kind"], buckets=DB_BUCKETS,
+)
+LLM_LATENCY = Histogram(
+    "llm_request_duration_seconds", "Anthropic API call latency, one sample per HTTP attempt",
+    ["caller", "outcome"], buckets=LLM_BUCKETS,
+)
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a SQLAlchemy pool connection, including connect time",
+    ["pool"], buckets=POOL_BUCKETS,
+)
+DB_POOL_CHECKOUT_TIMEOUTS = Counter(
+    "db_pool_checkout_timeouts_total", "SQLAlchemy pool checkouts that gave up after DB_POOL_TIMEOUT",
+    ["pool"],
+)
+DB_POOL_CONNECTS = Counter(
+    "db_pool_connections_opened_total", "Database connections opened by the SQLAlchemy pool",
+    ["pool"],
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_connections_checked_out", "SQLAlchemy pool connections currently in use",
+    ["pool"], multiprocess_mode="livesum",
+)
+CACHE_LOOKUPS = Counter(
+    "cache_lookups_total", "In-process cache lookups; hit ratio = hit / (hit + miss)",
+    ["cache", "result"],
+)
+
+
+def request_labels(blueprint, endpoint):
+    """Label values for a request; unmatched URLs share one endpoint label to bound cardinality"""
+    return blueprint or "app", endpoint or "unmatched"
+
+
+def observe_llm(caller: str, outcome: str, started: float):
+    """Record one Anthropic call that began at time.perf_counter() value `started`"""
+    LLM_LATENCY.labels(caller, outcome).observe(time.perf_counter() - started)
+
+
+def render():
+    """(body, content type) for the /metrics endpoint"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
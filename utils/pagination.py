@@ -0,0 +1,88 @@
+# backend/utils/pagination.py
+"""Keyset pagination and field projection for list endpoints.
+
+Lists are ordered newest first by (created_at, id). A page ends with an
+opaque cursor holding the last row's key; the next page asks for rows
+strictly before it, so the database seeks straight to the position through
+the (user_id, created_at DESC, id DESC) index instead of skipping OFFSET
+rows. The body stays a plain JSON list; the cursor for the next page goes in
+the X-Next-Cursor header and a Link: rel="next" header.
+"""
+import base64
+import binascii
+import json
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlencode
+
+from flask import request
+
+DEFAULT_PAGE_SIZE = int(os.getenv('DEFAULT_PAGE_SIZE', 100))
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', 500))
+
+
+def encode_cursor(created_at: str, row_id) -> str:
+    raw = json.dumps([created_at, row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, Any]:
+    """(created_at, id) from a cursor; ValueError if it was not produced by encode_cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(created_at, str) or not isinstance(row_id, (int, str)) or isinstance(row_id, bool):
+        raise ValueError("Invalid cursor")
+    return created_at, row_id
+
+
+def page_params(args) -> Tuple[int, Optional[Tuple[str, Any]]]:
+    """(limit, decoded cursor or None) from the query string; ValueError on bad input"""
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    cursor = args.get('cursor')
+    return limit, decode_cursor(cursor) if cursor else None
+
+
+def parse_fields(raw: Optional[str], allowed: Sequence[str]) -> List[str]:
+    """Requested columns from a comma-separated `fields` value, in `allowed` order; all of them if absent"""
+    if not raw:
+        return list(allowed)
+    requested = {field.strip() for field in raw.split(',') if field.strip()}
+    unknown = requested.difference(allowed)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}. Allowed: {', '.join(allowed)}")
+    if not requested:
+        raise ValueError("fields must name at least one column")
+    return [field for field in allowed if field in requested]
+
+
+def query_columns(fields: Sequence[str]) -> List[str]:
+    """Columns to select: the requested ones plus the keyset columns the cursor needs"""
+    return list(fields) + [key for key in ('created_at', 'id') if key not in fields]
+
+
+def paginate(rows: List[Dict[str, Any]], limit: int, fields: Sequence[str]) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Trim a limit + 1 fetch to one page of `fields` and the cursor for the next page, if any"""
+    page = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        last = page[-1]
+        next_cursor = encode_cursor(last['created_at'], last['id'])
+    return [{field: row[field] for field in fields} for row in page], next_cursor
+
+
+def set_next_page(response, next_cursor: Optional[str]):
+    """Add X-Next-Cursor and Link: rel="next" headers when there is another page"""
+    if next_cursor:
+        args = request.args.to_dict()
+        args['cursor'] = next_cursor
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = f'<{request.base_url}?{urlencode(args)}>; rel="next"'
+    return response
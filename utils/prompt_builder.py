@@ -0,0 +1,268 @@
+# backend/utils/prompt_builder.py
+import math
+import os
+import re
+from typing import List, Dict, Any, Optional, Tuple
+
+# Rough characters-per-token ratio for English prose. Good enough to keep us
+# well inside the context window without a round trip to a tokenizer.
+CHARS_PER_TOKEN = 4
+
+# Upper bound for the insights prompt (system + user message)
+DEFAULT_PROMPT_TOKEN_BUDGET = int(os.getenv("INSIGHTS_PROMPT_TOKEN_BUDGET", 12000))
+
+# Longest a single note may be once it has been summarised
+SUMMARISED_NOTE_CHARS = 280
+
+_WORD_RE = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """Estimate the number of tokens in a piece of text without calling the API"""
+    if not text:
+        return 0
+    by_chars = len(text) / CHARS_PER_TOKEN
+    # Short words and punctuation tokenize worse than the character ratio suggests
+    by_words = len(_WORD_RE.findall(text)) * 0.75
+    return int(math.ceil(max(by_chars, by_words)))
+
+
+class PromptBuilder:
+    """Collects prompt fragments and joins them once at the end.
+
+    Keeps a running token estimate so callers can check the budget while
+    assembling instead of re-measuring the whole prompt.
+    """
+
+    def __init__(self, separator: str = ""):
+        self._parts: List[str] = []
+        self._separator = separator
+        self.tokens = 0
+
+    def add(self, text: str) -> "PromptBuilder":
+        if text:
+            self._parts.append(text)
+            self.tokens += estimate_tokens(text)
+        return self
+
+    def add_lines(self, lines: List[str]) -> "PromptBuilder":
+        for line in lines:
+            self.add(line + "\n")
+        return self
+
+    def build(self) -> str:
+        return self._separator.join(self._parts)
+
+
+def _terms(text: str) -> set:
+    return {word.lower() for word in re.findall(r"[A-Za-z']{4,}", text or "")}
+
+
+def summarise_note(content: str, max_chars: int = SUMMARISED_NOTE_CHARS) -> str:
+    """Shorten a note to its leading sentences, cut at a word boundary"""
+    content = " ".join((content or "").split())
+    if len(content) <= max_chars:
+        return content
+
+    summary = ""
+    for sentence in _SENTENCE_END_RE.split(content):
+        if len(summary) + len(sentence) + 1 > max_chars:
+            break
+        summary = f"{summary} {sentence}".strip()
+
+    if not summary:
+        summary = content[:max_chars].rsplit(" ", 1)[0]
+    return summary + " …"
+
+
+def _format_verse(verse: Dict[str, Any]) -> str:
+    return f"{verse['verse']}: {verse['text']}\n"
+
+
+def _format_note(note: Dict[str, Any], content: Optional[str] = None) -> str:
+    text = note["content"] if content is None else content
+    return f"{note['book']} {note['chapter']}:{note['verse']} - {text}\n"
+
+
+def _verse_ranges(numbers: List[int]) -> str:
+    """Render sorted verse numbers compactly, e.g. [1, 2, 3, 7] -> '1-3, 7'"""
+    ranges = []
+    start = prev = None
+    for number in numbers:
+        if start is None:
+            start = prev = number
+        elif number == prev + 1:
+            prev = number
+        else:
+            ranges.append(f"{start}-{prev}" if start != prev else f"{start}")
+            start = prev = number
+    if start is not None:
+        ranges.append(f"{start}-{prev}" if start != prev else f"{start}")
+    return ", ".join(ranges)
+
+
+def _fit_verses(
+    verses: List[Dict[str, Any]],
+    budget: int,
+    focus_terms: set,
+    noted_verses: set
+) -> Tuple[str, int, int]:
+    """Return the verses text, its token estimate and the number of verses kept.
+
+    When the chapter does not fit, verses are kept by relevance: verses the
+    user has written notes on first, then verses sharing the most terms with
+    the user's notes and preferred topics. Kept verses stay in chapter order
+    and omitted stretches are marked so the model knows text was skipped.
+    """
+    lines = [_format_verse(verse) for verse in verses]
+    costs = [estimate_tokens(line) for line in lines]
+    if sum(costs) <= budget:
+        return "".join(lines), sum(costs), len(verses)
+
+    def relevance(index):
+        verse = verses[index]
+        score = len(_terms(verse["text"]) & focus_terms)
+        if verse["verse"] in noted_verses:
+            score += 100
+        # Prefer earlier verses on ties so the opening of the chapter survives
+        return (-score, index)
+
+    kept = set()
+    used = 0
+    # Leave room for the omission markers
+    marker_budget = budget - 20
+    for index in sorted(range(len(verses)), key=relevance):
+        if used + costs[index] > marker_budget:
+            continue
+        kept.add(index)
+        used += costs[index]
+
+    builder = PromptBuilder()
+    omitted = []
+    for index, verse in enumerate(verses):
+        if index in kept:
+            if omitted:
+                builder.add(f"[verses {_verse_ranges(omitted)} omitted for length]\n")
+                omitted = []
+            builder.add(lines[index])
+        else:
+            omitted.append(verse["verse"])
+    if omitted:
+        builder.add(f"[verses {_verse_ranges(omitted)} omitted for length]\n")
+
+    return builder.build(), builder.tokens, len(kept)
+
+
+def _fit_notes(
+    verse_notes: List[Dict[str, Any]],
+    budget: int,
+    focus_terms: set
+) -> Tuple[str, int, int, bool]:
+    """Return the notes text, its token estimate, notes kept and whether notes were summarised.
+
+    Notes are first included verbatim, then summarised to their leading
+    sentences, and finally sampled by relevance to the preferred topics,
+    longest-first on ties, with a line recording how many were left out.
+    """
+    if not verse_notes:
+        return "", 0, 0, False
+
+    header = "User's verse notes:\n"
+    full = [_format_note(note) for note in verse_notes]
+    full_cost = estimate_tokens(header) + sum(estimate_tokens(line) for line in full)
+    if full_cost <= budget:
+        return header + "".join(full), full_cost, len(verse_notes), False
+
+    summarised = [_format_note(note, summarise_note(note["content"])) for note in verse_notes]
+    costs = [estimate_tokens(line) for line in summarised]
+    header_cost = estimate_tokens(header)
+    if header_cost + sum(costs) <= budget:
+        return header + "".join(summarised), header_cost + sum(costs), len(verse_notes), True
+
+    def relevance(index):
+        note = verse_notes[index]
+        return (-len(_terms(note["content"]) & focus_terms), -len(note["content"] or ""), index)
+
+    kept = set()
+    used = header_cost + 20  # room for the omission line
+    for index in sorted(range(len(verse_notes)), key=relevance):
+        if used + costs[index] > budget:
+            continue
+        kept.add(index)
+        used += costs[index]
+
+    builder = PromptBuilder().add(header)
+    for index in sorted(kept):
+        builder.add(summarised[index])
+    omitted = len(verse_notes) - len(kept)
+    if omitted:
+        builder.add(f"({omitted} further notes omitted for length)\n")
+    return builder.build(), builder.tokens, len(kept), True
+
+
+def fit_chapter_context(
+    verses: List[Dict[str, Any]],
+    verse_notes: List[Dict[str, Any]],
+    chapter_note: Optional[Dict[str, Any]],
+    budget_tokens: int,
+    preferred_topics: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """Fit the chapter text and the user's notes into a token budget
+
+    Args:
+        verses: List of verse objects with book, chapter, verse, and text
+        verse_notes: List of user notes for individual verses
+        chapter_note: User's note for the entire chapter
+        budget_tokens: Tokens available for the verses and notes together
+        preferred_topics: Topics used to rank verses and notes by relevance
+
+    Returns:
+        Dictionary with verses_text, notes_text, chapter_note_text and a
+        stats dictionary describing what was kept
+    """
+    budget_tokens = max(budget_tokens, 0)
+    verse_notes = verse_notes or []
+    focus_terms = set()
+    for topic in preferred_topics or []:
+        focus_terms |= _terms(topic)
+    for note in verse_notes:
+        focus_terms |= _terms(note.get("content"))
+    noted_verses = {note.get("verse") for note in verse_notes}
+
+    # The chapter note is capped at a tenth of the budget
+    chapter_note_text = ""
+    if chapter_note and chapter_note.get("content"):
+        content = chapter_note["content"]
+        max_chars = max(budget_tokens // 10, 0) * CHARS_PER_TOKEN
+        if len(content) > max_chars:
+            content = summarise_note(content, max_chars)
+        chapter_note_text = f"User's chapter note: {content}\n"
+    chapter_note_tokens = estimate_tokens(chapter_note_text)
+
+    # Verses get priority; notes take at most a third of what remains unless
+    # the verses leave more room
+    remaining = budget_tokens - chapter_note_tokens
+    notes_cap = remaining // 3 if verse_notes else 0
+    verses_text, verses_tokens, verses_kept = _fit_verses(
+        verses, remaining - notes_cap, focus_terms, noted_verses
+    )
+    notes_text, notes_tokens, notes_kept, summarised = _fit_notes(
+        verse_notes, remaining - verses_tokens, focus_terms
+    )
+
+    return {
+        "verses_text": verses_text,
+        "notes_text": notes_text,
+        "chapter_note_text": chapter_note_text,
+        "stats": {
+            "budget_tokens": budget_tokens,
+            "context_tokens": verses_tokens + notes_tokens + chapter_note_tokens,
+            "verses_included": verses_kept,
+            "verses_total": len(verses),
+            "notes_included": notes_kept,
+            "notes_total": len(verse_notes),
+            "notes_summarised": summarised,
+            "truncated": verses_kept < len(verses) or notes_kept < len(verse_notes),
+        },
+    }
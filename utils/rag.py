@@ -9,13 +9,42 @@ from sentence_transformers import SentenceTransformer
 import numpy as np
 from typing import List, Dict, Any, Optional
 import gc
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from utils.prompt_builder import (
+    DEFAULT_PROMPT_TOKEN_BUDGET,
+    PromptBuilder,
+    estimate_tokens,
+    fit_chapter_context,
+)
+from utils.insight_store import get_insight
+from utils.singleflight import coalesce, request_key
+from utils.resilience import (
+    ANTHROPIC_RETRY_BUDGET,
+    ANTHROPIC_TIMEOUT,
+    CircuitOpenError,
+    RateLimitExceeded,
+    anthropic_breaker,
+    anthropic_limiter,
+    parse_retry_after,
+)
+from utils.metrics import observe_llm
 
 # Load environment variables
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
-ANTHROPIC_API_URL = "https://api.anthropic.com/v1/messages"
+# Point ANTHROPIC_BASE_URL at a local stub to exercise the AI paths without the paid API
+ANTHROPIC_BASE_URL = os.getenv("ANTHROPIC_BASE_URL", "https://api.anthropic.com")
+ANTHROPIC_API_URL = f"{ANTHROPIC_BASE_URL.rstrip('/')}/v1/messages"
+
+# Embedding pipeline tuning
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", 0))  # 0 = all cores
+EMBEDDING_BATCH_TOKEN_BUDGET = int(os.getenv("EMBEDDING_BATCH_TOKEN_BUDGET", 8192))  # padded tokens per batch
+EMBEDDING_MAX_BATCH = 128
 
 # Global model reference - will be lazily loaded
 _model = None
+# Set while something (e.g. the hybrid search index) needs the model resident between requests
+_model_pinned = False
 
 # Load the sentence transformer model (this will be cached after first load)
 def get_embedding_model():
@@ -38,10 +67,16 @@ def get_embedding_model():
         print(f"Error loading embedding model: {e}")
         return None
 
+def pin_embedding_model():
+    """Keep the embedding model loaded across requests so queries are not paying load time"""
+    global _model_pinned
+    _model_pinned = True
+    return get_embedding_model()
+
 def clear_model_cache():
     """Clear the model from memory when not in use"""
     global _model
-    if _model is not None:
+    if _model is not None and not _model_pinned:
         del _model
         _model = None
         # Force garbage collection
@@ -51,49 +86,85 @@ def clear_model_cache():
             torch.cuda.empty_cache()
 
 def call_anthropic_api(messages, max_tokens=1024, temperature=0.7, max_retries=3):
-    """Call the Anthropic Claude API with retry mechanism for overloaded errors"""
+    """Call the Anthropic Claude API with retry mechanism for overloaded errors
+
+    Concurrent calls with an identical request are coalesced onto a single
+    upstream call and share its response.
+    """
+    headers = {
+        "x-api-key": ANTHROPIC_API_KEY,
+        "anthropic-version": "2023-06-01",
+        "content-type": "application/json"
+    }
+    
+    # Extract system message and user messages
+    system_content = None
+    user_messages = []
+    
+    for msg in messages:
+        if msg["role"] == "system":
+            system_content = msg["content"]
+        else:
+            user_messages.append(msg)
+    
+    # Construct data with top-level system parameter
+    data = {
+        "model": "claude-3-7-sonnet-20250219",
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "messages": user_messages
+    }
+    
+    # Only add system parameter if a system message was provided
+    if system_content:
+        data["system"] = system_content
+    
+    return coalesce(
+        request_key("messages", data),
+        lambda: _post_with_retries(headers, data, max_retries),
+        cacheable=lambda result: "error" not in result
+    )
+
+def _post_with_retries(headers, data, max_retries):
+    """POST to the Messages API behind the shared rate limiter and circuit breaker.
+
+    Retries overloaded and transient errors with capped exponential backoff,
+    honouring Retry-After, but never sleeps longer than ANTHROPIC_RETRY_BUDGET
+    in total so a request thread is not held hostage by an upstream incident.
+    """
     retry_count = 0
-    base_delay = 2  # Base delay in seconds
+    base_delay = 1  # Base delay in seconds
+    slept = 0.0
     
     while retry_count <= max_retries:
         try:
-            headers = {
-                "x-api-key": ANTHROPIC_API_KEY,
-                "anthropic-version": "2023-06-01",
-                "content-type": "application/json"
-            }
-            
-            # Extract system message and user messages
-            system_content = None
-            user_messages = []
-            
-            for msg in messages:
-                if msg["role"] == "system":
-                    system_content = msg["content"]
-                else:
-                    user_messages.append(msg)
-            
-            # Construct data with top-level system parameter
-            data = {
-                "model": "claude-3-7-sonnet-20250219",
-                "max_tokens": max_tokens,
-                "temperature": temperature,
-                "messages": user_messages
-            }
-            
-            # Only add system parameter if a system message was provided
-            if system_content:
-                data["system"] = system_content
-            
+            # Limiter first, so a shed request never holds the breaker's half-open trial
+            anthropic_limiter.acquire()
+            anthropic_breaker.before_call()
+        except CircuitOpenError as e:
+            print(f"Skipping Anthropic call, circuit open for another {e.retry_after:.0f}s")
+            return {"error": "Claude is currently unavailable. Please try again in a few minutes.", "retry_after": e.retry_after}
+        except RateLimitExceeded as e:
+            print("Skipping Anthropic call, local request queue is full")
+            return {"error": "Too many AI requests right now. Please try again shortly.", "retry_after": e.retry_after}
+        
+        retry_after = None
+        started = time.perf_counter()
+        response = None
+        try:
             response = requests.post(
                 ANTHROPIC_API_URL,
                 headers=headers,
-                json=data
+                json=data,
+                timeout=ANTHROPIC_TIMEOUT
             )
             
+            observe_llm("insights", "ok" if response.status_code == 200 else str(response.status_code), started)
             if response.status_code != 200:
                 error_message = "Unknown API error"
-                should_retry = False
+                # Overloaded (529), rate limited (429) and server errors are worth retrying
+                should_retry = response.status_code == 429 or response.status_code >= 500
+                retry_after = parse_retry_after(response.headers.get("retry-after"))
                 
                 try:
                     error_json = response.json()
@@ -109,58 +180,143 @@ def call_anthropic_api(messages, max_tokens=1024, temperature=0.7, max_retries=3
                 
                 print(f"API error: {response.status_code}, {response.text}")
                 
-                if should_retry and retry_count < max_retries:
-                    retry_count += 1
-                    # Calculate exponential backoff with jitter
-                    delay = base_delay * (2 ** retry_count) + random.uniform(0, 1)
-                    print(f"Retrying in {delay:.2f} seconds (attempt {retry_count}/{max_retries})...")
-                    time.sleep(delay)
-                    continue
-                    
-                return {"error": error_message}
-            
-            return response.json()
+                if not should_retry:
+                    # The API answered; the request itself was bad
+                    anthropic_breaker.record_success()
+                    return {"error": error_message}
+                
+                anthropic_breaker.record_failure(error_message, retry_after=retry_after)
+                failure = {"error": error_message}
+            else:
+                anthropic_breaker.record_success()
+                return response.json()
             
         except Exception as e:
             print(f"Error calling Anthropic API: {e}")
-            retry_count += 1
-            
-            if retry_count <= max_retries:
-                delay = base_delay * (2 ** retry_count) + random.uniform(0, 1)
-                print(f"Retrying in {delay:.2f} seconds (attempt {retry_count}/{max_retries})...")
-                time.sleep(delay)
-            else:
-                return {"error": f"Failed to connect to Claude API after {max_retries} attempts: {str(e)}"}
+            if response is None:
+                observe_llm("insights", "connection_error", started)
+            anthropic_breaker.record_failure(e)
+            failure = {"error": f"Failed to connect to Claude API after {retry_count + 1} attempts: {str(e)}"}
+        except BaseException:
+            # Interrupted mid-call: no verdict on the upstream, but the trial slot must be freed
+            anthropic_breaker.release_trial()
+            raise
+        
+        retry_count += 1
+        if retry_count > max_retries:
+            return failure
+        
+        # Calculate exponential backoff with jitter, deferring to Retry-After when given
+        delay = retry_after if retry_after is not None else base_delay * (2 ** retry_count) + random.uniform(0, 1)
+        if slept + delay > ANTHROPIC_RETRY_BUDGET:
+            print(f"Not retrying: a {delay:.2f}s wait exceeds the remaining retry budget")
+            return {**failure, "retry_after": delay}
+        print(f"Retrying in {delay:.2f} seconds (attempt {retry_count}/{max_retries})...")
+        time.sleep(delay)
+        slept += delay
     
     # If we get here, all retries failed
     return {"error": "Failed to connect to Claude API after multiple attempts"}
 
-def get_embeddings(texts: List[str]) -> Optional[List[np.ndarray]]:
-    """Generate embeddings for a list of texts"""
+def _configure_torch_threads(threads: Optional[int] = None) -> int:
+    """Set the intra-op thread count explicitly instead of relying on torch's default"""
+    threads = threads or EMBEDDING_THREADS or os.cpu_count() or 1
+    torch.set_num_threads(threads)
+    return threads
+
+def _length_bucketed_batches(texts: List[str], token_budget: int) -> List[List[int]]:
+    """Group text indices into batches of similar length.
+
+    Texts are sorted by estimated token count so each batch pads to a
+    similar length, and a batch grows only while batch_size x longest text
+    stays within the padded-token budget. Short verses therefore travel in
+    large batches and long passages in small ones.
+    """
+    max_seq_length = 256  # all-MiniLM-L6-v2 truncates beyond this
+    lengths = [min(estimate_tokens(text) + 2, max_seq_length) for text in texts]  # +2 for [CLS]/[SEP]
+    order = sorted(range(len(texts)), key=lambda i: lengths[i])
+
+    batches = []
+    current = []
+    for index in order:
+        # Sorted ascending, so the newest text is the longest in the batch
+        if current and ((len(current) + 1) * lengths[index] > token_budget or len(current) >= EMBEDDING_MAX_BATCH):
+            batches.append(current)
+            current = []
+        current.append(index)
+    if current:
+        batches.append(current)
+    return batches
+
+def _init_embedding_worker(threads: int):
+    _configure_torch_threads(threads)
+    get_embedding_model()
+
+def _encode_batch(batch_texts: List[str]) -> np.ndarray:
+    model = get_embedding_model()
+    if model is None:
+        raise RuntimeError("Embedding model unavailable")
+    with torch.no_grad():
+        return model.encode(batch_texts, batch_size=len(batch_texts), convert_to_numpy=True)
+
+def get_embeddings(
+    texts: List[str],
+    processes: int = 1,
+    token_budget: Optional[int] = None,
+    threads: Optional[int] = None
+) -> Optional[List[np.ndarray]]:
+    """Generate embeddings for a list of texts
+
+    Args:
+        texts: Texts to embed; the result is in the same order
+        processes: Worker processes for bulk jobs such as offline indexing.
+            Each loads its own model and gets an equal share of the cores.
+        token_budget: Padded tokens allowed per batch, which bounds memory
+            (defaults to EMBEDDING_BATCH_TOKEN_BUDGET)
+        threads: Intra-op threads for in-process encoding (defaults to
+            EMBEDDING_THREADS, else all cores)
+
+    Returns:
+        List of embeddings, or None if the model could not be used
+    """
+    if not texts:
+        return []
     try:
-        # Get model (lazy loading)
-        model = get_embedding_model()
-        if not model:
-            return None
+        started = time.time()
+        batches = _length_bucketed_batches(texts, token_budget or EMBEDDING_BATCH_TOKEN_BUDGET)
+        batch_texts = [[texts[i] for i in batch] for batch in batches]
         
-        # Process in smaller batches to reduce memory usage
-        batch_size = 8
-        embeddings = []
+        if processes > 1:
+            # Spawn rather than fork: forking after torch has started its thread pool can deadlock
+            threads_per_process = max((os.cpu_count() or 1) // processes, 1)
+            with ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_embedding_worker,
+                initargs=(threads_per_process,)
+            ) as executor:
+                encoded = list(executor.map(_encode_batch, batch_texts))
+        else:
+            # Get model (lazy loading)
+            model = get_embedding_model()
+            if not model:
+                return None
+            _configure_torch_threads(threads)
+            encoded = [_encode_batch(batch) for batch in batch_texts]
         
-        for i in range(0, len(texts), batch_size):
-            batch_texts = texts[i:i+batch_size]
-            with torch.no_grad():
-                batch_embeddings = model.encode(batch_texts, convert_to_numpy=True)
-            
-            if isinstance(batch_embeddings, np.ndarray) and len(batch_embeddings.shape) == 2:
-                # If it returned a 2D array with multiple embeddings
-                embeddings.extend([emb for emb in batch_embeddings])
-            else:
-                # If it returned a single embedding
-                embeddings.append(batch_embeddings)
+        # Scatter the batch results back to input order
+        embeddings = [None] * len(texts)
+        for batch, batch_embeddings in zip(batches, encoded):
+            for index, embedding in zip(batch, batch_embeddings):
+                embeddings[index] = embedding
         
         # Clear cached tensors after processing
-        torch.cuda.empty_cache()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        
+        elapsed = max(time.time() - started, 1e-9)
+        print(f"Encoded {len(texts)} texts in {len(batches)} batches across {processes} process(es) "
+              f"in {elapsed:.2f}s ({len(texts) / elapsed:.1f} texts/sec)")
         
         return embeddings
     except Exception as e:
@@ -197,7 +353,9 @@ def generate_verse_insights(
     verses: List[Dict[str, str]],
     verse_notes: List[Dict[str, str]],
     chapter_note: Dict[str, str],
-    ai_preferences: Dict[str, Any]
+    ai_preferences: Dict[str, Any],
+    prompt_token_budget: int = DEFAULT_PROMPT_TOKEN_BUDGET,
+    use_precomputed: bool = True
 ) -> Dict[str, Any]:
     """Generate insights on Bible verses using user notes and RAG
     
@@ -214,11 +372,23 @@ def generate_verse_insights(
             - depth_level: 'beginner', 'intermediate', or 'scholarly' content depth
             - time_orientation: Historical vs modern focus (0-1)
             - user_context: User-specific information for personalization
+        prompt_token_budget: Estimated token ceiling for the whole prompt.
+            Long chapters and large note sets are summarised, sampled and
+            truncated by relevance to stay under it.
+        use_precomputed: Serve a stored insight for this chapter and
+            preference profile when the user has no notes on it.
         
     Returns:
-        Dictionary with generated insights
+        Dictionary with generated insights and the token counts used
     """
     try:
+        # Chapters without personal notes can be served from the batch precompute
+        has_chapter_note = bool(chapter_note and chapter_note.get('content'))
+        if use_precomputed and not verse_notes and not has_chapter_note:
+            precomputed = get_insight(verses[0]['book'], verses[0]['chapter'], ai_preferences)
+            if precomputed:
+                return {**precomputed, "precomputed": True}
+        
         if not ANTHROPIC_API_KEY:
             return {"error": "ANTHROPIC_API_KEY not set in environment variables"}
         
@@ -238,23 +408,6 @@ def generate_verse_insights(
         # Get chapter reference
         chapter_ref = f"{verses[0]['book']} {verses[0]['chapter']}"
         
-        # Prepare the verses text
-        verses_text = ""
-        for verse in verses:
-            verses_text += f"{verse['verse']}: {verse['text']}\n"
-        
-        # Prepare user notes
-        notes_text = ""
-        if verse_notes:
-            notes_text = "User's verse notes:\n"
-            for note in verse_notes:
-                notes_text += f"{note['book']} {note['chapter']}:{note['verse']} - {note['content']}\n"
-        
-        # Add chapter note if available
-        chapter_note_text = ""
-        if chapter_note and 'content' in chapter_note and chapter_note['content']:
-            chapter_note_text = f"User's chapter note: {chapter_note['content']}\n"
-        
         # Construct prompt components based on preferences
         historical_focus = "Focus more on historical context and original meaning." if time_orientation < 0.3 else ""
         modern_focus = "Focus more on modern application and relevance today." if time_orientation > 0.7 else ""
@@ -293,21 +446,33 @@ Analyze the Bible chapter and generate insightful commentary.
 {style_instruction} {depth_instructions} {historical_focus} {modern_focus} {challenge_instructions} {topics_instruction} {personalization}
 IMPORTANT: Always provide complete, well-structured responses. Never leave thoughts or paragraphs unfinished."""
 
-        # Construct the user prompt
-        user_message = f"""Please provide insights on {chapter_ref}.
-
-Bible text:
-{verses_text}
-
-{notes_text}
-{chapter_note_text}
-
+        # Fixed instructions that wrap the chapter text and notes
+        intro = f"Please provide insights on {chapter_ref}.\n\nBible text:\n"
+        closing = f"""
 Generate a cohesive analysis that draws connections between verses and highlights key themes and applications.
 Aim for around {response_length} characters, but you MUST complete your thoughts properly.
 It is CRUCIAL that you do not cut your response off mid-thought or mid-sentence. Always finish your complete analysis.
 Make sure all your sections and paragraphs are properly completed.
 Your response must be complete and well-structured with a proper conclusion."""
 
+        # Fit verses and notes into whatever the instructions leave of the budget
+        instruction_tokens = estimate_tokens(system_message) + estimate_tokens(intro) + estimate_tokens(closing)
+        context = fit_chapter_context(
+            verses,
+            verse_notes,
+            chapter_note,
+            budget_tokens=prompt_token_budget - instruction_tokens,
+            preferred_topics=preferred_topics
+        )
+
+        # Construct the user prompt
+        user_prompt = PromptBuilder(separator="\n")
+        user_prompt.add(intro + context["verses_text"])
+        user_prompt.add(context["notes_text"])
+        user_prompt.add(context["chapter_note_text"])
+        user_prompt.add(closing)
+        user_message = user_prompt.build()
+
         # Call Claude API
         messages = [
             {"role": "system", "content": system_message},
@@ -333,6 +498,7 @@ Your response must be complete and well-structured with a proper conclusion."""
         
         # Extract insights from Claude's response
         insights = claude_response["content"][0]["text"]
+        usage = claude_response.get("usage", {})
         
         result = {
             "chapter_reference": chapter_ref,
@@ -346,6 +512,18 @@ Your response must be complete and well-structured with a proper conclusion."""
                 "time_orientation": time_orientation,
                 "response_length": response_length,
                 "personalized": bool(user_context)
+            },
+            "token_usage": {
+                "prompt_tokens_estimated": instruction_tokens + context["stats"]["context_tokens"],
+                "prompt_token_budget": prompt_token_budget,
+                "input_tokens": usage.get("input_tokens"),
+                "output_tokens": usage.get("output_tokens"),
+                "verses_included": context["stats"]["verses_included"],
+                "verses_total": context["stats"]["verses_total"],
+                "notes_included": context["stats"]["notes_included"],
+                "notes_total": context["stats"]["notes_total"],
+                "notes_summarised": context["stats"]["notes_summarised"],
+                "truncated": context["stats"]["truncated"]
             }
         }
         
@@ -0,0 +1,294 @@
+# backend/utils/resilience.py
+import asyncio
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+from utils.metrics import observe_llm
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitExceeded(Exception):
+    """Raised when the local limiter queue is full or the wait would be too long"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(Exception):
+    """Raised when calls are short-circuited because the upstream is failing"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value) -> Optional[float]:
+    """Parse a Retry-After header given in seconds or as an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Token-bucket rate limiter with a bounded wait queue.
+
+    Callers that find the bucket empty reserve a future token and sleep until
+    it is due. At most `max_queue` callers may wait at once, and nobody waits
+    longer than `max_wait`; beyond that RateLimitExceeded is raised so request
+    threads shed load instead of piling up.
+    """
+
+    def __init__(self, rate: float, capacity: float, max_queue: int, max_wait: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._waiting = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _reserve(self) -> float:
+        """Take a token, returning how long to wait for it (0 if one was free)"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            wait = (1 - self._tokens) / self.rate
+            if self._waiting >= self.max_queue or wait > self.max_wait:
+                raise RateLimitExceeded("AI request queue is full", retry_after=wait)
+            # Reserve the next token; the balance goes negative until it refills
+            self._tokens -= 1
+            self._waiting += 1
+            return wait
+
+    def _release_waiter(self):
+        with self._lock:
+            self._waiting -= 1
+
+    def acquire(self):
+        wait = self._reserve()
+        if not wait:
+            return
+        try:
+            time.sleep(wait)
+        finally:
+            self._release_waiter()
+
+    async def acquire_async(self):
+        """acquire() for coroutines: waits without blocking the event loop"""
+        wait = self._reserve()
+        if not wait:
+            return
+        try:
+            await asyncio.sleep(wait)
+        finally:
+            self._release_waiter()
+
+    def snapshot(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                "tokens": round(self._tokens, 2),
+                "rate_per_sec": self.rate,
+                "capacity": self.capacity,
+                "queue_depth": self._waiting,
+                "max_queue": self.max_queue,
+            }
+
+
+class CircuitBreaker:
+    """Fails fast after consecutive upstream errors.
+
+    closed: calls flow normally. After `failure_threshold` consecutive
+    failures the breaker opens and rejects calls for `reset_timeout` seconds
+    (or longer if the upstream sent Retry-After). It then half-opens and
+    lets a single trial call through: success closes it, failure reopens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._open_until = 0.0
+        self._trial_in_flight = False
+        self._last_error = None
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+            now = time.monotonic()
+            if self._state == self.OPEN and now >= self._open_until:
+                self._state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self._state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            retry_after = max(self._open_until - now, 1.0)
+            raise CircuitOpenError(f"{self.name} circuit is open", retry_after=retry_after)
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info(f"{self.name} circuit closed")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self, error=None, retry_after: Optional[float] = None):
+        with self._lock:
+            self._failures += 1
+            self._last_error = str(error) if error else None
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                open_for = max(self.reset_timeout, retry_after or 0)
+                self._open_until = time.monotonic() + open_for
+                if self._state != self.OPEN:
+                    logger.warning(f"{self.name} circuit opened for {open_for:.0f}s after {self._failures} failures")
+                self._state = self.OPEN
+                self._trial_in_flight = False
+
+    def release_trial(self):
+        """Free the half-open trial slot when its call ended without a verdict on the upstream
+        (cancelled, or failed before or outside the HTTP request)"""
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._trial_in_flight = False
+
+    @property
+    def state(self):
+        return self._state
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "state": self._state,
+                "consecutive_failures": self._failures,
+                "open_for_seconds": round(max(self._open_until - time.monotonic(), 0), 1) if self._state == self.OPEN else 0,
+                "last_error": self._last_error,
+            }
+
+
+# Shared guards for every Anthropic call in this worker
+anthropic_limiter = TokenBucket(
+    rate=float(os.getenv("ANTHROPIC_RATE_PER_SEC", 2)),
+    capacity=float(os.getenv("ANTHROPIC_BURST", 5)),
+    max_queue=int(os.getenv("ANTHROPIC_MAX_QUEUE", 4)),
+    max_wait=float(os.getenv("ANTHROPIC_MAX_QUEUE_WAIT", 5)),
+)
+anthropic_breaker = CircuitBreaker(
+    "anthropic",
+    failure_threshold=int(os.getenv("ANTHROPIC_BREAKER_THRESHOLD", 5)),
+    reset_timeout=float(os.getenv("ANTHROPIC_BREAKER_RESET", 30)),
+)
+
+# Longest a request thread may spend sleeping between retries, in total
+ANTHROPIC_RETRY_BUDGET = float(os.getenv("ANTHROPIC_RETRY_BUDGET", 8))
+# Per-attempt HTTP timeout; insights can legitimately take a while to generate
+ANTHROPIC_TIMEOUT = float(os.getenv("ANTHROPIC_TIMEOUT", 120))
+
+
+def _record_anthropic_error(error) -> bool:
+    """Feed an SDK error to the breaker; False if it says nothing about the upstream"""
+    import anthropic
+
+    if isinstance(error, anthropic.APIStatusError):
+        if error.status_code == 429 or error.status_code >= 500:
+            anthropic_breaker.record_failure(
+                error, retry_after=parse_retry_after(error.response.headers.get('retry-after')))
+        else:
+            anthropic_breaker.record_success()
+        return True
+    if isinstance(error, anthropic.APIConnectionError):
+        anthropic_breaker.record_failure(error)
+        return True
+    return False
+
+
+def _llm_outcome(error):
+    status_code = getattr(error, "status_code", None)
+    return str(status_code) if status_code is not None else "connection_error"
+
+
+def guarded_anthropic_call(fn, caller="ai_search"):
+    """Run an Anthropic SDK call behind the shared rate limiter and circuit breaker"""
+    # Wait for a token first, so a shed request never holds the breaker's half-open trial
+    anthropic_limiter.acquire()
+    anthropic_breaker.before_call()
+    started = time.perf_counter()
+    recorded = False
+    try:
+        result = fn()
+    except Exception as e:
+        observe_llm(caller, _llm_outcome(e), started)
+        recorded = _record_anthropic_error(e)
+        raise
+    else:
+        observe_llm(caller, "ok", started)
+        anthropic_breaker.record_success()
+        recorded = True
+        return result
+    finally:
+        if not recorded:
+            anthropic_breaker.release_trial()
+
+
+async def guarded_anthropic_call_async(fn, caller="ai_search"):
+    """guarded_anthropic_call for the async SDK client; fn returns an awaitable"""
+    await anthropic_limiter.acquire_async()
+    anthropic_breaker.before_call()
+    started = time.perf_counter()
+    recorded = False
+    try:
+        result = await fn()
+    except Exception as e:
+        observe_llm(caller, _llm_outcome(e), started)
+        recorded = _record_anthropic_error(e)
+        raise
+    else:
+        observe_llm(caller, "ok", started)
+        anthropic_breaker.record_success()
+        recorded = True
+        return result
+    finally:
+        # Also reached on cancellation, which is not an Exception
+        if not recorded:
+            anthropic_breaker.release_trial()
+
+
+def anthropic_status():
+    """Limiter and breaker state, for the health endpoint"""
+    return {
+        "circuit": anthropic_breaker.snapshot(),
+        "rate_limiter": anthropic_limiter.snapshot(),
+    }
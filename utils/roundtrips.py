@@ -0,0 +1,202 @@
+# backend/utils/roundtrips.py
+"""Per-request accounting of database round trips.
+
+Every SQLAlchemy statement, Supabase REST call and direct Postgres (DAL)
+query made while handling a request is counted and timed under one of the
+kinds below. The app reads the totals at the end of the request for the
+Server-Timing header and a structured log line.
+"""
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+from sqlalchemy import event
+
+from utils.metrics import DB_LATENCY
+
+logger = logging.getLogger(__name__)
+
+# Warn when a single request makes more round trips than this; 0 disables the warning
+DB_ROUNDTRIP_WARN_THRESHOLD = int(os.getenv("DB_ROUNDTRIP_WARN_THRESHOLD", 0))
+
+KINDS = ("sql", "rest", "auth", "pg")
+
+_latency_by_kind = {kind: DB_LATENCY.labels(kind) for kind in KINDS}
+
+_current: ContextVar[Optional["RoundTrips"]] = ContextVar("db_roundtrips", default=None)
+
+
+class RoundTrips:
+    """Round-trip counts and cumulative seconds for one request, by kind"""
+
+    __slots__ = ("counts", "seconds")
+
+    def __init__(self):
+        self.counts = dict.fromkeys(KINDS, 0)
+        self.seconds = dict.fromkeys(KINDS, 0.0)
+
+    def record(self, kind: str, seconds: float):
+        self.counts[kind] += 1
+        self.seconds[kind] += seconds
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def server_timing(self) -> str:
+        """Server-Timing header value, e.g. `sql;desc="3 round trips";dur=4.2, db;desc="3 round trips";dur=4.2`"""
+        entries = [
+            f'{kind};desc="{self.counts[kind]} round trips";dur={self.seconds[kind] * 1000:.1f}'
+            for kind in KINDS if self.counts[kind]
+        ]
+        entries.append(f'db;desc="{self.total} round trips";dur={sum(self.seconds.values()) * 1000:.1f}')
+        return ", ".join(entries)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "total": self.total,
+            **{kind: {"count": self.counts[kind], "ms": round(self.seconds[kind] * 1000, 1)}
+               for kind in KINDS if self.counts[kind]},
+        }
+
+
+def begin_request():
+    """Start counting for the current request (thread or asyncio task)"""
+    _current.set(RoundTrips())
+
+
+def end_request() -> Optional[RoundTrips]:
+    """Stop counting and return what the request used"""
+    stats = _current.get()
+    _current.set(None)
+    return stats
+
+
+def current() -> Optional[RoundTrips]:
+    return _current.get()
+
+
+def record(kind: str, seconds: float):
+    _latency_by_kind[kind].observe(seconds)
+    stats = _current.get()
+    if stats is not None:
+        stats.record(kind, seconds)
+
+
+@contextmanager
+def timed(kind: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(kind, time.perf_counter() - started)
+
+
+def log_request(method: str, endpoint: Optional[str], path: str, status: int, stats: RoundTrips):
+    """One JSON log line per request, plus a warning past DB_ROUNDTRIP_WARN_THRESHOLD"""
+    line = json.dumps({
+        "event": "db_roundtrips",
+        "method": method,
+        "endpoint": endpoint,
+        "path": path,
+        "status": status,
+        **stats.as_dict(),
+    }, separators=(",", ":"))
+    if DB_ROUNDTRIP_WARN_THRESHOLD and stats.total > DB_ROUNDTRIP_WARN_THRESHOLD:
+        logger.warning(f"{line} exceeds DB_ROUNDTRIP_WARN_THRESHOLD={DB_ROUNDTRIP_WARN_THRESHOLD}")
+    else:
+        logger.info(line)
+
+
+def instrument_engine(engine):
+    """Count and time every statement SQLAlchemy sends on `engine`"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("roundtrip_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["roundtrip_started"].pop()
+        record("sql", time.perf_counter() - started)
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("roundtrip_started"):
+            record("sql", time.perf_counter() - conn.info["roundtrip_started"].pop())
+
+
+class _TimedBuilder:
+    """Wraps a PostgREST query builder so that execute() is timed as one round trip"""
+
+    __slots__ = ("_builder",)
+
+    def __init__(self, builder):
+        self._builder = builder
+
+    def __getattr__(self, name):
+        attr = getattr(self._builder, name)
+        if name == "execute":
+            def execute(*args, **kwargs):
+                with timed("rest"):
+                    return attr(*args, **kwargs)
+            return execute
+        if callable(attr):
+            def chained(*args, **kwargs):
+                return _wrap_builder(attr(*args, **kwargs))
+            return chained
+        # Properties such as `.not_` return another builder
+        return _wrap_builder(attr)
+
+
+def _wrap_builder(value):
+    return _TimedBuilder(value) if hasattr(value, "execute") else value
+
+
+class _TimedAuth:
+    """Wraps the Supabase auth client; each method call is one round trip"""
+
+    __slots__ = ("_auth",)
+
+    def __init__(self, auth):
+        self._auth = auth
+
+    def __getattr__(self, name):
+        attr = getattr(self._auth, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            with timed("auth"):
+                return attr(*args, **kwargs)
+        return call
+
+
+class TimedSupabaseClient:
+    """Supabase client proxy that records REST and auth round trips"""
+
+    __slots__ = ("_client",)
+
+    def __init__(self, client):
+        self._client = client
+
+    def table(self, *args, **kwargs):
+        return _wrap_builder(self._client.table(*args, **kwargs))
+
+    def from_(self, *args, **kwargs):
+        return _wrap_builder(self._client.from_(*args, **kwargs))
+
+    def rpc(self, *args, **kwargs):
+        return _wrap_builder(self._client.rpc(*args, **kwargs))
+
+    @property
+    def auth(self):
+        return _TimedAuth(self._client.auth)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
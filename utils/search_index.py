@@ -0,0 +1,226 @@
+# backend/utils/search_index.py
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from config import BASE_DIR
+
+logger = logging.getLogger(__name__)
+
+# Precomputed verse embeddings (see scripts/build_verse_embeddings.py). Without
+# them hybrid search degrades to lexical-only rather than embedding 31k verses inline.
+VERSE_EMBEDDINGS_PATH = os.getenv("VERSE_EMBEDDINGS_PATH", os.path.join(BASE_DIR, "verse_embeddings.npz"))
+
+# Build the index in a background thread at startup instead of on the first search request
+SEARCH_INDEX_WARMUP = os.getenv("SEARCH_INDEX_WARMUP", "true").lower() in ("1", "true", "yes")
+
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Reciprocal rank fusion constant; 60 is the value from the original RRF paper
+RRF_K = 60
+# How deep each ranker's list goes before fusion
+CANDIDATES_PER_RANKER = 100
+
+_TOKEN_RE = re.compile(r"[a-z0-9']+")
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "from", "he", "her", "his",
+    "i", "in", "is", "it", "me", "my", "not", "of", "on", "or", "shall", "she", "that", "the",
+    "thee", "their", "them", "they", "this", "thou", "thy", "to", "unto", "was", "we", "were",
+    "which", "with", "ye", "you",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in _TOKEN_RE.findall((text or "").lower()) if token not in _STOPWORDS]
+
+
+def load_verse_corpus(page_size: int = 1000) -> List[Dict[str, Any]]:
+    """Load every verse from Supabase, paging past the PostgREST row limit"""
+    from database import get_db
+
+    verses = []
+    with get_db(read_only=True) as client:
+        start = 0
+        while True:
+            response = client.table('bible_verses') \
+                .select('id, book_name, chapter, verse, text') \
+                .order('id') \
+                .range(start, start + page_size - 1) \
+                .execute()
+            verses.extend(response.data)
+            if len(response.data) < page_size:
+                break
+            start += page_size
+    return verses
+
+
+class HybridSearchIndex:
+    """In-memory BM25 and embedding indexes over the Bible text, fused with RRF.
+
+    Both rankers are scored with numpy over the whole corpus, so a query
+    costs a few milliseconds plus one embedding of the query text.
+    """
+
+    def __init__(self, verses: List[Dict[str, Any]], embeddings: Optional[np.ndarray] = None):
+        self.verses = verses
+        self._build_lexical()
+        self.embeddings = embeddings
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="hybrid-search")
+
+    def _build_lexical(self):
+        postings = defaultdict(list)
+        doc_lengths = np.zeros(len(self.verses), dtype=np.float32)
+        for doc_id, verse in enumerate(self.verses):
+            tokens = tokenize(verse['text'])
+            doc_lengths[doc_id] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                postings[term].append((doc_id, tf))
+
+        doc_count = len(self.verses)
+        avg_length = float(doc_lengths.mean()) if doc_count else 0.0
+        # Per-document BM25 length normalisation, computed once
+        length_norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths / max(avg_length, 1e-9))
+
+        self._postings = {}
+        for term, entries in postings.items():
+            doc_ids = np.fromiter((d for d, _ in entries), dtype=np.int32, count=len(entries))
+            tfs = np.fromiter((t for _, t in entries), dtype=np.float32, count=len(entries))
+            df = len(entries)
+            idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+            weights = idf * tfs * (BM25_K1 + 1) / (tfs + length_norm[doc_ids])
+            self._postings[term] = (doc_ids, weights.astype(np.float32))
+
+    @staticmethod
+    def _top(scores: np.ndarray, limit: int) -> List[int]:
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-scores[candidates], limit)[:limit]]
+        return candidates[np.argsort(-scores[candidates], kind="stable")].tolist()
+
+    def lexical_ranking(self, query: str, limit: int = CANDIDATES_PER_RANKER) -> List[int]:
+        scores = np.zeros(len(self.verses), dtype=np.float32)
+        for term in set(tokenize(query)):
+            entry = self._postings.get(term)
+            if entry is not None:
+                doc_ids, weights = entry
+                scores[doc_ids] += weights
+        return self._top(scores, limit)
+
+    def semantic_ranking(self, query: str, limit: int = CANDIDATES_PER_RANKER) -> List[int]:
+        if self.embeddings is None:
+            return []
+        try:
+            from utils.rag import pin_embedding_model
+        except ImportError as e:
+            logger.warning(f"Embedding stack unavailable ({e}); hybrid search will be lexical-only")
+            self.embeddings = None
+            return []
+
+        model = pin_embedding_model()
+        if model is None:
+            return []
+        query_vector = model.encode([query], convert_to_numpy=True, normalize_embeddings=True)[0]
+        scores = self.embeddings @ query_vector.astype(np.float32)
+        # Cosine similarity can be negative; shift so _top keeps every candidate
+        return self._top(scores + 1.0, limit)
+
+    def search(self, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """Run both rankers concurrently and fuse them with reciprocal rank fusion"""
+        lexical_future = self._executor.submit(self.lexical_ranking, query)
+        semantic_future = self._executor.submit(self.semantic_ranking, query)
+        lexical = lexical_future.result()
+        try:
+            semantic = semantic_future.result()
+        except Exception as e:
+            logger.warning(f"Semantic ranking failed, using lexical results only: {e}")
+            semantic = []
+
+        fused = defaultdict(float)
+        lexical_rank = {}
+        semantic_rank = {}
+        for rank, doc_id in enumerate(lexical, 1):
+            fused[doc_id] += 1.0 / (RRF_K + rank)
+            lexical_rank[doc_id] = rank
+        for rank, doc_id in enumerate(semantic, 1):
+            fused[doc_id] += 1.0 / (RRF_K + rank)
+            semantic_rank[doc_id] = rank
+
+        ranked = sorted(fused.items(), key=lambda item: -item[1])[:limit]
+        return [{
+            **self.verses[doc_id],
+            "score": round(score, 6),
+            "lexical_rank": lexical_rank.get(doc_id),
+            "semantic_rank": semantic_rank.get(doc_id),
+        } for doc_id, score in ranked]
+
+
+def load_verse_embeddings(verses: List[Dict[str, Any]], path: str = VERSE_EMBEDDINGS_PATH) -> Optional[np.ndarray]:
+    """Load stored embeddings and align them with the corpus order; None if unavailable"""
+    if not os.path.exists(path):
+        logger.warning(f"No verse embeddings at {path}; hybrid search will be lexical-only")
+        return None
+    stored = np.load(path, allow_pickle=False)
+    row_by_id = {verse_id: row for row, verse_id in enumerate(stored["ids"].tolist())}
+    missing = [v['id'] for v in verses if v['id'] not in row_by_id]
+    if missing:
+        logger.warning(f"{len(missing)} verses have no stored embedding; rebuild {path}. Semantic ranking disabled.")
+        return None
+    vectors = stored["vectors"][[row_by_id[v['id']] for v in verses]].astype(np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    return vectors
+
+
+def build_verse_embeddings(
+    path: str = VERSE_EMBEDDINGS_PATH,
+    verses: Optional[List[Dict[str, Any]]] = None,
+    processes: int = 1
+) -> int:
+    """Embed every verse and store the vectors with their ids. Returns the number of verses."""
+    from utils.rag import get_embeddings
+
+    verses = verses if verses is not None else load_verse_corpus()
+    embeddings = get_embeddings([v['text'] for v in verses], processes=processes)
+    if embeddings is None:
+        raise RuntimeError("Embedding model unavailable")
+    np.savez(path, ids=np.array([v['id'] for v in verses]), vectors=np.vstack(embeddings).astype(np.float32))
+    return len(verses)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_search_index() -> HybridSearchIndex:
+    """Build the index on first use; later calls return the same instance"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                started = time.time()
+                verses = load_verse_corpus()
+                _index = HybridSearchIndex(verses, load_verse_embeddings(verses))
+                logger.info(f"Built hybrid search index over {len(verses)} verses in {time.time() - started:.2f}s")
+    return _index
+
+
+def warm_search_index():
+    """Start building the index in the background so no request waits for the corpus load"""
+    if not SEARCH_INDEX_WARMUP:
+        return
+
+    def build():
+        try:
+            get_search_index()
+        except Exception as e:
+            logger.warning(f"Search index warm-up failed; it will be built on first use: {e}")
+
+    threading.Thread(target=build, name="search-index-warmup", daemon=True).start()
@@ -0,0 +1,245 @@
+# backend/utils/singleflight.py
+import asyncio
+import copy
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Shared directory for coalescing across gunicorn workers (e.g. /dev/shm/singleflight).
+# Leave unset to coalesce within a single worker only.
+SINGLEFLIGHT_DIR = os.getenv("SINGLEFLIGHT_DIR")
+# How long a finished result is reused by workers that arrive just after the leader
+SINGLEFLIGHT_RESULT_TTL = float(os.getenv("SINGLEFLIGHT_RESULT_TTL", 10))
+# How often a worker clears expired results and abandoned lock files out of SINGLEFLIGHT_DIR
+SINGLEFLIGHT_SWEEP_INTERVAL = float(os.getenv("SINGLEFLIGHT_SWEEP_INTERVAL", 300))
+
+
+def request_key(*parts: Any) -> str:
+    """Hash the parts of a normalized request into a coalescing key"""
+    payload = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def normalize_text(text: str) -> str:
+    """Case- and whitespace-insensitive form of free-text input"""
+    return " ".join((text or "").lower().split())
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent identical calls within one process.
+
+    The first caller for a key runs the function; callers that arrive while
+    it is in flight block until it finishes and receive a copy of its result
+    (or its exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            if call.waiters:
+                logger.info(f"Coalesced {call.waiters} identical request(s) onto one upstream call")
+            call.done.set()
+
+
+class FileSingleFlight:
+    """Coalesces identical calls across worker processes with a lock file per key.
+
+    The leader holds an exclusive flock while it runs the function, writes
+    the result next to the lock and unlinks the lock before releasing it.
+    Workers blocked on the lock notice it was unlinked, take a fresh one and
+    read that result instead of repeating the call, as long as it is younger
+    than `result_ttl`. Results must be JSON-serializable. Expired results and
+    abandoned files are swept every `sweep_interval` seconds.
+    """
+
+    # Lock files older than this belong to a worker that died mid-call
+    STALE_LOCK_SECONDS = 3600
+
+    def __init__(self, directory: str, result_ttl: float = SINGLEFLIGHT_RESULT_TTL,
+                 sweep_interval: float = SINGLEFLIGHT_SWEEP_INTERVAL):
+        self.directory = directory
+        self.result_ttl = result_ttl
+        self.sweep_interval = sweep_interval
+        self._next_sweep = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def _read_fresh(self, path: str):
+        try:
+            if time.time() - os.path.getmtime(path) > self.result_ttl:
+                os.remove(path)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, path: str, result: Any):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(result, f)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Could not share singleflight result: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _acquire(self, lock_path: str):
+        """Open and flock the key's lock file, retrying if it was unlinked while we waited"""
+        while True:
+            lock_file = open(lock_path, "a")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if os.fstat(lock_file.fileno()).st_ino == os.stat(lock_path).st_ino:
+                    return lock_file
+            except FileNotFoundError:
+                pass
+            lock_file.close()
+
+    def _sweep(self):
+        """Remove expired results, leftover temp files and locks abandoned by dead workers"""
+        now = time.time()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.sweep_interval
+        max_age = {".json": self.result_ttl, ".tmp": self.STALE_LOCK_SECONDS, ".lock": self.STALE_LOCK_SECONDS}
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    limit = max_age.get(os.path.splitext(entry.name)[1])
+                    if limit is not None and now - entry.stat().st_mtime > limit:
+                        os.remove(entry.path)
+        except OSError as e:
+            logger.debug(f"Singleflight sweep of {self.directory} incomplete: {e}")
+
+    def do(self, key: str, fn: Callable[[], Any], cacheable: Optional[Callable[[Any], bool]] = None) -> Any:
+        self._sweep()
+        lock_path = os.path.join(self.directory, f"{key}.lock")
+        result_path = os.path.join(self.directory, f"{key}.json")
+        lock_file = self._acquire(lock_path)
+        try:
+            shared = self._read_fresh(result_path)
+            if shared is not None:
+                return shared
+            result = fn()
+            if cacheable is None or cacheable(result):
+                self._write(result_path, result)
+            return result
+        finally:
+            # Unlink while still holding the lock; waiters see the inode change and re-acquire
+            try:
+                os.remove(lock_path)
+            except FileNotFoundError:
+                pass
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+
+class _AsyncCall:
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines sharing one event loop.
+
+    The shared call runs in its own task and every caller, the first one
+    included, awaits it through asyncio.shield. A cancelled caller (e.g. its
+    client disconnected) only stops waiting; the call itself is cancelled
+    once no caller is left waiting for it.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    def _forget(self, key: str, call: _AsyncCall):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        leader = call is None
+        if leader:
+            call = self._calls[key] = _AsyncCall(asyncio.ensure_future(fn()))
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+
+        call.waiters += 1
+        try:
+            result = await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if not call.waiters and not call.task.done():
+                # Every caller has gone away; nobody needs the result
+                call.task.cancel()
+        if leader:
+            return result
+        return copy.deepcopy(result)
+
+
+_in_process = SingleFlight()
+_in_loop = AsyncSingleFlight()
+_cross_worker = FileSingleFlight(SINGLEFLIGHT_DIR) if SINGLEFLIGHT_DIR else None
+
+
+def coalesce(key: str, fn: Callable[[], Any], cacheable: Optional[Callable[[Any], bool]] = None) -> Any:
+    """Run fn once for all concurrent callers with the same key.
+
+    Threads in this worker are coalesced in memory; when SINGLEFLIGHT_DIR is
+    set the in-process leader also coordinates with other workers through
+    the lock directory. `cacheable` decides whether a result may be handed
+    to workers that arrive after it finished (errors usually should not).
+    """
+    if _cross_worker is None:
+        return _in_process.do(key, fn)
+    return _in_process.do(key, lambda: _cross_worker.do(key, fn, cacheable))
+
+
+async def coalesce_async(key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+    """coalesce() for the ASGI app: one upstream call per key across the event loop.
+
+    The async app runs as a single process, so there is no cross-worker layer.
+    """
+    return await _in_loop.do(key, fn)
@@ -0,0 +1,75 @@
+# backend/utils/user_cache.py
+import logging
+import os
+import re
+from typing import Any, Dict, Optional
+
+from database import get_db
+from utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 2048))
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 300))
+
+# Per-worker cache of `users` rows by id, plus an email -> id index for friend lookups
+_profiles_by_id = TTLCache('user_profiles', maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+_ids_by_email = TTLCache('user_emails', maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+
+def _email_key(email: str) -> str:
+    return email.strip().lower()
+
+
+def _ilike_literal(value: str) -> str:
+    """Escape LIKE wildcards so an ilike filter matches `value` literally"""
+    return re.sub(r'([\\%_])', r'\\\1', value)
+
+
+def store_user_profile(profile: Dict[str, Any]):
+    """Write a freshly read or written `users` row into the cache"""
+    _profiles_by_id.set(str(profile['id']), profile)
+    if profile.get('email'):
+        _ids_by_email.set(_email_key(profile['email']), str(profile['id']))
+
+
+def invalidate_user_profile(user_id: str, email: Optional[str] = None):
+    """Drop a user from the cache; call after any write to their row"""
+    cached = _profiles_by_id.pop(str(user_id))
+    for address in {email, cached.get('email') if cached else None}:
+        if address:
+            _ids_by_email.delete(_email_key(address))
+
+
+def get_user_profile(user_id: str) -> Optional[Dict[str, Any]]:
+    """Return the `users` row for an id, or None if there is no such user"""
+    profile = _profiles_by_id.get(str(user_id))
+    if profile is not None:
+        return profile
+
+    with get_db() as client:
+        response = client.table('users').select('*').eq('id', user_id).execute()
+    profile = response.data[0] if response.data else None
+    if profile:
+        store_user_profile(profile)
+    return profile
+
+
+def get_user_by_email(email: str) -> Optional[Dict[str, Any]]:
+    """Return the `users` row for an email address, or None"""
+    key = _email_key(email)
+    user_id = _ids_by_email.get(key)
+    if user_id is not None:
+        profile = _profiles_by_id.get(user_id)
+        if profile is not None:
+            return profile
+
+    # Match the address case-insensitively, as the cache key does. PostgREST also treats
+    # `*` as a wildcard, so the rows are checked against the key before one is used.
+    with get_db() as client:
+        response = client.table('users').select('*').ilike('email', _ilike_literal(key)).execute()
+    profile = next((row for row in response.data or [] if _email_key(row.get('email') or '') == key), None)
+    if profile:
+        store_user_profile(profile)
+    return profile
+
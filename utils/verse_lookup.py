@@ -0,0 +1,60 @@
+# backend/utils/verse_lookup.py
+"""Verse text for server-side bookmark previews.
+
+Bible text never changes, so whole chapters are cached per worker: one DAL
+read fills every verse of a chapter, and resolving previews for a list of
+bookmarks costs one read per distinct uncached chapter rather than one per
+bookmark. Concurrent misses on the same chapter share a single read.
+"""
+import os
+from typing import Dict, Iterable, Optional, Tuple
+
+from utils import dal
+from utils.cache import TTLCache
+from utils.singleflight import SingleFlight
+
+VERSE_CACHE_CHAPTERS = int(os.getenv('VERSE_CACHE_CHAPTERS', 512))
+VERSE_CACHE_TTL = int(os.getenv('VERSE_CACHE_TTL', 86400))
+# Width of bookmarks.text_preview
+PREVIEW_MAX_LENGTH = 255
+
+_chapters = TTLCache('verse_chapters', maxsize=VERSE_CACHE_CHAPTERS, ttl=VERSE_CACHE_TTL)
+_chapter_loads = SingleFlight()
+
+VerseRef = Tuple[str, int, int]
+
+
+def _load_chapter(book: str, chapter: int) -> Dict[int, str]:
+    return {row['verse']: row['text'] for row in dal.verses_by_chapter(book, chapter)}
+
+
+def chapter_text(book: str, chapter: int) -> Dict[int, str]:
+    """Verse number -> text for one chapter; empty if the chapter does not exist"""
+    key = (book, int(chapter))
+    verses = _chapters.get(key)
+    if verses is None:
+        verses = _chapter_loads.do(f"{book}:{int(chapter)}", lambda: _load_chapter(book, int(chapter)))
+        _chapters.set(key, verses)
+    return verses
+
+
+def truncate_preview(text: Optional[str]) -> Optional[str]:
+    """Fit verse text into the text_preview column, marking a cut with an ellipsis"""
+    if text is None or len(text) <= PREVIEW_MAX_LENGTH:
+        return text
+    return text[:PREVIEW_MAX_LENGTH - 1].rstrip() + "…"
+
+
+def verse_preview(book: str, chapter: int, verse: int) -> Optional[str]:
+    """Preview text for one verse, or None if there is no such verse"""
+    return truncate_preview(chapter_text(book, chapter).get(int(verse)))
+
+
+def verse_previews(refs: Iterable[VerseRef]) -> Dict[VerseRef, Optional[str]]:
+    """Previews for many verses, reading each distinct chapter at most once"""
+    chapters, previews = {}, {}
+    for book, chapter, verse in refs:
+        if (book, chapter) not in chapters:
+            chapters[(book, chapter)] = chapter_text(book, chapter)
+        previews[(book, chapter, verse)] = truncate_preview(chapters[(book, chapter)].get(int(verse)))
+    return previews